@@ -1,7 +1,66 @@
-import random
-from interactions import distance_squared
-from cell import Cell
-from particle import Particle
+import numpy as np
+
+from particle import COLOR_INDEX, color_flags
+
+
+def decide_all(cells: list, particles, particle_pairs, cell_pairs):
+    """Movement for a whole population at once, returns an (n, 2) array of velocities.
+
+    particle_pairs and cell_pairs are the candidate pairs inside each cell's detection
+    neighbourhood, as SpatialHash.particle_pairs(cells) and cell_pairs(cells) return them.
+    """
+    num_cells = len(cells)
+    if num_cells == 0:
+        return np.empty((0, 2))
+
+    positions = np.array([cell.position for cell in cells], np.float64)
+    velocities = np.array([cell.body.velocity for cell in cells], np.float64)
+    speeds = np.array([cell.genome.speed for cell in cells], np.float64)
+    sizes = np.array([cell.genome.size for cell in cells], np.float64)
+    colors = np.array([COLOR_INDEX[cell.color] for cell in cells], np.int64)
+    edible = color_flags([cell.genome.p_consumption for cell in cells])
+    behavior = np.array([cell.genome.behavior for cell in cells], np.float64)
+
+    # Find closest particle, preferring matching colors and ignoring what can't be eaten
+    pair_cells, pair_particles, pair_dist = particle_pairs
+    particle_colors = particles.color[pair_particles]
+    matching = particle_colors == colors[pair_cells]
+    candidates = matching | edible[pair_cells, particle_colors]
+    pair_cells, pair_particles = pair_cells[candidates], pair_particles[candidates]
+    score = np.where(matching[candidates], pair_dist[candidates] * 0.5, pair_dist[candidates])
+
+    # each cell's lowest score, ties going to its earliest pair
+    best_score = np.full(num_cells, np.inf, score.dtype)
+    np.minimum.at(best_score, pair_cells, score)
+    tied = np.flatnonzero(score == best_score[pair_cells])
+    best = np.full(num_cells, len(score), np.int64)
+    np.minimum.at(best, pair_cells[tied], tied)
+    has_target = np.flatnonzero(best < len(score))
+    targets = pair_particles[best[has_target]]
+
+    # Move toward target particle, otherwise keep going
+    move = velocities.copy()
+    move[has_target, 0] = particles.x[targets] - positions[has_target, 0]
+    move[has_target, 1] = particles.y[targets] - positions[has_target, 1]
+
+    # Social force based on behavior toward other cells, weighted by inverse square distance
+    pair_cells, pair_others = cell_pairs
+    delta = positions[pair_others] - positions[pair_cells]
+    dist_sq = (delta ** 2).sum(axis=1)
+    near = (dist_sq != 0) & (dist_sq <= (sizes[pair_cells] * 10) ** 2)
+    pair_cells, pair_others, delta, dist_sq = pair_cells[near], pair_others[near], delta[near], dist_sq[near]
+
+    force_strength = behavior[pair_cells, colors[pair_others]] / dist_sq
+    force = delta / np.sqrt(dist_sq)[:, None] * force_strength[:, None]
+    move[:, 0] += np.bincount(pair_cells, weights=force[:, 0], minlength=num_cells)
+    move[:, 1] += np.bincount(pair_cells, weights=force[:, 1], minlength=num_cells)
+
+    # Normalize and scale by speed
+    magnitude = np.hypot(move[:, 0], move[:, 1])
+    moving = magnitude > 0
+    move[moving] /= magnitude[moving, None]
+    return move * speeds[:, None]
+
 
 # input cell and parameters, and output movement
 class CellAI:
@@ -23,88 +82,3 @@ class CellAI:
             preference = self.b
 
         return preference
-
-    def decide(self, cell: Cell, objects: list):
-        target_particle = None
-        distance_particle = {}
-        distances = []
-        particles = []
-        other_cells = []
-
-        for item in objects:
-            if isinstance(item, Particle):
-                particles.append(item)
-            elif isinstance(item, Cell):
-                other_cells.append(item)
-
-        # Evaluate particles
-        for particle in particles:
-            # Prefer particles of matching color (based on RGB channel matching)
-            if particle.color == cell.color:
-                dist = distance_squared(cell, particle)* 0.5
-            elif not cell.genome.p_consumption[particle.color]:
-                # ignore this particle
-                continue
-            else:
-                dist = distance_squared(cell, particle)
-
-            distance_particle[dist] = particle
-            distances.append(dist)
-
-        # Social force based on behavior toward other cells
-        social_force_x, social_force_y = 0, 0
-        for other in other_cells:
-            if other == cell:
-                continue
-
-            dx = other.position[0] - cell.position[0]
-            dy = other.position[1] - cell.position[1]
-            dist_sq = dx ** 2 + dy ** 2
-
-            if dist_sq == 0 or dist_sq > (cell.genome.size * 10) ** 2:
-                continue  # Ignore far away cells
-
-            dist = dist_sq ** 0.5
-            direction_x = dx / dist
-            direction_y = dy / dist
-
-            # Get behavior force (positive = attraction, negative = repulsion)
-            behavior_force = cell.genome.behavior.get(other.color, 0)
-
-            # Weight by inverse distance for smoother force curve
-            force_strength = behavior_force / dist_sq
-
-            social_force_x += direction_x * force_strength
-            social_force_y += direction_y * force_strength
-
-        # Find closest matching particle
-        if distances:
-            min_dist = min(distances)
-            target_particle = distance_particle[min_dist]
-
-        # Initialize movement vector
-        move_x, move_y = 0, 0
-
-        # Move toward target particle
-        if target_particle:
-            move_x += (target_particle.position[0] - cell.position[0])
-            move_y += (target_particle.position[1] - cell.position[1])
-        else:
-            move_x, move_y = cell.body.velocity
-
-        # Add social interaction forces (scaled by caution)
-        move_x += social_force_x
-        move_y += social_force_y
-
-        # Normalize
-        magnitude = (move_x ** 2 + move_y ** 2) ** 0.5
-        if magnitude > 0:
-            move_x /= magnitude
-            move_y /= magnitude
-
-        # Scale by speed
-        move_x *= cell.genome.speed
-        move_y *= cell.genome.speed
-
-        return move_x, move_y
-
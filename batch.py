@@ -0,0 +1,161 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from game import Game
+
+
+# settings a sweep specification may give, with the values used when it doesn't
+DEFAULT_SPEC = {
+    'ticks': 3600,
+    'dt': 1 / 60,
+    'chunks': [1, 1],
+    'cells': 50,
+    'player': True,
+    'seed': 0,
+    'repeats': 1,
+    # Genome() keyword -> list of values to sweep
+    'genome': {},
+    # list of (first, second, third) palette parts to sweep
+    'particle_mix': [[50, 35, 15]],
+}
+
+
+def expand_sweep(spec: dict):
+    """Every run of a sweep specification, the cartesian product of its genome values and particle mixes."""
+    spec = {**DEFAULT_SPEC, **spec}
+    names = sorted(spec['genome'])
+    runs = []
+    for values in itertools.product(*(spec['genome'][name] for name in names)):
+        for mix in spec['particle_mix']:
+            for repeat in range(spec['repeats']):
+                run = {
+                    'genome': dict(zip(names, values)),
+                    'particle_mix': list(mix),
+                    'seed': spec['seed'] + repeat,
+                    'ticks': spec['ticks'],
+                    'dt': spec['dt'],
+                    'chunks': list(spec['chunks']),
+                    'cells': spec['cells'],
+                    'player': spec['player'],
+                }
+                run['run_id'] = run_id(run)
+                runs.append(run)
+    return runs
+
+
+def run_id(run: dict):
+    # stable across sweeps, the same settings always get the same id
+    settings = {key: value for key, value in run.items() if key != 'run_id'}
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def simulate(run: dict):
+    """Run one headless world to extinction or run['ticks'], returns its result record."""
+    start = time.perf_counter()
+    game = Game(headless=True, num_chunks=tuple(run['chunks']), spawn_player=run['player'],
+                genome_defaults=run['genome'], particle_mix=run['particle_mix'], seed=run['seed'])
+    try:
+        for _ in range(run['cells']):
+            game.spawn_cell((game.rng.spawn.uniform(0, game.world_width), game.rng.spawn.uniform(0, game.world_height)))
+
+        peak_population = len(game.cells)
+        max_generation = 0
+        ticks = 0
+        while ticks < run['ticks'] and game.cells:
+            game.step(1, run['dt'])
+            ticks += 1
+            peak_population = max(peak_population, len(game.cells))
+            for cell in game.cells:
+                max_generation = max(max_generation, cell.generation)
+
+        # food in dormant and evicted chunks and collapsed buckets is still part of the world
+        dormant_mass = sum(int(chunk.counts.sum()) for chunk in game.chunks.values() if chunk.key not in game.chunk_manager.active)
+        dormant_mass += int(game.chunk_manager.collapsed_mass.sum())
+        particles = game.particles
+        alive = particles.alive[:particles.count]
+        return {
+            'run_id': run['run_id'],
+            'genome': run['genome'],
+            'particle_mix': run['particle_mix'],
+            'seed': run['seed'],
+            'ticks': ticks,
+            'survival_time': ticks * run['dt'],
+            'extinct': not game.cells,
+            'peak_population': peak_population,
+            'final_population': len(game.cells),
+            'max_generation': max_generation,
+            'cell_mass': sum(cell.mass for cell in game.cells),
+            'particle_mass': int(particles.mass[:particles.count][alive].sum()) + dormant_mass,
+            'wall_time': time.perf_counter() - start,
+        }
+    finally:
+        game.chunk_manager.close()
+
+
+def completed_runs(path: str):
+    """Ids of the runs already in a results file. Unreadable lines from an interrupted write are ignored."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    with open(path) as results:
+        for line in results:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if 'error' not in record:
+                done.add(record['run_id'])
+    return done
+
+
+def run_sweep(spec: dict, path: str, workers: int = None):
+    """Run every run of spec not yet in the results file at path, appending one JSON line per finished run."""
+    runs = expand_sweep(spec)
+    done = completed_runs(path)
+    pending = [run for run in runs if run['run_id'] not in done]
+    print(f"{len(runs)} runs, {len(runs) - len(pending)} already done, {len(pending)} to go")
+    if not pending:
+        return
+
+    with open(path, 'a+') as results:
+        # start on a fresh line if the last write was cut short
+        if results.tell() > 0:
+            results.seek(results.tell() - 1)
+            if results.read(1) != '\n':
+                results.write('\n')
+
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = {pool.submit(simulate, run): run for run in pending}
+            try:
+                for finished, future in enumerate(as_completed(futures), 1):
+                    run = futures[future]
+                    try:
+                        record = future.result()
+                    except Exception as error:
+                        # failed runs are recorded but tried again on the next resume
+                        record = {'run_id': run['run_id'], 'genome': run['genome'], 'particle_mix': run['particle_mix'],
+                                  'seed': run['seed'], 'error': repr(error)}
+                    results.write(json.dumps(record) + '\n')
+                    results.flush()
+                    print(f"[{finished}/{len(pending)}] {run['run_id']} {run['genome']} mix {run['particle_mix']}")
+            except KeyboardInterrupt:
+                pool.shutdown(wait=False, cancel_futures=True)
+                print("interrupted, run again with the same arguments to resume")
+                raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run a parameter sweep of headless worlds in a process pool")
+    parser.add_argument("spec", help="JSON sweep specification, see DEFAULT_SPEC")
+    parser.add_argument("--out", default="results.jsonl", help="results file, appended to and resumed from")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, every core by default")
+    args = parser.parse_args()
+
+    with open(args.spec) as spec_file:
+        run_sweep(json.load(spec_file), args.out, args.workers)
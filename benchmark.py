@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import pygame
+import pymunk
+
+from game import Game
+
+# phases in the order a tick runs them, update() sub-phases first
+PHASES = ('cell_update', 'neighbours', 'consumption', 'contacts', 'aging', 'split', 'ai', 'removal', 'streaming', 'update_grid',
+          'space_step', 'render')
+
+BASE_SCENARIO = {
+    'cells': 100,
+    'density': 24,
+    'grid_size': 120,
+    'detection_radius': 1,
+    'player': True,
+    'chunks': [2, 2],
+    'seed': 0,
+}
+
+
+def default_scenarios():
+    """The base scenario varied along one axis at a time."""
+    scenarios = []
+    for cells in (10, 100, 1000, 5000):
+        scenarios.append({'cells': cells})
+    for density in (8, 64):
+        scenarios.append({'density': density})
+    for grid_size, detection_radius in ((120, 2), (60, 2), (240, 1)):
+        scenarios.append({'grid_size': grid_size, 'detection_radius': detection_radius})
+    scenarios.append({'player': False})
+    scenarios.append({'cells': 1000, 'player': False})
+
+    scenarios = [{**BASE_SCENARIO, **scenario} for scenario in scenarios]
+    for scenario in scenarios:
+        scenario['name'] = scenario_name(scenario)
+    return scenarios
+
+
+def scenario_name(scenario):
+    return (f"cells{scenario['cells']}_density{scenario['density']}_grid{scenario['grid_size']}"
+            f"_radius{scenario['detection_radius']}_{'player' if scenario['player'] else 'noplayer'}")
+
+
+def build(scenario, render: bool):
+    """A deterministic world for the scenario, cells spread uniformly over it."""
+    game = Game(headless=not render, num_chunks=tuple(scenario['chunks']), grid_size=scenario['grid_size'],
+                particle_density=scenario['density'], genome_defaults={'detection_radius': scenario['detection_radius']},
+                seed=scenario['seed'], autopilot=True)
+    if not scenario['player']:
+        # dies on the first tick, like a player who ran out of age
+        game.player.age = game.player.genome.max_age
+
+    for _ in range(scenario['cells']):
+        game.spawn_cell((game.rng.spawn.uniform(0, game.world_width), game.rng.spawn.uniform(0, game.world_height)))
+    game.update_grid()
+    game.stream_chunks()
+    return game
+
+
+def tick(game, dt: float, render: bool):
+    # one frame of run_game_loop without the frame cap or input
+    game.update(dt)
+    if render:
+        if game.player in game.cells:
+            game.update_camera()
+        game.render()
+    game.step_space(dt)
+    game.profiler.lap('space_step')
+    game.profiler.end_frame()
+
+
+def run_scenario(scenario, ticks: int, warmup: int, dt: float, render: bool):
+    game = build(scenario, render)
+    try:
+        for _ in range(warmup):
+            tick(game, dt, render)
+
+        cells_start = len(game.cells)
+        game.profiler.enabled = True
+        game.profiler.reset()
+        start = time.perf_counter()
+        for _ in range(ticks):
+            tick(game, dt, render)
+        elapsed = time.perf_counter() - start
+
+        phases = game.profiler.mean_ms()
+        return {
+            'name': scenario['name'],
+            'scenario': scenario,
+            'ticks': ticks,
+            'cells_start': cells_start,
+            'cells_end': len(game.cells),
+            'mean_cells': game.profiler.counters['cells'] / ticks,
+            'mean_particles': game.profiler.counters['particles'] / ticks,
+            'ms_per_tick': elapsed * 1000 / ticks,
+            'phases_ms': {phase: phases.get(phase, 0.0) for phase in PHASES},
+        }
+    finally:
+        game.chunk_manager.close()
+
+
+def environment():
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'pymunk': pymunk.version,
+    }
+
+
+def compare(results, baseline, tolerance: float):
+    """Phases that got slower than baseline by more than tolerance (a fraction), as printable lines."""
+    previous = {scenario['name']: scenario for scenario in baseline['scenarios']}
+    regressions = []
+    for scenario in results['scenarios']:
+        old = previous.get(scenario['name'])
+        if old is None:
+            continue
+        for phase, ms in list(scenario['phases_ms'].items()) + [('total', scenario['ms_per_tick'])]:
+            old_ms = old['ms_per_tick'] if phase == 'total' else old['phases_ms'].get(phase, 0.0)
+            # ignore noise in phases too short to measure
+            if old_ms > 0.05 and ms > old_ms * (1 + tolerance):
+                regressions.append(f"{scenario['name']} {phase}: {old_ms:.2f} -> {ms:.2f} ms")
+    return regressions
+
+
+def print_table(results):
+    header = f"{'scenario':<48} {'cells':>6} {'total':>8} " + " ".join(f"{phase[:9]:>9}" for phase in PHASES)
+    print(header)
+    for scenario in results['scenarios']:
+        phases = " ".join(f"{scenario['phases_ms'][phase]:9.2f}" for phase in PHASES)
+        print(f"{scenario['name']:<48} {scenario['mean_cells']:6.0f} {scenario['ms_per_tick']:8.2f} {phases}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time every tick phase over a set of deterministic scenarios")
+    parser.add_argument("--ticks", type=int, default=60, help="measured ticks per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="ticks run before measuring")
+    parser.add_argument("--dt", type=float, default=1 / 60)
+    parser.add_argument("--no-render", action="store_true", help="skip render(), no display needed")
+    parser.add_argument("--only", nargs="*", help="run only scenarios whose name contains one of these")
+    parser.add_argument("--out", default="benchmark.json", help="machine readable results")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before a phase is reported")
+    args = parser.parse_args()
+
+    render = not args.no_render
+    if render:
+        # render() draws into an offscreen display, no window is needed
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.init()
+
+    scenarios = default_scenarios()
+    if args.only:
+        scenarios = [scenario for scenario in scenarios if any(part in scenario['name'] for part in args.only)]
+
+    results = {'environment': environment(), 'ticks': args.ticks, 'warmup': args.warmup, 'dt': args.dt, 'render': render,
+               'scenarios': []}
+    for scenario in scenarios:
+        results['scenarios'].append(run_scenario(scenario, args.ticks, args.warmup, args.dt, render))
+        print(f"{scenario['name']}: {results['scenarios'][-1]['ms_per_tick']:.2f} ms/tick")
+
+    with open(args.out, 'w') as out:
+        json.dump(results, out, indent=2)
+    print_table(results)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for line in regressions:
+            print("slower:", line)
+        if regressions:
+            raise SystemExit(1)
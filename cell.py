@@ -1,29 +1,51 @@
 import pygame
 import pymunk
+import itertools
 import math
 
 from pygame.examples.scroll import zoom_factor
 
-from particle import Particle
+import numpy as np
+
+from particle import COLORS, COLOR_INDEX
+
 import random
-import copy
 
 from physics_particle import PhysicsParticle
 
+# every cell shape has this collision type, Game handles cell on cell contacts through it
+COLLISION_TYPE = 1
+
+# a split only adds its second child while there are fewer cells than this
+MAX_CELLS = 400
 
 class Cell(PhysicsParticle):
+    # every cell lifetime gets its own id, pooled Cell objects are reused (see CellPool)
+    ids = itertools.count()
+
     def __init__(self, position: tuple, chromosome: list, active_gene: int = 0, generation: int = 0, is_player: bool = False, has_split: bool = False):
+        self.body = None
+        self.shape = None
+        self.reset(position, chromosome, active_gene, generation, is_player, has_split)
+
+    def reset(self, position: tuple, chromosome: list, active_gene: int = 0, generation: int = 0, is_player: bool = False, has_split: bool = False):
+        """Make this a new cell, reusing the body and shape it already has if any."""
+        body, shape = self.body, self.shape
+        self.id = next(Cell.ids)
         self.chromosome = chromosome
+        self.active_gene = active_gene
         self.genome = chromosome[active_gene]
         self.size = self.genome.size
         density = self.size/self.genome.start_mass
-        super().__init__(self.genome.start_mass,self.genome.charge,density,position)
+        PhysicsParticle.__init__(self, self.genome.start_mass,self.genome.charge,density,position)
         self.age = 0
         self.is_player = is_player
         self.has_split = has_split
         self.dead = False
         self.generation = generation
         self.animation = 0
+        # the chromosome's genomes may be shared with relatives until this cell writes to its genome
+        self.owns_genome = False
 
         self.color = self.get_dominant_color()
 
@@ -35,17 +57,72 @@ class Cell(PhysicsParticle):
 
         # pymunk
         moment = pymunk.moment_for_circle(self.mass, 0, self.size)
-        self.create_body(moment)
-        self.create_circle(self.size)
-
-    # draw cell onto screen
-    def draw(self, perceived_color, surface, zoom_factor = 1.0, offset=(0, 0)):
-        x, y = self.body.position[0]*zoom_factor + offset[0], self.body.position[1]*zoom_factor + offset[1]
-        pygame.draw.circle(surface, perceived_color, (int(x), int(y)), self.size*zoom_factor, self.genome.thickness)
-        pygame.draw.circle(surface, perceived_color, (int(x) + self.animation*zoom_factor, int(y)), self.size*zoom_factor, self.genome.thickness)
-        pygame.draw.circle(surface, (0,0,0), (int(x), int(y)),  (self.size*0.99) * zoom_factor)
-        pygame.draw.circle(surface, (0,0,0), (int(x) + self.animation * zoom_factor, int(y)),
-                          (self.size*0.99) * zoom_factor)
+        if body is None:
+            self.create_body(moment)
+            self.create_circle(self.size)
+            self.set_collision_type(COLLISION_TYPE)
+            # collision handlers only see shapes
+            self.shape.cell = self
+        else:
+            self.body, self.shape = body, shape
+            self.reset_body(moment)
+            self.reset_circle(self.size)
+
+    # plain data describing the cell, enough to rebuild it in another space or process
+    def to_state(self):
+        return {
+            'position': tuple(self.body.position),
+            'velocity': tuple(self.body.velocity),
+            'chromosome': self.chromosome,
+            'active_gene': self.active_gene,
+            'generation': self.generation,
+            'is_player': self.is_player,
+            'has_split': self.has_split,
+            'age': self.age,
+            'mass': self.mass,
+            'animation': self.animation,
+            'color': self.color,
+            'dead': self.dead,
+        }
+
+    @classmethod
+    def from_state(cls, state, pool = None):
+        args = state['position'], state['chromosome'], state['active_gene'], state['generation'], state['is_player'], state['has_split']
+        cell = pool.acquire(*args) if pool else cls(*args)
+        cell.body.velocity = state['velocity']
+        cell.age = state['age']
+        cell.mass = state['mass']
+        cell.animation = state['animation']
+        cell.color = state['color']
+        cell.dead = state['dead']
+        return cell
+
+    @staticmethod
+    def sprite_key(size, thickness, animation, perceived_color, zoom_factor):
+        # the zoomed radii and animation offset exactly as drawn, cells of equal size and animation share a sprite
+        return size * zoom_factor, (size * 0.99) * zoom_factor, thickness, perceived_color, animation * zoom_factor
+
+    @staticmethod
+    def sprite_center(radius):
+        # where the first circle's center is in a sprite, on whole pixels so blits land where the circles would
+        return int(radius) + 2
+
+    @staticmethod
+    def render_sprite(radius, fill_radius, thickness, color, animation_offset):
+        """The cell's outline, split animation copy and black fills, on a transparent surface centered at sprite_center(radius)."""
+        center = Cell.sprite_center(radius)
+        sprite = pygame.Surface((2 * center + 1 + math.ceil(animation_offset), 2 * center + 1))
+        # anything but the outline color and the black fill can be the transparent key
+        key = (1, 1, 1) if color != (1, 1, 1) else (2, 2, 2)
+        sprite.fill(key)
+        pygame.draw.circle(sprite, color, (center, center), radius, thickness)
+        pygame.draw.circle(sprite, color, (center + animation_offset, center), radius, thickness)
+        pygame.draw.circle(sprite, (0,0,0), (center, center), fill_radius)
+        pygame.draw.circle(sprite, (0,0,0), (center + animation_offset, center), fill_radius)
+        if pygame.display.get_surface():
+            sprite = sprite.convert()
+        sprite.set_colorkey(key, pygame.RLEACCEL)
+        return sprite
 
     def draw_split_cell(self, screen):
         animate_split = 0
@@ -59,30 +136,45 @@ class Cell(PhysicsParticle):
         self.mass += mass
 
 
+    # copy the active genome before the first write, relatives may still share it
+    def own_genome(self):
+        if not self.owns_genome:
+            self.genome = self.genome.copy()
+            self.chromosome = list(self.chromosome)
+            self.chromosome[self.active_gene] = self.genome
+            self.owns_genome = True
+        return self.genome
+
     # change cell colour
     def calculate_colour(self,mass, r,g,b):
+        self.mix_colour(mass, r * mass, g * mass, b * mass)
+
+    # mix in colours already weighted by their masses (r_mass = sum of r * mass)
+    def mix_colour(self, mass, r_mass, g_mass, b_mass):
+        genome = self.own_genome()
+
         # get average of colours with respect to masses
-        self.genome.r = ((self.genome.r * self.mass) + (r * mass))//(self.mass + mass)
-        self.genome.g = ((self.genome.g * self.mass) + (g * mass))//(self.mass + mass)
-        self.genome.b = ((self.genome.b * self.mass) + (b * mass))//(self.mass + mass)
+        genome.r = ((genome.r * self.mass) + r_mass)//(self.mass + mass)
+        genome.g = ((genome.g * self.mass) + g_mass)//(self.mass + mass)
+        genome.b = ((genome.b * self.mass) + b_mass)//(self.mass + mass)
 
         # maintain brightness
-        rgb = [self.genome.r,self.genome.g,self.genome.b]
+        rgb = [genome.r,genome.g,genome.b]
         brightest = max(rgb)
-        self.genome.r = (self.genome.r * 255)// brightest
-        self.genome.g = (self.genome.g * 255)// brightest
-        self.genome.b = (self.genome.b * 255)// brightest
+        genome.r = (genome.r * 255)// brightest
+        genome.g = (genome.g * 255)// brightest
+        genome.b = (genome.b * 255)// brightest
 
 
         # if r,g,b become negative bind them to zero
-        if self.genome.r < 0:
-            self.genome.r = 0
+        if genome.r < 0:
+            genome.r = 0
 
-        if self.genome.g < 0:
-            self.genome.g = 0
+        if genome.g < 0:
+            genome.g = 0
 
-        if self.genome.b < 0:
-            self.genome.b = 0
+        if genome.b < 0:
+            genome.b = 0
 
     def get_dominant_color(self):
         max_val = max(self.genome.r, self.genome.g, self.genome.b)
@@ -94,13 +186,12 @@ class Cell(PhysicsParticle):
         else:
             return 'b'
 
-    def consume_particle(self,obj, consumed_particles):
-        if self.genome.p_consumption[obj.color]:
-            self.calculate_mass(obj.mass)
-            self.calculate_colour(obj.mass, obj.r, obj.g, obj.b)
-            if self.mass >= (self.genome.max_mass - 9):
-                self.animation += (self.size//4)
-            consumed_particles.append(obj)
+    # apply everything eaten this frame at once, see Game.consume_particles
+    def consume_particles(self, mass, r_mass, g_mass, b_mass, over_threshold):
+        self.calculate_mass(mass)
+        self.mix_colour(mass, r_mass, g_mass, b_mass)
+        # one animation step per particle eaten at or past the split threshold
+        self.animation += (self.size//4) * over_threshold
 
     def consume_cell(self, other, to_remove_cells):
         if (self.size > (other.size * 1.3)) and (other.genome.thickness == 1) and self.genome.c_consumption[other.color] and (other.age > 3):
@@ -117,32 +208,33 @@ class Cell(PhysicsParticle):
             to_remove_cells.add(other)'''
 
 
-    def split(self,cells, grid, grid_size, space):
+    # rng is the game's RandomStreams, the global random module is used without one
+    # with a CellPool the children reuse parked cells and the parent is released to it
+    def split(self,cells, spatial, grid_size, space, rng = None, pool = None, max_cells = MAX_CELLS, drop_food = None):
+        split_random = rng.split if rng else random
+        mutation_random = rng.mutation if rng else random
+
         grid_x = int(self.position[0]) // grid_size
         grid_y = int(self.position[1]) // grid_size
         x = grid_x * grid_size
         y = grid_y * grid_size
 
         if self.mass >= self.genome.max_mass:
+            # genomes that didn't mutate are shared with the parent, see own_genome
             new_chrome1 = []
             new_chrome2 = []
             for genome in self.chromosome:
-                new_genome1 = copy.deepcopy(genome)
-                new_genome2 = copy.deepcopy(genome)
-
-                new_genome1.mutate_gene()
-                new_genome2.mutate_gene()
+                new_chrome1.append(genome.mutated(mutation_random))
+                new_chrome2.append(genome.mutated(mutation_random))
 
-                new_chrome1.append(new_genome1)
-                new_chrome2.append(new_genome2)
-
-            active_gene1 = random.randint(0, len(new_chrome1)-1)
-            active_gene2 = random.randint(0, len(new_chrome2)-1)
+            active_gene1 = split_random.randint(0, len(new_chrome1)-1)
+            active_gene2 = split_random.randint(0, len(new_chrome2)-1)
             pos1 = self.body.position[0] - new_chrome1[active_gene1].size, self.body.position[1]
             pos2 = self.body.position[0] + new_chrome2[active_gene2].size, self.body.position[1]
 
-            new_cell1 = Cell(pos1,new_chrome1,active_gene1, self.generation + 1)
-            new_cell2 = Cell(pos2,new_chrome2,active_gene2, self.generation + 1)
+            new_cell = pool.acquire if pool else Cell
+            new_cell1 = new_cell(pos1,new_chrome1,active_gene1, self.generation + 1)
+            new_cell2 = new_cell(pos2,new_chrome2,active_gene2, self.generation + 1)
 
             new_mass = new_cell1.genome.start_mass + new_cell2.genome.start_mass
             '''# effort to maintain mass in the system (matter aint created nor destroyed)
@@ -162,21 +254,11 @@ class Cell(PhysicsParticle):
                 count = self.mass - new_mass
                 x_bounds = (x, x + grid_size - 1)
                 y_bounds = (y, y + grid_size - 1)
-                particles = []
-                for _ in range(count):
-                    x = random.randint(*x_bounds)
-                    y = random.randint(*y_bounds)
-
-                    color = random.randint(1, 100)
-                    if color <= 50:
-                        particle = Particle((x, y), 255, 0, 0)
-                    elif 50 < color <= 85:
-                        particle = Particle((x, y), 0, 255, 0)
-                    else:
-                        particle = Particle((x, y), 0, 0, 255)
-
-                    particles.append(particle)
-                grid[(grid_x, grid_y)].extend(particles)
+                if drop_food:
+                    # the game's create_particles, the 'd' palette is the one below
+                    drop_food(count, 'd', x_bounds, y_bounds)
+                else:
+                    spatial.particles.spawn(count, ((255, 0, 0), (0, 255, 0), (0, 0, 255)), x_bounds, y_bounds)
 
             '''print("\n")
             print("Old Cell Mass:", self.mass)
@@ -190,19 +272,24 @@ class Cell(PhysicsParticle):
                 new_cell1.is_player = True
 
             cells.remove(self)
+            spatial.remove(self)
+            if pool:
+                pool.release(self)
             cells.append(new_cell1)
+            spatial.insert(new_cell1)
             new_cell1.add_to_space(space)
-            new_cell1.set_collision_type(len(cells) - 1)
 
-            if len(cells) < 400:
+            if len(cells) < max_cells:
                 cells.append(new_cell2)
+                spatial.insert(new_cell2)
                 new_cell2.add_to_space(space)
-                new_cell2.set_collision_type(len(cells))
+            elif pool:
+                # no room for the second child, it only existed for its mass
+                pool.release(new_cell2)
 
-    def death(self,grid, grid_size):
-        grid_x = int(self.position[0] // grid_size)
-        grid_y = int(self.position[1] // grid_size)
-        particles = []
+    def death(self, particles, rng = random):
+        positions = []
+        colors = []
         '''if self.dead:
             print(f"[Warning] Tried to kill already-dead cell: {self}")
             return
@@ -216,28 +303,127 @@ class Cell(PhysicsParticle):
             particle_y = (self.body.position[1] + math.sin(theta)*self.size)
             # get new color value
 
-            color = random.randint(1, 3)
+            color = rng.randint(1, 3)
 
             if color == 1:
-                particle = Particle((particle_x, particle_y), 255, 0, 0)
+                colors.append((255, 0, 0))
                 self.calculate_colour(1, 0, 255, 255)
             elif color == 2:
-                particle = Particle((particle_x, particle_y), 0, 255, 0)
+                colors.append((0, 255, 0))
                 self.calculate_colour(1, 255, 0, 255)
             else:
-                particle = Particle((particle_x, particle_y), 0, 0, 255)
+                colors.append((0, 0, 255))
                 self.calculate_colour(1, 255, 255, 0)
 
-            particles.append(particle)
-        grid[(grid_x,grid_y)].extend(particles)
+            positions.append((particle_x, particle_y))
+        if positions:
+            positions = np.array(positions)
+            particles.add(positions[:, 0], positions[:, 1], colors)
+
+
+
+
+class CellPool:
+    """Cells taken out of the simulation, kept with their pymunk body and shape for reuse.
+
+    Splits and deaths churn through cells all the time, acquire() resets a parked cell
+    instead of allocating a new Body and Circle. A released cell leaves its space right
+    away but is only handed out again after recycle(), so references to it that live until
+    the end of the tick (the update loop, to_remove_cells) never see it come back as
+    another cell. Player cells are never parked, Game.player still points at a dead one.
+    """
+
+    def __init__(self):
+        self.free = []
+        self.released = {}
+        # for the profiler
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, position: tuple, chromosome: list, active_gene: int = 0, generation: int = 0, is_player: bool = False,
+                has_split: bool = False):
+        if self.free:
+            cell = self.free.pop()
+            cell.reset(position, chromosome, active_gene, generation, is_player, has_split)
+            self.reused += 1
+        else:
+            cell = Cell(position, chromosome, active_gene, generation, is_player, has_split)
+            self.created += 1
+        return cell
+
+    def release(self, cell):
+        """Take a cell out of its space, for reuse after the next recycle(). Releasing twice is fine."""
+        if cell.body.space is not None:
+            cell.remove_from_space(cell.body.space)
+        if not cell.is_player:
+            self.released[cell] = None
+
+    def recycle(self):
+        self.free.extend(self.released)
+        self.released.clear()
+
+
+class ColorFlags(int):
+    """Immutable r/g/b booleans packed into three bits, indexed by color like the dicts they replace."""
+    __slots__ = ()
+
+    def __new__(cls, flags=0):
+        if isinstance(flags, dict):
+            flags = sum(1 << COLOR_INDEX[color] for color, value in flags.items() if value)
+        return super().__new__(cls, flags)
+
+    def __getitem__(self, color):
+        return bool(self >> COLOR_INDEX[color] & 1)
+
+    def get(self, color, default=False):
+        return self[color] if color in COLOR_INDEX else default
+
+    def set(self, color, value):
+        bit = 1 << COLOR_INDEX[color]
+        return ColorFlags(self | bit if value else self & ~bit)
+
+    def __repr__(self):
+        return repr({color: self[color] for color in COLORS})
+
 
+class ColorWeights(tuple):
+    """Immutable per color floats, indexed by color like the dicts they replace."""
+    __slots__ = ()
 
+    def __new__(cls, weights=(0.0, 0.0, 0.0)):
+        if isinstance(weights, dict):
+            weights = [weights.get(color, 0.0) for color in COLORS]
+        return super().__new__(cls, weights)
+
+    def __getitem__(self, color):
+        return super().__getitem__(COLOR_INDEX[color] if isinstance(color, str) else color)
+
+    def get(self, color, default=0.0):
+        return self[color] if color in COLOR_INDEX else default
+
+    def set(self, color, value):
+        weights = list(self)
+        weights[COLOR_INDEX[color]] = value
+        return ColorWeights(weights)
+
+    def __repr__(self):
+        return repr(dict(zip(COLORS, self)))
+
+
+NO_COLORS = ColorFlags(0)
+ALL_COLORS = ColorFlags(0b111)
+NEUTRAL = ColorWeights()
 
 
 class Genome:
+    # only immutable values are stored, so genomes can be shared between relatives and copied shallowly
+    __slots__ = ('r', 'g', 'b', 'size', 'start_mass', 'max_mass', 'thickness', 'strength', 'speed', 'detection_radius',
+                 'max_age', 'charge', 'mutation_rate', 'exploding', 'multi_cell', 'behavior', 'p_consumption',
+                 'c_consumption', 'perception')
+
     def __init__(self, r: int = 255, g: int = 255, b: int = 255, size: int = 10, start_mass: int = 20, max_mass: int = 40,
-                 thickness: int = 1, strength: int = 1, speed: int = 50, perception = {"r": False, "g": False, "b": False}, detection_radius: int = 1, max_age: int = 30, charge: int = 0,
-                 mutation_rate: float = 0.1, exploding: bool = False, multi_cell: bool = False, behaviour = {'r': 0.0, 'g': 0.0, 'b': 0.0}, p_consumption = {'r': True, 'g': True, 'b': True}, c_consumption = {'r': True, 'g': True, 'b': True}
+                 thickness: int = 1, strength: int = 1, speed: int = 50, perception = NO_COLORS, detection_radius: int = 1, max_age: int = 30, charge: int = 0,
+                 mutation_rate: float = 0.1, exploding: bool = False, multi_cell: bool = False, behaviour = NEUTRAL, p_consumption = ALL_COLORS, c_consumption = ALL_COLORS
                 ):
 
         # Physical
@@ -257,160 +443,175 @@ class Genome:
         self.exploding = exploding
         self.multi_cell = multi_cell
 
-        # Behavioral
-        self.behavior = behaviour
-        self.p_consumption = p_consumption
-        self.c_consumption = c_consumption
-        self.perception = perception
+        # Behavioral (dicts are accepted and converted)
+        self.behavior = ColorWeights(behaviour)
+        self.p_consumption = ColorFlags(p_consumption)
+        self.c_consumption = ColorFlags(c_consumption)
+        self.perception = ColorFlags(perception)
+
+    def copy(self):
+        genome = Genome.__new__(Genome)
+        for name in Genome.__slots__:
+            setattr(genome, name, getattr(self, name))
+        return genome
+
+    def values(self):
+        return tuple(getattr(self, name) for name in Genome.__slots__)
+
+    def mutated(self, rng = random):
+        """This genome after mutate_gene, as a new genome only if anything actually changed."""
+        child = self.copy()
+        child.mutate_gene(rng)
+        return self if child.values() == self.values() else child
 
-    def mutate_gene(self):
+    def mutate_gene(self, rng = random):
         # expect at least one of rgb to be 255
         # defense: +size, +start_mass, +max_mass, +thickness, -speed +detection_radius, +max_age
         if self.r == 255:
 
             # behavioural
             # TODO: flocking
-            if random.random() < self.mutation_rate:
-                self.behavior['r'] = random.uniform(-1.0, 1.0)
+            if rng.random() < self.mutation_rate:
+                self.behavior = self.behavior.set('r', rng.uniform(-1.0, 1.0))
 
-            if random.random() < self.mutation_rate:
-                self.behavior['g'] = random.uniform(-1.0, 1.0)
+            if rng.random() < self.mutation_rate:
+                self.behavior = self.behavior.set('g', rng.uniform(-1.0, 1.0))
 
-            if random.random() < self.mutation_rate:
-                self.behavior['b'] = random.uniform(-1.0, 1.0)
+            if rng.random() < self.mutation_rate:
+                self.behavior = self.behavior.set('b', rng.uniform(-1.0, 1.0))
 
             # physical
             # buffs
             # faster movement speed
-            if random.random() < self.mutation_rate:
-                self.speed += random.randint(1,5)
+            if rng.random() < self.mutation_rate:
+                self.speed += rng.randint(1,5)
 
             # TODO: increased offspring
 
             # nerfs
             # smaller size
-            if random.random() < self.mutation_rate:
-                self.size -= random.randint(1,5)
+            if rng.random() < self.mutation_rate:
+                self.size -= rng.randint(1,5)
                 if self.size < 5:
                     self.size = 5
 
             # lose ability to consume red cells
-            if random.random() < self.mutation_rate:
-                self.c_consumption['r'] = False
+            if rng.random() < self.mutation_rate:
+                self.c_consumption = self.c_consumption.set('r', False)
 
             # lose ability to consume green cells
-            if random.random() < self.mutation_rate:
-                self.c_consumption['g'] = False
+            if rng.random() < self.mutation_rate:
+                self.c_consumption = self.c_consumption.set('g', False)
 
             # psychological
             # gain ability to see red
-            if random.random() < self.mutation_rate:
+            if rng.random() < self.mutation_rate:
                 if not (self.perception["b"] and self.perception["g"]):
-                    self.perception["r"] = True
+                    self.perception = self.perception.set('r', True)
 
             # lose ability to see blue
-            if random.random() < self.mutation_rate:
+            if rng.random() < self.mutation_rate:
                 if self.perception["b"]:
-                    self.perception["b"] = False
+                    self.perception = self.perception.set('b', False)
 
         # offense:
         elif self.g == 255:
             # behavioural
             # TODO: hunting behaviour
-            if random.random() < self.mutation_rate:
-                self.behavior['r'] += random.uniform(-1.0, 2.0)
+            if rng.random() < self.mutation_rate:
+                self.behavior = self.behavior.set('r', self.behavior['r'] + rng.uniform(-1.0, 2.0))
 
-            if random.random() < self.mutation_rate:
-                self.behavior['g'] = random.uniform(-1.0, 1.0)
+            if rng.random() < self.mutation_rate:
+                self.behavior = self.behavior.set('g', rng.uniform(-1.0, 1.0))
 
-            if random.random() < self.mutation_rate:
-                self.behavior['b'] = random.uniform(-1.0, 1.0)
+            if rng.random() < self.mutation_rate:
+                self.behavior = self.behavior.set('b', rng.uniform(-1.0, 1.0))
 
             # physical
             # buffs
             # increased start size
-            if random.random() < self.mutation_rate:
-                self.size += random.randint(1,5)
+            if rng.random() < self.mutation_rate:
+                self.size += rng.randint(1,5)
 
             # faster movement speed
-            if random.random() < self.mutation_rate:
-                self.speed += random.randint(1, 5)
+            if rng.random() < self.mutation_rate:
+                self.speed += rng.randint(1, 5)
 
             # gain age
-            if random.random() < self.mutation_rate:
-                self.max_age += random.randint(1,5)
+            if rng.random() < self.mutation_rate:
+                self.max_age += rng.randint(1,5)
 
             # gain ability to eat green particles
-            if random.random() < self.mutation_rate:
-                self.p_consumption['g'] = True
+            if rng.random() < self.mutation_rate:
+                self.p_consumption = self.p_consumption.set('g', True)
 
             # gain ability to eat red cells
-            if random.random() < self.mutation_rate:
-                self.c_consumption['r'] = True
+            if rng.random() < self.mutation_rate:
+                self.c_consumption = self.c_consumption.set('r', True)
 
             # nerfs
             # lose ability to consume red particles
-            if random.random() < self.mutation_rate:
-                self.p_consumption['r'] = False
+            if rng.random() < self.mutation_rate:
+                self.p_consumption = self.p_consumption.set('r', False)
 
             # psychological
-            if random.random() < self.mutation_rate:
+            if rng.random() < self.mutation_rate:
                 if not (self.perception["r"] and self.perception["b"]):
-                    self.perception["g"] = True
+                    self.perception = self.perception.set('g', True)
 
 
         # special:
         else:
-            if random.random() < self.mutation_rate:
-                self.behavior['r'] += random.uniform(-1.0, 1.0)
+            if rng.random() < self.mutation_rate:
+                self.behavior = self.behavior.set('r', self.behavior['r'] + rng.uniform(-1.0, 1.0))
 
-            if random.random() < self.mutation_rate:
-                self.behavior['g'] += random.uniform(-1.0, 1.0)
+            if rng.random() < self.mutation_rate:
+                self.behavior = self.behavior.set('g', self.behavior['g'] + rng.uniform(-1.0, 1.0))
 
-            if random.random() < self.mutation_rate:
-                self.behavior['b'] += random.uniform(-1.0, 1.0)
+            if rng.random() < self.mutation_rate:
+                self.behavior = self.behavior.set('b', self.behavior['b'] + rng.uniform(-1.0, 1.0))
 
             # resets
             # regain ability to eat red particles
-            if random.random() < self.mutation_rate:
-                self.p_consumption['r'] = True
+            if rng.random() < self.mutation_rate:
+                self.p_consumption = self.p_consumption.set('r', True)
 
             # regain ability to eat green cells
-            if random.random() < self.mutation_rate:
-                self.c_consumption['g'] = True
+            if rng.random() < self.mutation_rate:
+                self.c_consumption = self.c_consumption.set('g', True)
 
             # lose ability to see red
-            if random.random() < self.mutation_rate:
+            if rng.random() < self.mutation_rate:
                 if self.perception["r"]:
-                    self.perception["r"] = False
+                    self.perception = self.perception.set('r', False)
 
             # lose ability to see green
-            if random.random() < self.mutation_rate:
+            if rng.random() < self.mutation_rate:
                 if self.perception["g"]:
-                    self.perception["g"] = False
+                    self.perception = self.perception.set('g', False)
 
             # if not able to see red gain ability to see blue
-            if random.random() < self.mutation_rate:
+            if rng.random() < self.mutation_rate:
                 if not self.perception["r"]:
-                    self.perception["b"] = True
+                    self.perception = self.perception.set('b', True)
 
             # special abilities
-            if random.random() < self.mutation_rate:
+            if rng.random() < self.mutation_rate:
                 self.exploding = True
 
-            if random.random() < self.mutation_rate:
+            if rng.random() < self.mutation_rate:
                 self.thickness = 1
 
             # nerfs
             # lose age
-            if random.random() < self.mutation_rate:
-                self.max_age -= random.randint(1, 5)
+            if rng.random() < self.mutation_rate:
+                self.max_age -= rng.randint(1, 5)
                 if self.max_age < 30:
                     self.max_age = 30
 
             # lose size
-            if random.random() < self.mutation_rate:
-                self.size -= random.randint(1,5)
+            if rng.random() < self.mutation_rate:
+                self.size -= rng.randint(1,5)
                 if self.size < 5:
                     self.size = 5
 
@@ -0,0 +1,295 @@
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from particle import dominant_color_indices, expand_ranges, neighbourhood_columns
+from seeding import hash64
+
+# chunk states
+PRISTINE = 'pristine'  # never loaded, generated on first activation
+ACTIVE = 'active'      # particles live in the particle store
+DORMANT = 'dormant'    # particles packed into compact arrays in memory
+EVICTED = 'evicted'    # packed arrays written to disk
+
+# the rgb of particles materialized from collapsed mass, by dominant color index
+PURE_COLORS = np.eye(3, dtype=np.uint8) * 255
+
+
+class Chunk:
+    def __init__(self, key: tuple):
+        self.key = key
+        self.state = PRISTINE
+        self.packed = None
+        self.path = None
+        # particle mass per dominant color, kept while the chunk is not active
+        self.counts = np.zeros(3, np.int64)
+        self.idle_ticks = 0
+
+
+class ChunkManager:
+    """Streams chunks of the world in and out of the particle store.
+
+    Chunks holding cells, with a one chunk halo so detection neighbourhoods never reach
+    into unloaded food, and chunks within active_radius of a focus point (the camera) are
+    active. A chunk nobody wanted for dormant_after updates goes dormant: its particles
+    are removed from the store and packed into compact arrays. Once more than max_resident
+    chunks are dormant the least recently used ones are written to disk, and any chunk is
+    loaded back as soon as something comes near it again.
+
+    Inside active chunks food is streamed per bucket too, see update_buckets: a bucket no
+    cell or view needed for collapse_after updates is collapsed into its particle mass per
+    color and a seed, and materialized again as soon as one does.
+    """
+
+    def __init__(self, particles, chunk_size: int, grid_size: int, num_chunks_x: int, num_chunks_y: int, generate,
+                 active_radius: int = 1, dormant_after: int = 120, max_resident: int = 64, chunk_dir: str = None,
+                 chunk_columns: tuple = None, collapse_after: int = 240):
+        self.particles = particles
+        self.chunk_size = chunk_size
+        self.grid_size = grid_size
+        self.num_chunks_x = num_chunks_x
+        self.num_chunks_y = num_chunks_y
+        self.chunk_width = chunk_size * grid_size
+
+        # generate(key) spawns the initial particles of a pristine chunk
+        self.generate = generate
+        self.active_radius = active_radius
+        self.dormant_after = dormant_after
+        self.max_resident = max_resident
+        self.chunk_dir = chunk_dir
+        self.owns_chunk_dir = False
+
+        # only chunk columns [first, last) are managed here, the rest belong to other shards
+        first_column, last_column = chunk_columns or (0, num_chunks_x)
+        self.chunks = {}
+        for chunk_x in range(first_column, last_column):
+            for chunk_y in range(num_chunks_y):
+                self.chunks[(chunk_x, chunk_y)] = Chunk((chunk_x, chunk_y))
+
+        self.active = set()
+        self.resident = OrderedDict()  # dormant chunks still in memory, least recently used first
+
+        # particle mass per bucket and dominant color of dormant and evicted chunks, laid out
+        # like ParticleStore.bucket_mass, so the two add up to the whole world's food
+        self.num_rows = num_chunks_y * chunk_size
+        self.dormant_mass = np.zeros((num_chunks_x * chunk_size * self.num_rows, 3), np.int64)
+
+        # collapsed buckets, laid out the same way: particle mass per color, the seed their
+        # positions come back from and the last update the bucket was needed in. Longer than
+        # dormant_after, so chunks everyone left go dormant whole before their buckets collapse
+        self.collapse_after = collapse_after
+        self.updates = 0
+        self.collapsed_mass = np.zeros_like(self.dormant_mass)
+        self.seeds = np.zeros(len(self.dormant_mass), np.uint64)
+        self.last_needed = np.zeros(len(self.dormant_mass), np.int64)
+        # only buckets of our own chunks collapse, a shard's ghost columns are copies
+        self.owned = np.zeros((num_chunks_x * chunk_size, self.num_rows), bool)
+        self.owned[first_column * chunk_size:last_column * chunk_size] = True
+        self.owned = self.owned.ravel()
+
+    def chunk_of(self, positions):
+        positions = np.asarray(positions, np.float64).reshape(-1, 2)
+        chunk_x = np.clip((positions[:, 0] // self.chunk_width).astype(np.int64), 0, self.num_chunks_x - 1)
+        chunk_y = np.clip((positions[:, 1] // self.chunk_width).astype(np.int64), 0, self.num_chunks_y - 1)
+        return chunk_x, chunk_y
+
+    def _around(self, positions, radius, wanted):
+        if len(positions) == 0:
+            return
+
+        chunk_x, chunk_y = self.chunk_of(positions)
+        for cx, cy in set(zip(chunk_x.tolist(), chunk_y.tolist())):
+            for dx in range(-radius, radius + 1):
+                for dy in range(-radius, radius + 1):
+                    key = (cx + dx, cy + dy)
+                    if key in self.chunks:
+                        wanted.add(key)
+
+    def update(self, cell_positions, focus_points=()):
+        """Activate the chunks that are needed now and put long unneeded ones to sleep."""
+        wanted = set()
+        self._around(cell_positions, 1, wanted)
+        self._around(focus_points, self.active_radius, wanted)
+
+        loaded = False
+        for key in wanted:
+            chunk = self.chunks[key]
+            chunk.idle_ticks = 0
+            if chunk.state != ACTIVE:
+                self.activate(chunk)
+                loaded = True
+
+        for key in list(self.active - wanted):
+            chunk = self.chunks[key]
+            chunk.idle_ticks += 1
+            if chunk.idle_ticks >= self.dormant_after:
+                self.deactivate(chunk)
+
+        if loaded:
+            self.particles.commit()
+
+    def update_buckets(self, cell_positions, grid_radii, areas=()):
+        """Materialize the collapsed buckets that are needed now and collapse the ones long unneeded.
+
+        A bucket is needed within a cell's grid radius, plus one bucket for cells moving
+        between updates, and inside areas, (min_grid_x, max_grid_x, min_grid_y, max_grid_y)
+        rectangles like the screen. Run it after update(), whose chunks it works within.
+        """
+        self.updates += 1
+        if self.collapse_after is None:
+            return
+
+        needed = self._needed_buckets(cell_positions, grid_radii, areas)
+        self.last_needed[needed] = self.updates
+        needed = np.flatnonzero(needed)
+        wanted = needed[self.collapsed_mass[needed].any(axis=1)]
+
+        # the whole grid is only scanned for idle buckets every quarter of collapse_after
+        idle = np.empty(0, np.int64)
+        if self.updates % max(self.collapse_after // 4, 1) == 0:
+            idle = np.flatnonzero(self.owned & (self.updates - self.last_needed >= self.collapse_after)
+                                  & self.particles.bucket_mass.any(axis=1))
+        if len(idle):
+            self.collapse(idle)
+        if len(wanted):
+            self.materialize(wanted)
+        if len(wanted) or len(idle):
+            self.particles.commit()
+
+    def _needed_buckets(self, cell_positions, grid_radii, areas):
+        num_columns = len(self.owned) // self.num_rows
+        positions = np.asarray(cell_positions, np.float64).reshape(-1, 2)
+        grid_x = (positions[:, 0] // self.grid_size).astype(np.int64)
+        grid_y = (positions[:, 1] // self.grid_size).astype(np.int64)
+        _, first, last = neighbourhood_columns(grid_x, grid_y, np.asarray(grid_radii, np.int64) + 1, num_columns, self.num_rows)
+
+        ranges = [(first, last)]
+        for min_grid_x, max_grid_x, min_grid_y, max_grid_y in areas:
+            columns = np.arange(max(min_grid_x, 0), min(max_grid_x, num_columns - 1) + 1)
+            min_grid_y, max_grid_y = max(min_grid_y, 0), min(max_grid_y, self.num_rows - 1)
+            if min_grid_y <= max_grid_y:
+                ranges.append((columns * self.num_rows + min_grid_y, columns * self.num_rows + max_grid_y + 1))
+
+        _, buckets = expand_ranges(np.concatenate([first for first, _ in ranges]), np.concatenate([last for _, last in ranges]))
+        needed = np.zeros(len(self.owned), bool)
+        needed[buckets] = True
+        return needed
+
+    def collapse(self, buckets):
+        """Replace the particles of buckets in the store by their mass per color and a fresh seed."""
+        # bucket_mass already counts uncommitted additions that the query below can't see yet
+        assert not self.particles.pending, "commit the particle store before collapsing buckets"
+        _, indices = self.particles.indices_in_buckets(buckets, buckets + 1)
+        self.collapsed_mass[buckets] += self.particles.bucket_mass[buckets]
+        self.seeds[buckets] = self.particles.rng.integers(0, 2 ** 63, len(buckets), dtype=np.uint64)
+        self.particles.remove(indices)
+
+    def materialize(self, buckets):
+        """Put the particles of collapsed buckets back into the store, visible after its next commit.
+
+        Every unit of mass becomes a particle of mass one in its pure color, at a position
+        in the bucket that only depends on the seed and the particle's number, so a bucket
+        comes back the same however often and in whatever order it is materialized.
+        """
+        mass = self.collapsed_mass[buckets]
+        owner, number = expand_ranges(np.zeros(len(buckets), np.int64), mass.sum(axis=1))
+        color = (number[:, None] >= np.cumsum(mass, axis=1)[owner]).sum(axis=1)
+
+        keys = self.seeds[buckets][owner] + 2 * number.astype(np.uint64)
+        grid_x, grid_y = np.divmod(buckets[owner], self.num_rows)
+        x = grid_x * self.grid_size + (hash64(keys) % np.uint64(self.grid_size)).astype(np.int64)
+        y = grid_y * self.grid_size + (hash64(keys + np.uint64(1)) % np.uint64(self.grid_size)).astype(np.int64)
+        self.particles.add(x, y, PURE_COLORS[color])
+        self.collapsed_mass[buckets] = 0
+        self.last_needed[buckets] = self.updates
+
+    def _bucket_area(self, chunk):
+        chunk_x, chunk_y = chunk.key
+        min_grid_x, min_grid_y = chunk_x * self.chunk_size, chunk_y * self.chunk_size
+        return min_grid_x, min_grid_x + self.chunk_size - 1, min_grid_y, min_grid_y + self.chunk_size - 1
+
+    def activate(self, chunk):
+        if chunk.state == PRISTINE:
+            self.generate(chunk.key)
+        else:
+            if chunk.state == EVICTED:
+                with np.load(chunk.path) as data:
+                    chunk.packed = {name: data[name] for name in data.files}
+                os.remove(chunk.path)
+                chunk.path = None
+            else:
+                del self.resident[chunk.key]
+
+            packed = chunk.packed
+            origin_x, origin_y = chunk.key[0] * self.chunk_width, chunk.key[1] * self.chunk_width
+            self.particles.add(packed['x'] + origin_x, packed['y'] + origin_y, packed['rgb'], packed['mass'])
+            chunk.packed = None
+            self._dormant_view(chunk)[:] = 0
+
+        chunk.state = ACTIVE
+        chunk.counts[:] = 0
+        self.active.add(chunk.key)
+        # its buckets only count as idle from now on
+        min_grid_x, max_grid_x, min_grid_y, max_grid_y = self._bucket_area(chunk)
+        self.last_needed.reshape(-1, self.num_rows)[min_grid_x:max_grid_x + 1, min_grid_y:max_grid_y + 1] = self.updates
+
+    def deactivate(self, chunk):
+        # pack everything the store holds for this chunk and tombstone it there
+        indices = self.particles.indices_in_area(*self._bucket_area(chunk))
+        origin_x, origin_y = chunk.key[0] * self.chunk_width, chunk.key[1] * self.chunk_width
+        chunk.packed = {
+            'x': self.particles.x[indices] - origin_x,
+            'y': self.particles.y[indices] - origin_y,
+            'rgb': self.particles.rgb[indices],
+            'mass': self.particles.mass[indices],
+        }
+        chunk.counts[:] = np.bincount(self.particles.color[indices], weights=self.particles.mass[indices], minlength=3)
+        self.record_dormant(chunk)
+        self.particles.remove(indices)
+
+        chunk.state = DORMANT
+        self.active.discard(chunk.key)
+        self.resident[chunk.key] = chunk
+        while len(self.resident) > self.max_resident:
+            _, oldest = self.resident.popitem(last=False)
+            self.evict(oldest)
+
+    def _dormant_view(self, chunk):
+        # the chunk's buckets in dormant_mass, as (chunk_size, chunk_size, 3)
+        min_grid_x, max_grid_x, min_grid_y, max_grid_y = self._bucket_area(chunk)
+        grid = self.dormant_mass.reshape(-1, self.num_rows, 3)
+        return grid[min_grid_x:max_grid_x + 1, min_grid_y:max_grid_y + 1]
+
+    def record_dormant(self, chunk):
+        """Count a freshly packed chunk's particles into dormant_mass."""
+        packed = chunk.packed
+        grid_x = (packed['x'] // self.grid_size).astype(np.int64).clip(0, self.chunk_size - 1)
+        grid_y = (packed['y'] // self.grid_size).astype(np.int64).clip(0, self.chunk_size - 1)
+        color = dominant_color_indices(packed['rgb'])
+        view = self._dormant_view(chunk)
+        view[:] = 0
+        np.add.at(view, (grid_x, grid_y, color), packed['mass'])
+
+    def evict(self, chunk):
+        if self.chunk_dir is None:
+            self.chunk_dir = tempfile.mkdtemp(prefix="cellgame_chunks_")
+            self.owns_chunk_dir = True
+
+        chunk.path = os.path.join(self.chunk_dir, f"chunk_{chunk.key[0]}_{chunk.key[1]}.npz")
+        np.savez(chunk.path, **chunk.packed)
+        chunk.packed = None
+        chunk.state = EVICTED
+
+    @property
+    def resident_bytes(self):
+        return sum(array.nbytes for chunk in self.resident.values() for array in chunk.packed.values())
+
+    def close(self):
+        # drop evicted chunk files we created
+        if self.owns_chunk_dir:
+            shutil.rmtree(self.chunk_dir, ignore_errors=True)
+            self.chunk_dir = None
+            self.owns_chunk_dir = False
@@ -0,0 +1,106 @@
+from typing import NamedTuple
+
+import numpy as np
+import pygame
+
+
+class DrawState(NamedTuple):
+    """Everything render() draws for one tick, copied out of the game by capture().
+
+    Nothing in it refers back to the game and its arrays are read-only, so it can be
+    drawn while the next tick runs. Cell positions come in pairs, before and after the
+    tick, for drawing in between.
+    """
+    tick_count: int
+    camera: tuple
+    zoom_factor: float
+    screen_size: tuple
+    show_grid: bool
+    show_profiler: bool
+    # the player's HUD values and how it sees colors
+    age: int
+    max_age: int
+    generation: int
+    perception: int
+    # the player's position before and after the tick while the camera follows it, else None
+    follow: tuple
+    # one row per cell
+    previous_positions: np.ndarray
+    positions: np.ndarray
+    sizes: np.ndarray
+    thicknesses: np.ndarray
+    colors: np.ndarray
+    animations: np.ndarray
+    # food particles around the screen, when zoomed in
+    particle_positions: np.ndarray
+    particle_colors: np.ndarray
+    # particle mass per visible grid bucket and color and the first bucket's grid position, when zoomed out
+    density: np.ndarray
+    density_origin: tuple
+
+
+def _frozen(array):
+    array.flags.writeable = False
+    return array
+
+
+def capture(game):
+    """The DrawState of game as it is now, at the end of a tick."""
+    cells = game.cells
+    positions = np.array([tuple(cell.body.position) for cell in cells], np.float64).reshape(-1, 2)
+    previous = np.array([game.previous_positions.get(cell, position) for cell, position in zip(cells, positions.tolist())],
+                        np.float64).reshape(-1, 2)
+    # cells that wrapped around are drawn where they are now
+    wrapped = np.any(np.abs(positions - previous) > np.array([game.world_width, game.world_height]) / 2, axis=1)
+    previous[wrapped] = positions[wrapped]
+
+    player = game.player
+    follow = None
+    if player.age < player.genome.max_age:
+        current = tuple(player.body.position)
+        before = game.previous_positions.get(player, current)
+        if abs(current[0] - before[0]) > game.world_width / 2 or abs(current[1] - before[1]) > game.world_height / 2:
+            before = current
+        follow = before, current
+
+    # food is picked around where the frame's camera will be, which follows the player when it is alive
+    camera_offset = (-game.camera_x, -game.camera_y)
+    if follow is not None:
+        camera_offset = (game.screen_width / 2 - follow[1][0] * game.zoom_factor,
+                         game.screen_height / 2 - follow[1][1] * game.zoom_factor)
+    particle_positions = np.empty((0, 2), np.float32)
+    particle_colors = np.empty((0, 3), np.uint8)
+    density, density_origin = None, None
+    if game.zoom_factor >= game.lod_zoom:
+        # two buckets more than the screen, the camera moves a little between ticks
+        margin = int(2 * game.grid_size * game.zoom_factor)
+        screen_rect = pygame.Rect(0, 0, game.screen_width, game.screen_height).inflate(margin, margin)
+        indices = game.get_objects_in_screen_area('particle', screen_rect=screen_rect, offset=camera_offset)
+        particle_positions = np.stack((game.particles.x[indices], game.particles.y[indices]), axis=1)
+        particle_colors = game.particles.rgb[indices]
+    else:
+        density, density_origin = game.visible_density(camera_offset)
+
+    return DrawState(
+        tick_count=game.tick_count,
+        camera=(game.camera_x, game.camera_y),
+        zoom_factor=game.zoom_factor,
+        screen_size=(game.screen_width, game.screen_height),
+        show_grid=game.show_grid,
+        show_profiler=game.show_profiler,
+        age=int(player.age),
+        max_age=player.genome.max_age,
+        generation=player.generation,
+        perception=player.genome.perception,
+        follow=follow,
+        previous_positions=_frozen(previous),
+        positions=_frozen(positions),
+        sizes=_frozen(np.array([cell.size for cell in cells], np.int64)),
+        thicknesses=_frozen(np.array([cell.genome.thickness for cell in cells], np.int64)),
+        colors=_frozen(np.array([(cell.genome.r, cell.genome.g, cell.genome.b) for cell in cells], np.int64).reshape(-1, 3)),
+        animations=_frozen(np.array([cell.animation for cell in cells], np.int64)),
+        particle_positions=_frozen(particle_positions),
+        particle_colors=_frozen(particle_colors),
+        density=density if density is None else _frozen(density),
+        density_origin=density_origin,
+    )
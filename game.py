@@ -1,18 +1,77 @@
+import argparse
+import hashlib
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pygame
 import pymunk
-import random
 
 from pygame import VIDEORESIZE
 from pygame.examples.scroll import zoom_factor
 
-from interactions import distance_squared
-from cell import Cell, Genome
-from particle import Particle
-from AI import CellAI
+from cell import COLLISION_TYPE, MAX_CELLS, Cell, CellPool, Genome, ALL_COLORS, NO_COLORS
+from particle import PARTICLE_SIZE, color_flags
+from AI import decide_all
+from vision import PerceivedColors, perceive_colors
+from sprites import SpriteCache
+from spatial import SpatialHash
+from chunks import ChunkManager
+from profiler import Profiler
+from seeding import RandomStreams
+from replay import ReplayLog
+import snapshot
+import draw_state
+
+# key presses that reach apply_input, by the name they are recorded under
+INPUT_KEYS = {pygame.K_k: 'k', pygame.K_g: 'g', pygame.K_c: 'c', pygame.K_p: 'p'}
+# held keys, recorded as one bit each
+HELD_KEYS = {pygame.K_a: 1, pygame.K_d: 2, pygame.K_w: 4, pygame.K_s: 8, pygame.K_LSHIFT: 16, pygame.K_RSHIFT: 16}
+
+# grid buckets per chunk side, and the default bucket size in world units
+CHUNK_SIZE = 16
+GRID_SIZE = 120
 
 class Game:
-    def __init__(self):
-        self.font = pygame.font.SysFont("Arcade_Classic", 18)
+    def __init__(self, headless: bool = False, num_chunks: tuple = (1, 1), spawn_player: bool = True, chunk_columns: tuple = None,
+                 genome_defaults: dict = None, particle_mix: tuple = None, grid_size: int = GRID_SIZE, particle_density: int = 24,
+                 seed: int = None, autopilot: bool = None, screen_size: tuple = None, fixed_dt: float = 1 / 60, substeps: int = 1,
+                 max_catch_up: int = 5, render_fps: int = 60, pipelined: bool = False):
+        # headless worlds have no window, font or input and are advanced with step()
+        self.headless = headless
+        # the ai steers the player when nobody else does, replays drive a headless player by recorded input instead
+        self.autopilot = headless if autopilot is None else autopilot
+        # the windowed loop simulates ticks of fixed_dt, each split into substeps physics steps, and
+        # renders at up to render_fps; after a stall it runs at most max_catch_up ticks per frame
+        self.fixed_dt = fixed_dt
+        self.substeps = substeps
+        self.max_catch_up = max_catch_up
+        self.render_fps = render_fps
+        # ticks run on a worker thread while the main thread draws the ones before them
+        self.pipelined = pipelined
+        # cell positions before the last tick, rendering interpolates from them
+        self.previous_positions = {}
+        # below this zoom food is drawn per bucket, see render_density
+        self.lod_zoom = 1.0
+        # how the player sees colors, by its perception
+        self.perceived_colors = PerceivedColors()
+        # cell outlines by size, thickness, color and split animation, see Cell.render_sprite
+        self.cell_sprites = SpriteCache()
+        # walls and grid lines pre-drawn in tiles of the zoomed world, see render_static
+        self.static_tiles = SpriteCache(64 * 1024 * 1024)
+        self.static_tiles_for = None
+        self.static_tile_size = 512
+        self.static_tiles_per_frame = 2
+        # pixels of a food particle's outline at particle_outline_radius
+        self.particle_outline_offsets = None
+        self.particle_outline_radius = None
+
+        # every random draw of the simulation comes from these, one stream per subsystem
+        self.rng = RandomStreams(seed)
+
+        # Genome() keyword overrides for the player and spawned cells
+        self.genome_defaults = genome_defaults or {}
 
         self.SCREEN_WIDTH = 1920
         self.SCREEN_HEIGHT = 1080
@@ -20,16 +79,24 @@ class Game:
 
         # special controls
         self.show_grid = False
+        self.show_profiler = False
         self.show_colors = False
-        self.old_perception = {"r": False, "g": False, "b": False}
+        self.old_perception = NO_COLORS
+
+        if self.headless:
+            self.font = None
+            self.screen = None
+            self.screen_width, self.screen_height = screen_size or (self.SCREEN_WIDTH, self.SCREEN_HEIGHT)
+        else:
+            self.font = pygame.font.SysFont("Arcade_Classic", 18)
 
-        # Fixed resolution for rendering
-        self.screen = pygame.display.set_mode((self.SCREEN_WIDTH, self.SCREEN_HEIGHT), pygame.RESIZABLE)
-        self.surface = pygame.Surface((self.SCREEN_WIDTH, self.SCREEN_HEIGHT))
+            # Fixed resolution for rendering
+            self.screen = pygame.display.set_mode((self.SCREEN_WIDTH, self.SCREEN_HEIGHT), pygame.RESIZABLE)
+            self.surface = pygame.Surface((self.SCREEN_WIDTH, self.SCREEN_HEIGHT))
 
-        # get monitor screen
-        self.screen_width, self.screen_height = self.screen.get_size()
-        print("Screen size:", self.screen_width, self.screen_height)
+            # get monitor screen
+            self.screen_width, self.screen_height = self.screen.get_size()
+            print("Screen size:", self.screen_width, self.screen_height)
 
         # camera and zoom
         self.zoom_factor = 1.0
@@ -41,12 +108,16 @@ class Game:
 
         # physics space
         self.space = pymunk.Space()
+        self.contacts = {}
 
         # initialize chunks and grid
-        self.grid_size = 120
-        self.chunk_size = 16
-        self.num_chunks_x = 1
-        self.num_chunks_y = 1
+        self.grid_size = grid_size
+        self.chunk_size = CHUNK_SIZE
+        # food particles spawned per bucket when a chunk is first loaded
+        self.particle_density = particle_density
+        self.num_chunks_x, self.num_chunks_y = num_chunks
+        # chunk columns [first, last) simulated by this Game, None for the whole world
+        self.chunk_columns = chunk_columns
 
         # chunk and grid properties
         self.num_columns = self.chunk_size * self.num_chunks_x
@@ -55,49 +126,79 @@ class Game:
         self.world_width = self.num_columns * self.grid_size
         self.world_height = self.num_rows * self.grid_size
 
-        self.grid = {}
-        self.particles = []
+        # cells and food particles bucketed by grid coordinate
+        self.spatial = SpatialHash(self.num_columns, self.num_rows, self.grid_size)
+        self.particles = self.spatial.particles
+        self.particles.rng = self.rng.particles
+        if particle_mix is not None:
+            self.particles.mix = tuple(particle_mix)
+
+        # everything needed to build this world again, for replays
+        self.settings = {
+            'seed': self.rng.seed,
+            'num_chunks': list(num_chunks),
+            'spawn_player': spawn_player,
+            'genome_defaults': self.genome_defaults,
+            'particle_mix': list(self.particles.mix),
+            'grid_size': grid_size,
+            'particle_density': particle_density,
+            'screen_size': [self.screen_width, self.screen_height],
+            'substeps': substeps,
+        }
 
         self.init_grid()
 
-        self.chunks = {}
-        for chunk_x in range(self.num_chunks_x):
-            for chunk_y in range(self.num_chunks_y):
-                self.chunks[(chunk_x, chunk_y)] = []
-
-        # Initialize player and game objects
-        # self.player_speed = 1
-        default_genome = Genome()
-        init_chromosome = [default_genome]
-        spawn_x = random.randint(0, self.world_width)
-        spawn_y = random.randint(0, self.world_height)
-        self.player = Cell((spawn_x, spawn_y), init_chromosome,is_player = True)
-        self.player.add_to_space(self.space)
-        self.player.set_collision_type(0)
-
         # keep track of generations (for high scores)
         self.generation = 0
 
-        self.cells = [self.player]
+        self.cells = []
+        # split and dead cells are parked here with their bodies, new cells come from it
+        self.cell_pool = CellPool()
+        # splits stop adding cells at this population
+        self.max_cells = MAX_CELLS
         # self.particles = self.create_particles(5000)
-        self.consumed_particles = []
         self.to_remove_cells = set()
 
+        # Initialize player and game objects (headless worlds may start without one)
+        # self.player_speed = 1
+        self.player = None
+        if spawn_player:
+            default_genome = self.default_genome()
+            init_chromosome = [default_genome]
+            spawn_x = self.rng.spawn.randint(0, self.world_width)
+            spawn_y = self.rng.spawn.randint(0, self.world_height)
+            self.player = self.cell_pool.acquire((spawn_x, spawn_y), init_chromosome, is_player = True)
+            self.player.add_to_space(self.space)
+            self.cells.append(self.player)
+
         self.update_grid()
+        self.stream_chunks()
+
+        # per phase timings, off unless a benchmark or the debug overlay turns it on
+        self.profiler = Profiler()
+        self.profiler_text = []
+
+        # periodic background snapshots, see snapshot.BackgroundSnapshots
+        self.snapshots = None
 
         self.clock = pygame.time.Clock()
         self.run = True
-        self.prev_time = pygame.time.get_ticks()
+        self.tick_count = 0
 
-        # handle collisions
-        self.handler = self.space.add_default_collision_handler()
+        # cells touching other cells, kept up to date by pymunk's collision detection
+        self.handler = self.space.add_collision_handler(COLLISION_TYPE, COLLISION_TYPE)
         self.handler.begin = self.begin_collision
-        self.handler.pre_solve = self.pre_collision
-        self.handler.post_solve = self.post_collision
         self.handler.separate = self.separate_collision
 
+    @classmethod
+    def from_settings(cls, settings: dict, **kwargs):
+        """A new world built like the one settings were taken from (see self.settings)."""
+        return cls(num_chunks=tuple(settings['num_chunks']), spawn_player=settings['spawn_player'],
+                   genome_defaults=settings['genome_defaults'], particle_mix=settings['particle_mix'],
+                   grid_size=settings['grid_size'], particle_density=settings['particle_density'], seed=settings['seed'],
+                   screen_size=tuple(settings['screen_size']), substeps=settings.get('substeps', 1), **kwargs)
+
     def create_particles(self, count, color, x_bounds = None, y_bounds = None):
-        particles = []
         if color == 'r':
             col1 = 0, 255, 0
             col2 = 0, 0, 255
@@ -113,24 +214,11 @@ class Game:
             col2 = 0, 255, 0
             col3 = 0, 0, 255
 
-        for _ in range(count):
-            if x_bounds and y_bounds:
-                x = random.randint(*x_bounds)
-                y = random.randint(*y_bounds)
-            else:
-                x = random.randint(0, self.screen_width)
-                y = random.randint(0, self.screen_height)
-
-            color = random.randint(1, 100)
-            if color <= 50:
-                particle = Particle((x, y), col1[0], col1[1], col1[2])
-            elif 50 < color <= 85:
-                particle = Particle((x, y), col2[0], col2[1], col2[2])
-            else:
-                particle = Particle((x, y), col3[0], col3[1], col3[2])
+        if not (x_bounds and y_bounds):
+            x_bounds = (0, self.screen_width)
+            y_bounds = (0, self.screen_height)
 
-            particles.append(particle)
-        return particles
+        self.particles.spawn(count, (col1, col2, col3), x_bounds, y_bounds)
 
     def create_walls(self):
         thickness = 1  # Thickness of the wall segments
@@ -170,13 +258,15 @@ class Game:
     def scale(self, pos, offset = (0,0)):
         return pos[0] * self.zoom_factor + offset[0], pos[1] * self.zoom_factor + offset[1]
 
-    def draw_walls(self, surface, offset=(0, 0)):
+    def draw_walls(self, surface, zoom_factor=1.0, offset=(0, 0)):
         wall_color = 255,255,255
+        scaled_width = self.world_width * zoom_factor
+        scaled_height = self.world_height * zoom_factor
 
-        top_left = self.scale((0, 0), offset)
-        top_right = self.scale((self.world_width, 0), offset)
-        bottom_left = self.scale((0, self.world_height), offset)
-        bottom_right = self.scale((self.world_width, self.world_height), offset)
+        top_left = offset[0], offset[1]
+        top_right = scaled_width + offset[0], offset[1]
+        bottom_left = offset[0], scaled_height + offset[1]
+        bottom_right = scaled_width + offset[0], scaled_height + offset[1]
 
         # Draw the four walls
         pygame.draw.line(surface, wall_color, top_left, top_right, 2)  # Top
@@ -184,61 +274,69 @@ class Game:
         pygame.draw.line(surface, wall_color, top_left, bottom_left, 2)  # Left
         pygame.draw.line(surface, wall_color, top_right, bottom_right, 1)  # Right
 
-    # Create the collision handler (outside the game loop)
+    # a pair of cells is in self.contacts from the step they start touching until they separate,
+    # which pymunk also reports when one of them is removed from the space
     def begin_collision(self, arbiter, space, data):
-        # print("Collision occurred!")
+        self.contacts[self.contact_key(arbiter)] = None
         return True  # Return False if you want to ignore the collision
 
-    def pre_collision(self, arbiter, space, data):
-        # print("Pre solve")
-        return True
-
-    def post_collision(self,arbiter, space, data):
-        # print("Post solve")
-        pass
-
     def separate_collision(self, arbiter, space, data):
-        # print("Separate")
-        pass
-
-    def init_grid(self):
-        self.grid = {}
+        self.contacts.pop(self.contact_key(arbiter), None)
 
-        for x in range(0, self.world_width, self.grid_size):
-            for y in range(0, self.world_height, self.grid_size):
-                grid_x = x // self.grid_size
-                grid_y = y // self.grid_size
-                self.grid[(grid_x, grid_y)] = []
+    @staticmethod
+    def contact_key(arbiter):
+        a, b = arbiter.shapes[0].cell, arbiter.shapes[1].cell
+        return (a, b) if a.id < b.id else (b, a)
 
-                # Spawn 24 particles in this cell using create_particles
-                new_particles = self.create_particles(24, 'd', (x, x + self.grid_size - 1), (y, y + self.grid_size - 1))
-                self.grid[(grid_x, grid_y)].extend(new_particles)
-                # print(grid_x, grid_y, new_particles, "\n")
-                # self.particles.extend(new_particles)
+    def init_grid(self):
+        # chunks get their particles the first time they become active
+        self.chunk_manager = ChunkManager(self.particles, self.chunk_size, self.grid_size, self.num_chunks_x, self.num_chunks_y,
+                                          self.generate_chunk, chunk_columns=self.chunk_columns)
+        self.chunks = self.chunk_manager.chunks
+
+    def generate_chunk(self, key):
+        chunk_x, chunk_y = key
+        chunk_width = self.chunk_size * self.grid_size
+        for x in range(chunk_x * chunk_width, (chunk_x + 1) * chunk_width, self.grid_size):
+            for y in range(chunk_y * chunk_width, (chunk_y + 1) * chunk_width, self.grid_size):
+                # Spawn particle_density particles in this cell using create_particles
+                self.create_particles(self.particle_density, 'd', (x, x + self.grid_size - 1), (y, y + self.grid_size - 1))
+
+    def default_genome(self):
+        return Genome(**self.genome_defaults)
+
+    def spawn_cell(self, position, chromosome: list = None, active_gene: int = 0):
+        """Add an npc cell to the world, with a default genome unless a chromosome is given."""
+        cell = self.cell_pool.acquire(position, chromosome or [self.default_genome()], active_gene)
+        cell.add_to_space(self.space)
+        self.cells.append(cell)
+        self.spatial.insert(cell)
+        return cell
+
+    def stream_chunks(self):
+        # bodies, not cell.position, so cells that just wrapped around load their new chunk
+        cell_positions = np.array([cell.body.position for cell in self.cells], np.float64).reshape(-1, 2)
+        focus_points = []
+        areas = []
+        if not self.autopilot:
+            focus_points.append(((self.camera_x + self.screen_width / 2) / self.zoom_factor,
+                                 (self.camera_y + self.screen_height / 2) / self.zoom_factor))
+            # zoomed out the density map shows collapsed buckets as they are
+            if self.zoom_factor >= self.lod_zoom:
+                areas.append(self.screen_area())
+        self.chunk_manager.update(cell_positions, focus_points)
+        self.chunk_manager.update_buckets(cell_positions, [cell.genome.detection_radius for cell in self.cells], areas)
+
+    def screen_area(self):
+        # grid buckets on screen and one more on every side, as (min_grid_x, max_grid_x, min_grid_y, max_grid_y)
+        scaled_grid_size = self.grid_size * self.zoom_factor
+        return (int(self.camera_x // scaled_grid_size) - 1, int((self.camera_x + self.screen_width) // scaled_grid_size) + 1,
+                int(self.camera_y // scaled_grid_size) - 1, int((self.camera_y + self.screen_height) // scaled_grid_size) + 1)
 
     def update_grid(self):
-        for key in self.grid:
-            self.grid[key] = [obj for obj in self.grid[key] if isinstance(obj, Particle)]
-
-        '''for particle in self.particles:
-            grid_x = int(particle.position[0] // self.grid_size)
-            grid_y = int(particle.position[1] // self.grid_size)
-
-            # Clamp grid_x and grid_y to stay within initialized bounds
-            grid_x = max(0, min(grid_x, self.world_width // self.grid_size - 1))
-            grid_y = max(0, min(grid_y, self.world_height // self.grid_size - 1))
-
-            self.grid[grid_x, grid_y].append(particle)'''
-
+        # only cells that crossed into another bucket are touched
         for cell in self.cells:
-            grid_x = int(cell.position[0] // self.grid_size)
-            grid_y = int(cell.position[1] // self.grid_size)
-
-            # Clamp grid_x and grid_y to stay within initialized bounds
-            grid_x = max(0, min(grid_x, self.world_width // self.grid_size - 1))
-            grid_y = max(0, min(grid_y, self.world_height // self.grid_size - 1))
-
-            self.grid[grid_x, grid_y].append(cell)
+            self.spatial.move(cell)
 
     def draw_grid(self, surface, zoom_factor=1.0, offset=(0, 0)):
         color = (50, 50, 50)
@@ -246,42 +344,94 @@ class Game:
         scaled_width = self.world_width * zoom_factor
         scaled_height = self.world_height * zoom_factor
 
+        # lines off the surface are skipped, the rest would be clipped anyway
+        surface_width, surface_height = surface.get_size()
+
         # Vertical lines
         x = 0
         while x <= scaled_width:
-            start_pos = (x + offset[0], 0 + offset[1])
-            end_pos = (x + offset[0], scaled_height + offset[1])
-            pygame.draw.line(surface, color, start_pos, end_pos)
+            if -1 <= x + offset[0] <= surface_width:
+                start_pos = (x + offset[0], 0 + offset[1])
+                end_pos = (x + offset[0], scaled_height + offset[1])
+                pygame.draw.line(surface, color, start_pos, end_pos)
             x += scaled_grid_size
 
         # Horizontal lines
         y = 0
         while y <= scaled_height:
-            start_pos = (0 + offset[0], y + offset[1])
-            end_pos = (scaled_width + offset[0], y + offset[1])
-            pygame.draw.line(surface, color, start_pos, end_pos)
+            if -1 <= y + offset[1] <= surface_height:
+                start_pos = (0 + offset[0], y + offset[1])
+                end_pos = (scaled_width + offset[0], y + offset[1])
+                pygame.draw.line(surface, color, start_pos, end_pos)
             y += scaled_grid_size
 
     # grid_radius = 1 -> 3x3 grid
     # grid_radius = 2 -> 5x5 grid
     # grid_radius = 3 -> 7x7 grid
     def find_objects_within_radius(self, cell: Cell, grid_radius: int):
-        grid_x = int(cell.position[0] // self.grid_size)
-        grid_y = int(cell.position[1] // self.grid_size)
-
-        # Determine which grid cells to check based on `grid_radius`
-        neighboring_cells = [
-            (grid_x + dx, grid_y + dy)
-            for dx in range(-grid_radius, grid_radius + 1)
-            for dy in range(-grid_radius, grid_radius + 1)
-        ]
-
-        nearby_objects = []
-        for nx, ny in neighboring_cells:
-            if (nx, ny) in self.grid:
-                nearby_objects.extend(self.grid[(nx, ny)])
-
-        return nearby_objects
+        # cells only, food is found in batches through SpatialHash.particle_pairs
+        return self.spatial.cells_near(cell.position, grid_radius)
+
+    def consume_particles(self):
+        """Let every cell eat the particles it overlaps in one batched pass."""
+        pair_cells, pair_particles = self.find_consumed_particles()
+        self.feed_cells(self.cells, pair_cells, self.particles.mass[pair_particles], self.particles.rgb[pair_particles])
+
+        # tombstoned right away, later queries this frame already skip them
+        self.particles.remove(pair_particles)
+
+    def find_consumed_particles(self):
+        # (index into self.cells, particle index) pairs in cell order, contested particles go to the earliest cell
+        pair_cells, pair_particles, pair_dist = self.spatial.particle_pairs(self.cells)
+        self.profiler.lap('neighbours')
+
+        sizes = np.array([cell.size for cell in self.cells], np.float64)
+        edible = color_flags([cell.genome.p_consumption for cell in self.cells])
+        eaten = (pair_dist < sizes[pair_cells] ** 2) & edible[pair_cells, self.particles.color[pair_particles]]
+        pair_cells, pair_particles = pair_cells[eaten], pair_particles[eaten]
+
+        # resolve contested particles in favour of the earliest cell
+        order = np.argsort(pair_cells, kind='stable')
+        pair_cells, pair_particles = pair_cells[order], pair_particles[order]
+        _, first = np.unique(pair_particles, return_index=True)
+        first.sort()
+        return pair_cells[first], pair_particles[first]
+
+    def feed_cells(self, cells, pair_cells, mass, rgb):
+        """Apply eaten particles (mass and rgb per pair, grouped by cell in eating order) to the cells."""
+        num_cells = len(cells)
+        mass = np.asarray(mass, np.int64)
+        rgb = np.asarray(rgb, np.int64).reshape(-1, 3)
+        total_mass = np.bincount(pair_cells, weights=mass, minlength=num_cells).astype(np.int64)
+        rgb_mass = [np.bincount(pair_cells, weights=rgb[:, c] * mass, minlength=num_cells).astype(np.int64) for c in range(3)]
+
+        # cell mass after each particle, for the split animation
+        start_mass = np.array([cell.mass for cell in cells], np.int64)
+        threshold = np.array([cell.genome.max_mass - 9 for cell in cells], np.int64)
+        mass_before_cell = np.cumsum(total_mass) - total_mass
+        running_mass = np.cumsum(mass) - mass_before_cell[pair_cells] + start_mass[pair_cells]
+        over_threshold = np.bincount(pair_cells, weights=running_mass >= threshold[pair_cells], minlength=num_cells).astype(np.int64)
+
+        for i in np.flatnonzero(total_mass).tolist():
+            cells[i].consume_particles(int(total_mass[i]), int(rgb_mass[0][i]), int(rgb_mass[1][i]), int(rgb_mass[2][i]),
+                                       int(over_threshold[i]))
+
+    def consume_cells(self):
+        # both cells of a pymunk contact get a try, the one earlier in self.cells first
+        if not self.contacts:
+            return
+
+        order = {cell: i for i, cell in enumerate(self.cells)}
+        attempts = []
+        for a, b in self.contacts:
+            if a in order and b in order:
+                attempts.append((order[a], order[b]))
+                attempts.append((order[b], order[a]))
+
+        for i, j in sorted(attempts):
+            other = self.cells[j]
+            if not other.dead:
+                self.cells[i].consume_cell(other, self.to_remove_cells)
 
     def get_objects_in_screen_area(self, obj_type, screen_rect, offset=(0, 0)):
         visible_objects = []
@@ -302,15 +452,11 @@ class Game:
         min_grid_y = int(top // self.grid_size)
         max_grid_y = int(bottom // self.grid_size)
 
-        for grid_x in range(min_grid_x, max_grid_x + 1):
-            for grid_y in range(min_grid_y, max_grid_y + 1):
-                if (grid_x, grid_y) in self.grid:
-                    for obj in self.grid[(grid_x, grid_y)]:
-                        if obj_type == 'particle' and isinstance(obj, Particle):
-                            visible_objects.append(obj)
-                        elif obj_type == 'cell' and isinstance(obj, Cell):
-                            visible_objects.append(obj)
-                        # Add more types as needed
+        # particles come back as store indices
+        if obj_type == 'particle':
+            return self.particles.indices_in_area(min_grid_x, max_grid_x, min_grid_y, max_grid_y)
+        elif obj_type == 'cell':
+            visible_objects.extend(self.spatial.cells_in_area(min_grid_x, max_grid_x, min_grid_y, max_grid_y))
 
         return visible_objects
 
@@ -320,46 +466,22 @@ class Game:
         nearby_objects = self.find_objects_within_radius(cell, explosion_radius)
 
         for obj in nearby_objects:
-            if isinstance(obj, Cell) and (obj != cell) and (obj not in self.to_remove_cells):
+            if (obj != cell) and (not obj.dead) and (obj not in self.to_remove_cells):
                     self.to_remove_cells.add(obj)
 
-    def simulate_vision(self, color):
-        r, g, b = color
-        brightness = (r + g + b)//3
-
-        if self.player.genome.perception["r"]:
-            if r < brightness:
-                r = brightness
-            vis_r = r
-        else:
-            vis_r = 0
-
-        if self.player.genome.perception["g"]:
-            if g < brightness:
-                g = brightness
-            vis_g = g
-        else:
-            vis_g = 0
-
-        if self.player.genome.perception["b"]:
-            if b < brightness:
-                b = brightness
-            vis_b = b
-        else:
-            vis_b = 0
-
-        rp = vis_r if vis_r != 0 else brightness
-        gp = vis_g if vis_g != 0 else brightness
-        bp = vis_b if vis_b != 0 else brightness
-
-        perceived_color = rp, gp, bp
-        return perceived_color
-
     def update_camera(self):
         self.camera_x = (self.player.position[0] * self.zoom_factor) - self.screen_width / 2
         self.camera_y = (self.player.position[1] * self.zoom_factor) - self.screen_height / 2
 
     def handle_input(self):
+        """Poll this frame's input and apply it, returns it as (held keys, events) for the replay log."""
+        keys, events = self.poll_input()
+        self.apply_input(keys, events)
+        return keys, events
+
+    def poll_input(self):
+        # window handling happens here, everything that can change the simulation is returned
+        events = []
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.run = False
@@ -372,35 +494,60 @@ class Game:
                     self.fullscreen = not self.fullscreen
                     if self.fullscreen:
                         self.screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN)
-                        self.screen_width, self.screen_height = self.screen.get_size()
                     else:
                         self.screen = pygame.display.set_mode((self.SCREEN_WIDTH, self.SCREEN_HEIGHT))
-                        self.screen_width, self.screen_height = self.screen.get_size()
+                    events.append(('screen',) + self.screen.get_size())
+
+                elif event.key in INPUT_KEYS:
+                    events.append(('key', INPUT_KEYS[event.key]))
 
-                if event.key == pygame.K_k:
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                events.append(('mouse', event.button) + pygame.mouse.get_pos())
+
+        pressed = pygame.key.get_pressed()
+        keys = 0
+        for key, bit in HELD_KEYS.items():
+            if pressed[key]:
+                keys |= bit
+        return keys, events
+
+    def apply_input(self, keys: int, events: list):
+        """Apply one frame of polled or replayed input: held key bits plus events."""
+        for event in events:
+            if event[0] == 'screen':
+                self.screen_width, self.screen_height = event[1], event[2]
+
+            elif event[0] == 'key':
+                if event[1] == 'k':
                     self.player.age = self.player.genome.max_age + 1
 
-                if event.key == pygame.K_g:
+                if event[1] == 'g':
                     self.show_grid = not self.show_grid
 
-                if event.key == pygame.K_c:
+                # timings are only collected while the overlay is up, unless profiling from the start
+                if event[1] == 'p':
+                    self.show_profiler = not self.show_profiler
+                    if self.show_profiler:
+                        self.profiler.enabled = True
+
+                if event[1] == 'c':
                     if self.player.age >= self.player.genome.max_age:
                         self.show_colors = not self.show_colors
                         if self.show_colors:
                             self.old_perception = self.player.genome.perception
-                            self.player.genome.perception = {"r": True, "g": True, "b": True}
+                            self.player.own_genome().perception = ALL_COLORS
                         else:
-                            self.player.genome.perception = self.old_perception
+                            self.player.own_genome().perception = self.old_perception
 
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_x, mouse_y = pygame.mouse.get_pos()
+            elif event[0] == 'mouse':
+                button, mouse_x, mouse_y = event[1], event[2], event[3]
                 world_x = (mouse_x + self.camera_x) / self.zoom_factor
                 world_y = (mouse_y + self.camera_y) / self.zoom_factor
 
-                if event.button == 4:  # Scroll up to zoom in
+                if button == 4:  # Scroll up to zoom in
                     if self.player.age >= self.player.genome.max_age:
                         self.zoom_factor += self.zoom_speed
-                elif event.button == 5:  # Scroll down to zoom out
+                elif button == 5:  # Scroll down to zoom out
                     if self.player.age >= self.player.genome.max_age:
                         self.zoom_factor = max(self.zoom_factor - self.zoom_speed, 0.01)
                 else:
@@ -410,27 +557,26 @@ class Game:
                 self.camera_x = -mouse_x + world_x * self.zoom_factor
                 self.camera_y = -mouse_y + world_y * self.zoom_factor
 
-        keys = pygame.key.get_pressed()
-        speed = self.camera_speed * (2 if keys[pygame.K_LSHIFT] or keys[pygame.K_RSHIFT] else 1)
+        speed = self.camera_speed * (2 if keys & HELD_KEYS[pygame.K_LSHIFT] else 1)
 
-        if keys[pygame.K_a]:
+        if keys & HELD_KEYS[pygame.K_a]:
             if self.player.age >= self.player.genome.max_age:
                 self.camera_x -= speed
             else:
                 self.player.body.velocity = -self.player.genome.speed, self.player.body.velocity[1]
-        if keys[pygame.K_d]:
+        if keys & HELD_KEYS[pygame.K_d]:
             if self.player.age >= self.player.genome.max_age:
                 self.camera_x += speed
             else:
                 self.player.body.velocity = self.player.genome.speed, self.player.body.velocity[1]
 
-        if keys[pygame.K_w]:
+        if keys & HELD_KEYS[pygame.K_w]:
             if self.player.age >= self.player.genome.max_age:
                 self.camera_y -= speed
             else:
                 self.player.body.velocity = self.player.body.velocity[0], -self.player.genome.speed
 
-        if keys[pygame.K_s]:
+        if keys & HELD_KEYS[pygame.K_s]:
             if self.player.age >= self.player.genome.max_age:
                 self.camera_y += speed
             else:
@@ -441,34 +587,36 @@ class Game:
             self.update_camera()
 
     def update(self, delta_time):
+        profiler = self.profiler
+        profiling = profiler.enabled
+        profiler.begin()
+
         for cell in self.cells:
             cell.update()
-            cell.age += delta_time
-            nearby_objects = self.find_objects_within_radius(cell, cell.genome.detection_radius)
+        profiler.lap('cell_update')
 
-            for obj in nearby_objects:
-                # if particle check consumed by cell
-                if isinstance(obj, Particle) and distance_squared(cell, obj) < (cell.size ** 2):
-                    if obj in self.consumed_particles:
-                        pass
-                    else:
-                        cell.consume_particle(obj, self.consumed_particles)
+        # check particles consumed by cells
+        self.consume_particles()
+        profiler.lap('consumption')
 
-                # if cell check consumed by cell
-                if isinstance(obj, Cell) and (obj != cell) and (not obj.dead):
-                    if distance_squared(cell, obj) < ((cell.size + obj.size)**2):
-                            cell.consume_cell(obj, self.to_remove_cells)
+        # check cells consumed by cells they touch
+        self.consume_cells()
+        profiler.lap('contacts')
+
+        # every lap closes the phase it is named after, wrapping and dying count as aging
+        for cell in self.cells:
+            cell.age += delta_time
+            if profiling:
+                profiler.lap('aging')
 
             # check if cell can split
-            cell.split(self.cells, self.grid, self.grid_size ,self.space)
+            cell.split(self.cells, self.spatial, self.grid_size ,self.space, self.rng, self.cell_pool, self.max_cells, self.create_particles)
+            if profiling:
+                profiler.lap('split')
             if cell.is_player:
                 self.player = cell
                 self.zoom_factor = 50/cell.genome.size
 
-            # make npc cells decide where to go next
-            if cell != self.player:
-                cell.body.velocity = CellAI(cell.genome.r, cell.genome.g, cell.genome.b).decide(cell, nearby_objects)
-
             self.handle_wrap_around(cell)
 
             if cell.age >= cell.genome.max_age:
@@ -481,148 +629,472 @@ class Game:
                 if cell == self.player:
                     #  self.run = False
                     pass
+            if profiling:
+                profiler.lap('aging')
 
-        for p in self.consumed_particles[:]:  # Iterate over a copy
-            grid_x = int(p.position[0] // self.grid_size)
-            grid_y = int(p.position[1] // self.grid_size)
-
-            if (grid_x, grid_y) in self.grid:
-                try:
-                    self.grid[grid_x, grid_y].remove(p)
-                except ValueError:
-                    print(f"[Warning] Tried to remove particle from grid ({grid_x},{grid_y}) but it wasn't found.")
+        profiler.lap('aging')
 
-            self.consumed_particles.remove(p)
+        # make npc cells decide where to go next (and the player, on autopilot)
+        self.decide_npc_movement()
+        profiler.lap('ai')
 
-        # After looping, remove all marked cells
-        for dead in self.to_remove_cells:
+        # After looping, remove all marked cells, in a reproducible order since it decides where their particles go
+        order = {cell: i for i, cell in enumerate(self.cells)}
+        for dead in sorted(self.to_remove_cells, key=lambda cell: (order.get(cell, len(order)), tuple(cell.body.position))):
             dead.age = dead.genome.max_age
-            # dead.death(self.grid, self.grid_size)
+            # dead.death(self.particles)
             grid_x = int(dead.position[0]) // self.grid_size
             grid_y = int(dead.position[1]) // self.grid_size
             x = grid_x * self.grid_size
             y = grid_y * self.grid_size
 
             # Spawn 24 particles in this cell using create_particles
-            new_particles = self.create_particles(dead.mass, dead.color,(x, x + self.grid_size - 1), (y, y + self.grid_size - 1))
-            self.grid[(grid_x, grid_y)].extend(new_particles)
-            dead.remove_from_space(self.space)
+            self.create_particles(dead.mass, dead.color,(x, x + self.grid_size - 1), (y, y + self.grid_size - 1))
+            self.cell_pool.release(dead)
+            self.spatial.remove(dead)
             if dead in self.cells:
                 self.cells.remove(dead)
 
         self.to_remove_cells.clear()
+        # this tick's dead and split cells can be reused from the next one
+        self.cell_pool.recycle()
+        profiler.lap('removal')
+        self.particles.commit()
+        self.stream_chunks()
+        profiler.lap('streaming')
         self.update_grid()
-
-    def render(self):
+        profiler.lap('update_grid')
+        if profiling:
+            profiler.count('cells', len(self.cells))
+            profiler.count('particles', len(self.particles))
+            profiler.count('cell_mass', sum(cell.mass for cell in self.cells))
+
+    def find_neighbours(self, cells):
+        # the pairs decide_all works on, timed apart from it
+        pairs = self.spatial.particle_pairs(cells), self.spatial.cell_pairs(cells)
+        self.profiler.lap('neighbours')
+        return pairs
+
+    def decide_npc_movement(self):
+        # every cell counts for social forces, only npcs get the result written back
+        velocities = decide_all(self.cells, self.particles, *self.find_neighbours(self.cells))
+        for cell, velocity in zip(self.cells, velocities.tolist()):
+            if (cell != self.player or self.autopilot) and cell not in self.to_remove_cells:
+                cell.body.velocity = velocity
+
+    def render(self, alpha: float = 1.0):
+        """Draw the game as it is now, alpha of the way from its previous tick to the last one."""
+        self.draw(draw_state.capture(self), alpha)
+        self.profiler.lap('render')
+
+    def draw(self, state: draw_state.DrawState, alpha: float = 1.0):
+        # reads nothing of the simulation but state, so a pipelined loop can run the next tick meanwhile
         self.screen.fill((0, 0, 0))
 
-        # Calculate the camera offset
-        camera_offset = (-self.camera_x, -self.camera_y)
+        # Calculate the camera offset, following the player where it is drawn
+        camera_x, camera_y = state.camera
+        zoom_factor = state.zoom_factor
+        screen_width, screen_height = state.screen_size
+        if state.follow is not None:
+            (previous_x, previous_y), (player_x, player_y) = state.follow
+            if alpha < 1:
+                player_x, player_y = previous_x + (player_x - previous_x) * alpha, previous_y + (player_y - previous_y) * alpha
+            camera_x = player_x * zoom_factor - screen_width / 2
+            camera_y = player_y * zoom_factor - screen_height / 2
+        camera_offset = (-camera_x, -camera_y)
+
+        # zoomed out, food is drawn as a density map under the cells
+        if state.density is not None:
+            self.render_density(self.screen, state, camera_offset)
 
         # Draw cells with camera offsetsAWa
-        for cell in self.cells:
-            self.render_if_visible(cell, self.screen, camera_offset, self.screen_width, self.screen_height)
-            #cell.draw(self.screen, offset=camera_offset)
+        self.render_cells(self.screen, state, camera_offset, alpha)
 
         # Draw particles with camera offset
-        if self.zoom_factor < 1:
-            pass
-        else:
-            visible_particles = self.get_objects_in_screen_area('particle', screen_rect= self.screen.get_rect(), offset= camera_offset)
-            for particle in visible_particles:
-                self.render_if_visible(particle, self.screen, camera_offset, self.screen_width, self.screen_height)
-            # particle.draw_particle(self.screen, offset=camera_offset)
-
-        self.draw_walls(self.screen, offset=camera_offset)
+        self.render_particles(self.screen, state, camera_offset)
 
-        if self.show_grid:
-            self.draw_grid(self.screen, self.zoom_factor, offset=camera_offset)
+        self.render_static(self.screen, camera_offset, zoom_factor, state.show_grid)
 
         fps = self.clock.get_fps()
         fps_text = self.font.render(f"FPS: {fps:.2f}", True, pygame.Color("white"))
-        age_text = self.font.render(f"AGE: {int(self.player.age)} / {self.player.genome.max_age}", True, pygame.Color("white"))
-        age_text_rect = age_text.get_rect(center=(self.screen_width - 50, 20))
-        hs_text = self.font.render(f"GENERATION: {self.player.generation}", True, pygame.Color("white"))
-        hs_text_rect = hs_text.get_rect(center=(self.screen_width//2, 20))
+        age_text = self.font.render(f"AGE: {state.age} / {state.max_age}", True, pygame.Color("white"))
+        age_text_rect = age_text.get_rect(center=(screen_width - 50, 20))
+        hs_text = self.font.render(f"GENERATION: {state.generation}", True, pygame.Color("white"))
+        hs_text_rect = hs_text.get_rect(center=(screen_width//2, 20))
         self.screen.blit(fps_text, (10, 10))
         self.screen.blit(age_text, age_text_rect)
         self.screen.blit(hs_text, hs_text_rect)
 
-        pygame.display.flip()
+        if state.show_profiler:
+            self.draw_profiler(self.screen, state.tick_count)
 
-    def render_if_visible(self, obj, surface, camera_offset, screen_width, screen_height):
-        # Assume obj has a `draw(surface, camera_offset)` method
-        # and a `.position` or `.body.position` attribute in world space
-
-        # Get object's position
-        if hasattr(obj, "body"):  # e.g., a physics object like a Cell
-            pos = obj.body.position
-            r,g,b = obj.genome.r, obj.genome.g, obj.genome.b
-        elif hasattr(obj, "position"):  # e.g., a particle or wall
-            pos = obj.position
-            r,g,b = obj.r, obj.g, obj.b
-        else:
-            return  # Can't render if position isn't known
+        pygame.display.flip()
 
-        # Compute screen-relative position
-        screen_x = pos[0]*self.zoom_factor + camera_offset[0]
-        screen_y = pos[1]*self.zoom_factor + camera_offset[1]
+    def draw_profiler(self, surface, tick_count):
+        # the text only changes twice a second so the overlay stays readable and cheap
+        if tick_count % 30 == 0 or not self.profiler_text:
+            self.profiler_text = [self.font.render(line, True, pygame.Color("white")) for line in self.profiler.overlay_lines()]
+
+        for i, text in enumerate(self.profiler_text):
+            surface.blit(text, (10, 40 + i * 20))
+
+    def visible_density(self, camera_offset):
+        # particle mass per bucket and color around the screen, from the store's and chunk manager's counts,
+        # and the grid position of the first bucket
+        # a bucket more on every side, the camera moves a little between ticks
+        scaled_grid_size = self.grid_size * self.zoom_factor
+        min_grid_x = max(int(-camera_offset[0] // scaled_grid_size) - 1, 0)
+        max_grid_x = min(int((self.screen_width - camera_offset[0]) // scaled_grid_size) + 1, self.num_columns - 1)
+        min_grid_y = max(int(-camera_offset[1] // scaled_grid_size) - 1, 0)
+        max_grid_y = min(int((self.screen_height - camera_offset[1]) // scaled_grid_size) + 1, self.num_rows - 1)
+        if min_grid_x > max_grid_x or min_grid_y > max_grid_y:
+            return np.zeros((0, 0, 3), np.int64), (0, 0)
+
+        area = slice(min_grid_x, max_grid_x + 1), slice(min_grid_y, max_grid_y + 1)
+        manager = self.chunk_manager
+        mass = (self.particles.bucket_mass.reshape(self.num_columns, self.num_rows, 3)[area]
+                + manager.dormant_mass.reshape(self.num_columns, self.num_rows, 3)[area]
+                + manager.collapsed_mass.reshape(self.num_columns, self.num_rows, 3)[area])
+        return mass, (min_grid_x, min_grid_y)
+
+    def render_density(self, surface, state, camera_offset):
+        """Food as one tile per grid bucket, shaded by the particle mass of each color in it."""
+        mass = state.density
+        if mass.size == 0:
+            return
+
+        # the perceived colors of the three food colors, mixed by mass and dimmed below the spawn density
+        palette = perceive_colors(np.eye(3) * 255, state.perception).astype(np.float64)
+        total = mass.sum(axis=2, keepdims=True)
+        shade = np.minimum(total / self.particle_density, 1.0) / np.maximum(total, 1)
+        tiles = pygame.surfarray.make_surface((mass @ palette * shade).astype(np.uint8))
+
+        scaled_grid_size = self.grid_size * state.zoom_factor
+        min_grid_x, min_grid_y = state.density_origin
+        size = round(tiles.get_width() * scaled_grid_size), round(tiles.get_height() * scaled_grid_size)
+        position = min_grid_x * scaled_grid_size + camera_offset[0], min_grid_y * scaled_grid_size + camera_offset[1]
+        surface.blit(pygame.transform.scale(tiles, size), position)
+
+    def render_static(self, surface, camera_offset, zoom_factor, show_grid):
+        # walls and grid from cached tiles of the zoomed world, on whole camera pixels;
+        # while tiles are missing a few are drawn per frame and the lines directly
+        layer = zoom_factor, surface.get_size()
+        if layer != self.static_tiles_for:
+            self.static_tiles.clear()
+            self.static_tiles_for = layer
+
+        size = self.static_tile_size
+        offset_x, offset_y = math.floor(camera_offset[0]), math.floor(camera_offset[1])
+        width, height = surface.get_size()
+        keys = [(zoom_factor, show_grid, tile_x, tile_y)
+                for tile_x in range(-offset_x // size, (width - offset_x) // size + 1)
+                for tile_y in range(-offset_y // size, (height - offset_y) // size + 1)]
+
+        missing = [key for key in keys if key not in self.static_tiles]
+        if len(missing) > self.static_tiles_per_frame:
+            # new tiles are blitted right away, pygame prepares their RLE on the first blit
+            for key in missing[:self.static_tiles_per_frame]:
+                tile = self.static_tiles.get(key, self.render_static_tile)
+                if tile is not None:
+                    surface.blit(tile, (key[2] * size + offset_x, key[3] * size + offset_y))
+            # on the same whole pixels as the tiles, so lines don't shift once the tiles are in
+            self.draw_walls(surface, zoom_factor, offset=(offset_x, offset_y))
+            if show_grid:
+                self.draw_grid(surface, zoom_factor, offset=(offset_x, offset_y))
+            return
+
+        blits = []
+        for key in keys:
+            tile = self.static_tiles.get(key, self.render_static_tile)
+            if tile is not None:
+                blits.append((tile, (key[2] * size + offset_x, key[3] * size + offset_y)))
+        surface.blits(blits, doreturn=False)
+
+    def render_static_tile(self, zoom_factor, show_grid, tile_x, tile_y):
+        # None for tiles outside the walls and, without the grid, for all but the ones the walls cross
+        size = self.static_tile_size
+        area = pygame.Rect(tile_x * size, tile_y * size, size, size)
+        walls = pygame.Rect(-2, -2, self.world_width * zoom_factor + 4, self.world_height * zoom_factor + 4)
+        if not area.colliderect(walls) or (not show_grid and walls.inflate(-8, -8).contains(area)):
+            return None
+
+        key_color = (1, 1, 1)
+        tile = pygame.Surface((size, size))
+        tile.fill(key_color)
+        offset = (-tile_x * size, -tile_y * size)
+        self.draw_walls(tile, zoom_factor, offset=offset)
+        if show_grid:
+            self.draw_grid(tile, zoom_factor, offset=offset)
+
+        if pygame.display.get_surface() is not None:
+            tile = tile.convert()
+        tile.set_colorkey(key_color, pygame.RLEACCEL)
+        return tile
+
+    def render_cells(self, surface, state, camera_offset, alpha):
+        """Draw every visible cell from its cached sprite (see Cell.render_sprite) in one blits call."""
+        zoom = state.zoom_factor
+        screen_width, screen_height = state.screen_size
+        positions = state.positions
+        if alpha < 1:
+            positions = state.previous_positions + (positions - state.previous_positions) * alpha
+        screen_x = positions[:, 0] * zoom + camera_offset[0]
+        screen_y = positions[:, 1] * zoom + camera_offset[1]
 
-        # Check if object is within visible screen bounds (+buffer optional)
         buffer = 50  # To avoid pop-in if needed
-        if (-buffer <= screen_x <= screen_width + buffer) and (-buffer <= screen_y <= screen_height + buffer):
-            # TODO optimize perceived color
-            perceived_color = self.simulate_vision((r,g,b))
-            obj.draw(perceived_color, surface, self.zoom_factor, camera_offset)
-
-    def run_game_loop(self):
-        prev_cell_len = 0
-        prev_particle_len = 5000
-        prev_total_cell_mass = 0
-        prev_total_mass = 0
-        prev_zoom_factor = 0
+        visible = np.flatnonzero((-buffer <= screen_x) & (screen_x <= screen_width + buffer)
+                                 & (-buffer <= screen_y) & (screen_y <= screen_height + buffer))
+        blits = []
+        for x, y, size, thickness, color, animation in zip(screen_x[visible].tolist(), screen_y[visible].tolist(),
+                                                           state.sizes[visible].tolist(), state.thicknesses[visible].tolist(),
+                                                           map(tuple, state.colors[visible].tolist()), state.animations[visible].tolist()):
+            perceived_color = self.perceived_colors.get(state.perception, color)
+            key = Cell.sprite_key(size, thickness, animation, perceived_color, zoom)
+            sprite = self.cell_sprites.get(key, Cell.render_sprite)
+            center = Cell.sprite_center(key[0])
+            blits.append((sprite, (int(x) - center, int(y) - center)))
+        surface.blits(blits, doreturn=False)
+
+    def step_space(self, dt):
+        # substeps shorter physics steps per tick keep fast cells from tunnelling and stacks stable
+        for _ in range(self.substeps):
+            self.space.step(dt / self.substeps)
+
+    def step(self, n_ticks: int = 1, dt: float = 1 / 60):
+        """Advance the simulation n_ticks fixed steps with no rendering or frame cap, returns ticks per second."""
+        start = time.perf_counter()
+        for _ in range(n_ticks):
+            self.tick(dt)
+            self.profiler.end_frame()
+        elapsed = time.perf_counter() - start
+
+        return n_ticks / elapsed if elapsed > 0 else float("inf")
+
+    def particle_outline(self, radius):
+        # pixel offsets from the center that pygame.draw.circle sets for a particle of this radius
+        if radius != self.particle_outline_radius:
+            center = int(radius) + 2
+            stamp = pygame.Surface((2 * center + 1, 2 * center + 1))
+            pygame.draw.circle(stamp, (255, 255, 255), (center, center), radius, width= 1)
+            x, y = np.nonzero(pygame.surfarray.array2d(stamp))
+            self.particle_outline_offsets = x - center, y - center
+            self.particle_outline_radius = radius
+        return self.particle_outline_offsets
+
+    def render_particles(self, surface, state, camera_offset):
+        """Draw food particles straight into the surface's pixels, every particle at once."""
+        radius = PARTICLE_SIZE * state.zoom_factor
+        if radius < 1 or len(state.particle_positions) == 0:
+            return
+
+        # Compute screen-relative positions for the whole slice
+        screen_x = state.particle_positions[:, 0] * state.zoom_factor + camera_offset[0]
+        screen_y = state.particle_positions[:, 1] * state.zoom_factor + camera_offset[1]
+
+        screen_width, screen_height = state.screen_size
+        buffer = 50  # To avoid pop-in if needed
+        visible = (-buffer <= screen_x) & (screen_x <= screen_width + buffer) & (-buffer <= screen_y) & (screen_y <= screen_height + buffer)
+        rgb = state.particle_colors[visible]
+        if len(rgb) == 0:
+            return
+
+        # perceived colors are worked out once per distinct color, as pixel values of the surface
+        packed = (rgb[:, 0].astype(np.int32) << 16) | (rgb[:, 1].astype(np.int32) << 8) | rgb[:, 2]
+        colors, inverse = np.unique(packed, return_inverse=True)
+        colors = np.stack(((colors >> 16) & 255, (colors >> 8) & 255, colors & 255), axis=1)
+        perceived = pygame.surfarray.map_array(surface, perceive_colors(colors, state.perception)[None])[0]
+
+        # the outline of a circle around (int(x), int(y)) for every particle, clipped to the surface
+        offset_x, offset_y = self.particle_outline(radius)
+        x = (screen_x[visible].astype(np.int64)[:, None] + offset_x).ravel()
+        y = (screen_y[visible].astype(np.int64)[:, None] + offset_y).ravel()
+        color = np.repeat(inverse.ravel(), len(offset_x))
+        width, height = surface.get_size()
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+
+        pixels = pygame.surfarray.pixels2d(surface)
+        pixels[x[inside], y[inside]] = perceived[color[inside]]
+        # the surface stays locked while the pixel view exists
+        del pixels
+
+    def tick(self, dt):
+        # one fixed step of the whole simulation
+        self.update(dt)
+        self.step_space(dt)
+        self.profiler.lap('space_step')
+        self.tick_count += 1
+        if self.snapshots is not None:
+            self.snapshots.update(self)
+            self.profiler.lap('snapshot')
+
+    def run_ticks(self, ticks, keys, events, replay_log: ReplayLog = None):
+        # a frame's worth of ticks, its input goes to the first of them
+        for _ in range(ticks):
+            self.apply_input(keys, events)
+            if replay_log is not None:
+                replay_log.record(self.fixed_dt, keys, events)
+            events = []
+
+            self.previous_positions = {cell: tuple(cell.body.position) for cell in self.cells}
+            self.tick(self.fixed_dt)
+
+    def run_game_loop(self, replay_log: ReplayLog = None):
+        # fixed ticks of self.fixed_dt as real time passes, at most max_catch_up per frame, drawn in between;
+        # pipelined, the ticks run on a worker thread while the last frame's DrawState is drawn
+        accumulator = 0.0
+        previous_time = time.perf_counter()
+        pending_events = []
+
+        def simulate(ticks, keys, events):
+            self.run_ticks(ticks, keys, events, replay_log)
+            state = draw_state.capture(self)
+            self.profiler.lap('draw_state')
+            return state
+
+        simulation = ThreadPoolExecutor(max_workers=1) if self.pipelined else None
+        # the ticks in flight on the worker and the alpha to draw them at, then the last ones that finished
+        ticking, ticking_alpha = None, 1.0
+        state, state_alpha = None, 1.0
+        render_time = None
         while self.run:
-            delta_time = self.clock.tick(60) / 1000.0
-            current_time = pygame.time.get_ticks()
-            delta_time = (current_time - self.prev_time) / 1000.0
-            self.prev_time = current_time
-
-            self.handle_input()
-            self.update(delta_time)
-            self.render()
-            self.space.step(delta_time)
-
-            '''if self.zoom_factor != prev_zoom_factor:
-                print("Zoom level:", self.zoom_factor)
-                prev_zoom_factor = self.zoom_factor'''
-
-            '''if prev_cell_len != len(self.cells):
-                print("Amount of cells: ", len(self.cells))
-                prev_cell_len = len(self.cells)'''
-
-            # check if any grid cells are referencing the same list
-
-            '''if prev_particle_len != len(self.particles):
-                print("Amount of particles:", len(self.particles))
-                prev_particle_len = len(self.particles)
-
-            total_cell_mass = 0
-            for cell in self.cells:
-                total_cell_mass += cell.mass
-
-            if prev_total_cell_mass != total_cell_mass:
-                print("Total cell mass:", total_cell_mass)
-
-            total_mass = total_cell_mass + len(self.particles)
-            print("Total Mass:", total_mass)
-            print("\n")'''
-
-
-
-
+            self.clock.tick(self.render_fps)
+            now = time.perf_counter()
+            accumulator += now - previous_time
+            previous_time = now
+
+            # only one thread uses the profiler at a time, the render time of a pipelined frame is added once its ticks are done
+            if ticking is not None:
+                state, state_alpha = ticking.result(), ticking_alpha
+                if render_time is not None:
+                    self.profiler.record('render', render_time)
+                self.profiler.end_frame()
+
+            self.profiler.begin()
+            keys, events = self.poll_input()
+            # events reach the first tick that runs, which may be a later frame's
+            pending_events.extend(events)
+            self.profiler.lap('input')
+
+            ticks = 0
+            while accumulator >= self.fixed_dt and ticks < self.max_catch_up:
+                accumulator -= self.fixed_dt
+                ticks += 1
+            if ticks == self.max_catch_up:
+                accumulator = min(accumulator, self.fixed_dt)
+            events = pending_events
+            if ticks:
+                pending_events = []
+
+            if simulation is None:
+                self.run_ticks(ticks, keys, events, replay_log)
+                self.render(accumulator / self.fixed_dt)
+                self.profiler.end_frame()
+                continue
+
+            ticking, ticking_alpha = simulation.submit(simulate, ticks, keys, events), accumulator / self.fixed_dt
+            if state is not None:
+                start = time.perf_counter()
+                self.draw(state, state_alpha)
+                render_time = time.perf_counter() - start
+
+        if simulation is not None:
+            if ticking is not None:
+                ticking.result()
+            simulation.shutdown()
+
+        if replay_log is not None:
+            replay_log.digest = self.state_digest()
+
+        self.close()
         pygame.quit()
 
+    def close(self):
+        # a snapshot still being written reads evicted chunk files, finish it before they are deleted
+        if self.snapshots is not None:
+            self.snapshots.close()
+        self.chunk_manager.close()
+
+    def replay(self, replay_log: ReplayLog, max_ticks: int = None):
+        """Simulate a recorded run tick for tick without rendering, returns ticks per second."""
+        start = time.perf_counter()
+        ticks = 0
+        for dt, keys, events in replay_log.frames():
+            if max_ticks is not None and ticks >= max_ticks:
+                break
+            self.apply_input(keys, events)
+            self.step(1, dt)
+            ticks += 1
+        elapsed = time.perf_counter() - start
+
+        return ticks / elapsed if elapsed > 0 else float("inf")
+
+    def state_digest(self):
+        """Short hash of the simulation state, equal for two runs that went exactly the same way."""
+        digest = hashlib.sha1()
+        digest.update(np.array([(cell.body.position[0], cell.body.position[1], cell.mass, cell.generation) for cell in self.cells],
+                               np.float64).tobytes())
+        n = self.particles.count
+        alive = self.particles.alive[:n]
+        digest.update(self.particles.x[:n][alive].tobytes())
+        digest.update(self.particles.y[:n][alive].tobytes())
+        return digest.hexdigest()[:16]
+
 if __name__ == "__main__":
-    pygame.init()
-    game = Game()
-    game.run_game_loop()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action="store_true", help="simulate without a window")
+    parser.add_argument("--ticks", type=int, default=None, help="ticks to simulate when headless (3600) or to replay (all)")
+    parser.add_argument("--dt", type=float, default=1 / 60, help="fixed time step when headless")
+    parser.add_argument("--chunks", type=int, nargs=2, default=(1, 1), metavar=("X", "Y"), help="world size in chunks")
+    parser.add_argument("--profile", metavar="FILE", help="profile every frame and write the timings to FILE at exit")
+    parser.add_argument("--seed", type=int, default=None, help="run seed, random if not given")
+    parser.add_argument("--fixed-dt", type=float, default=1 / 60, help="length of a simulation tick when windowed")
+    parser.add_argument("--substeps", type=int, default=1, help="physics steps per tick")
+    parser.add_argument("--max-catch-up", type=int, default=5, help="most ticks simulated in one frame after a stall")
+    parser.add_argument("--render-fps", type=int, default=60, help="frame rate cap, 0 for none")
+    parser.add_argument("--pipelined", action="store_true", help="simulate on a worker thread while the last tick is drawn")
+    parser.add_argument("--record", metavar="FILE", help="record the run's input to a replay log")
+    parser.add_argument("--replay", metavar="FILE", help="replay a recorded run headless, up to --ticks ticks if given")
+    parser.add_argument("--load", metavar="DIR", help="continue from a snapshot instead of a new world")
+    parser.add_argument("--snapshot", metavar="DIR", help="keep a snapshot of the world in DIR, saved in the background")
+    parser.add_argument("--snapshot-every", type=int, default=3600, metavar="TICKS", help="ticks between snapshots")
+    args = parser.parse_args()
+
+    def build_game(**kwargs):
+        if args.load:
+            game = Game.from_settings(snapshot.read_meta(args.load)['settings'], **kwargs)
+            snapshot.load(game, args.load)
+        else:
+            game = Game(num_chunks=tuple(args.chunks), seed=args.seed, substeps=args.substeps, **kwargs)
+        if args.snapshot:
+            game.snapshots = snapshot.BackgroundSnapshots(args.snapshot, args.snapshot_every)
+        return game
+
+    if args.replay:
+        replay_log = ReplayLog.load(args.replay)
+        game = Game.from_settings(replay_log.settings, headless=True, autopilot=False)
+        game.profiler.enabled = bool(args.profile)
+        tps = game.replay(replay_log, args.ticks)
+        game.close()
+        print(f"replayed {game.tick_count} of {len(replay_log)} ticks at {tps:.0f} ticks/s, {len(game.cells)} cells left")
+        if game.tick_count == len(replay_log) and replay_log.digest:
+            print("state matches the recording" if game.state_digest() == replay_log.digest else "state DIFFERS from the recording")
+    elif args.headless:
+        game = build_game(headless=True)
+        game.profiler.enabled = bool(args.profile)
+        ticks = args.ticks or 3600
+        tps = game.step(ticks, args.dt)
+        game.close()
+        print(f"{ticks} ticks at {tps:.0f} ticks/s ({tps * args.dt:.0f}x real time), {len(game.cells)} cells left")
+    else:
+        pygame.init()
+        game = build_game(fixed_dt=args.fixed_dt, max_catch_up=args.max_catch_up, render_fps=args.render_fps,
+                          pipelined=args.pipelined)
+        game.profiler.enabled = bool(args.profile)
+        replay_log = ReplayLog(game.settings) if args.record else None
+        game.run_game_loop(replay_log)
+        if replay_log is not None:
+            replay_log.save(args.record)
+            print(f"recorded {len(replay_log)} ticks to {args.record}")
+
+    if args.profile:
+        game.profiler.export(args.profile)
@@ -0,0 +1,155 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from cell import ColorFlags, ColorWeights, Genome
+
+# ColorFlags bits, as uint8 so ~R is a uint8 mask too
+R, G, B = np.uint8(1), np.uint8(2), np.uint8(4)
+
+
+class GenomeArrays:
+    """A population of genomes as one array per Genome field, for batch work like mutate().
+
+    The per color maps are kept the way Genome keeps them: behavior as an (n, 3) float
+    array and the boolean maps as ColorFlags bitmasks.
+    """
+
+    INTS = ('r', 'g', 'b', 'size', 'start_mass', 'max_mass', 'thickness', 'strength', 'speed', 'detection_radius',
+            'max_age', 'charge')
+    FLAGS = ('exploding', 'multi_cell')
+    COLOR_FLAGS = ('p_consumption', 'c_consumption', 'perception')
+
+    def __init__(self, columns: dict):
+        # field name -> array, all the same length
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns['r'])
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['columns'][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    @classmethod
+    def from_genomes(cls, genomes: list):
+        columns = {name: np.array([getattr(genome, name) for genome in genomes], np.int64) for name in cls.INTS}
+        columns['mutation_rate'] = np.array([genome.mutation_rate for genome in genomes], np.float64)
+        for name in cls.FLAGS:
+            columns[name] = np.array([getattr(genome, name) for genome in genomes], bool)
+        columns['behavior'] = np.array([genome.behavior for genome in genomes], np.float64).reshape(-1, 3)
+        for name in cls.COLOR_FLAGS:
+            columns[name] = np.array([getattr(genome, name) for genome in genomes], np.uint8)
+        return cls(columns)
+
+    @classmethod
+    def repeat(cls, genome: Genome, count: int):
+        """count copies of one genome, the usual start of an offline evolution run."""
+        return cls({name: np.repeat(array, count, axis=0) for name, array in cls.from_genomes([genome]).columns.items()})
+
+    def copy(self):
+        return GenomeArrays({name: array.copy() for name, array in self.columns.items()})
+
+    def to_genomes(self):
+        fields = {name: self.columns[name].tolist() for name in self.INTS + ('mutation_rate',) + self.FLAGS}
+        fields['behavior'] = [ColorWeights(weights) for weights in self.columns['behavior'].tolist()]
+        for name in self.COLOR_FLAGS:
+            fields[name] = [ColorFlags(flags) for flags in self.columns[name].tolist()]
+
+        genomes = []
+        for i in range(len(self)):
+            genome = Genome.__new__(Genome)
+            for name, values in fields.items():
+                setattr(genome, name, values[i])
+            genomes.append(genome)
+        return genomes
+
+    def mutate(self, rng: np.random.Generator):
+        """Genome.mutate_gene for every genome at once, in place.
+
+        Every rule rolls against its genome's mutation_rate like mutate_gene does, with all
+        random numbers drawn up front and the red, green and special rule sets applied as
+        masks, so the outcome has the same distribution (not the same random stream).
+        """
+        n = len(self)
+        rolls = rng.random((n, 12)) < self.mutation_rate[:, None]
+        uniform = rng.random((n, 3))
+        steps = rng.integers(1, 6, (n, 3))
+
+        # same branch order as mutate_gene: red if r == 255, else green if g == 255, else special
+        red = self.r == 255
+        green = ~red & (self.g == 255)
+        special = ~red & ~green
+        behavior, size, speed, max_age = self.behavior, self.size, self.speed, self.max_age
+        p_consumption, c_consumption, perception = self.p_consumption, self.c_consumption, self.perception
+
+        # red: behaviour re-rolled, faster, smaller, loses cell appetite and blue sight
+        rule = red[:, None] & rolls[:, :3]
+        behavior[rule] = (uniform * 2 - 1)[rule]
+        rule = red & rolls[:, 3]
+        speed[rule] += steps[rule, 0]
+        rule = red & rolls[:, 4]
+        size[rule] = np.maximum(size[rule] - steps[rule, 1], 5)
+        c_consumption[red & rolls[:, 5]] &= ~R
+        c_consumption[red & rolls[:, 6]] &= ~G
+        perception[red & rolls[:, 7] & ((perception & (B | G)) != (B | G))] |= R
+        perception[red & rolls[:, 8]] &= ~B
+
+        # green: hunts red, bigger, faster, older, eats green particles
+        rule = green & rolls[:, 0]
+        behavior[rule, 0] += uniform[rule, 0] * 3 - 1
+        rule = green[:, None] & rolls[:, 1:3]
+        behavior[:, 1:][rule] = (uniform[:, 1:] * 2 - 1)[rule]
+        rule = green & rolls[:, 3]
+        size[rule] += steps[rule, 0]
+        rule = green & rolls[:, 4]
+        speed[rule] += steps[rule, 1]
+        rule = green & rolls[:, 5]
+        max_age[rule] += steps[rule, 2]
+        p_consumption[green & rolls[:, 6]] |= G
+        c_consumption[green & rolls[:, 7]] |= R
+        p_consumption[green & rolls[:, 8]] &= ~R
+        perception[green & rolls[:, 9] & ((perception & (R | B)) != (R | B))] |= G
+
+        # special: behaviour drifts, resets, explodes, thinner, shorter lived and smaller
+        rule = special[:, None] & rolls[:, :3]
+        behavior[rule] += (uniform * 2 - 1)[rule]
+        p_consumption[special & rolls[:, 3]] |= R
+        c_consumption[special & rolls[:, 4]] |= G
+        perception[special & rolls[:, 5]] &= ~R
+        perception[special & rolls[:, 6]] &= ~G
+        # sees blue if it can't see red, after the two rules above
+        perception[special & rolls[:, 7] & ((perception & R) == 0)] |= B
+        self.exploding[special & rolls[:, 8]] = True
+        self.thickness[special & rolls[:, 9]] = 1
+        rule = special & rolls[:, 10]
+        max_age[rule] = np.maximum(max_age[rule] - steps[rule, 0], 30)
+        rule = special & rolls[:, 11]
+        size[rule] = np.maximum(size[rule] - steps[rule, 1], 5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="compare batch mutation throughput with Genome.mutate_gene")
+    parser.add_argument("--count", type=int, default=1_000_000, help="genomes to mutate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start_genomes = [Genome(), Genome(g=0, b=0), Genome(r=0, b=0), Genome(r=0, g=0)]
+    population = GenomeArrays.from_genomes(start_genomes * (args.count // len(start_genomes)))
+
+    start = time.perf_counter()
+    population.mutate(np.random.default_rng(args.seed))
+    batch = time.perf_counter() - start
+
+    sample = min(args.count, 100_000)
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    for i in range(sample):
+        start_genomes[i % len(start_genomes)].mutated(rng)
+    single = (time.perf_counter() - start) * args.count / sample
+
+    print(f"{len(population)} genomes: batch {batch:.2f}s, mutate_gene {single:.2f}s (estimated), {single / batch:.0f}x faster")
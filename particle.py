@@ -1,30 +1,231 @@
-import pygame
-
-class Particle:
-    def __init__(self, position: tuple, r: int, g: int, b: int, mass: int = 1, size: int = 1):
-        self.position = position
-        self.r = r
-        self.g = g
-        self.b = b
-        self.color = self.get_dominant_color()
-
-        self.mass = mass
-        self.size = size
-
-    def draw(self, perceived_color, surface, zoom_factor = 1.0, offset=(0, 0)):
-        if self.size * zoom_factor < 1:
-            pass
-        else:
-            x, y = self.position[0]*zoom_factor + offset[0], self.position[1]*zoom_factor + offset[1]
-            pygame.draw.circle(surface, perceived_color, (int(x), int(y)), self.size*zoom_factor, width= 1)
-
-
-    def get_dominant_color(self):
-        max_val = max(self.r, self.g, self.b)
-
-        if self.r == max_val:
-            return 'r'
-        elif self.g == max_val:
-            return 'g'
-        else:
-            return 'b'
\ No newline at end of file
+import numpy as np
+
+# dominant color characters, indexed the same way as the rgb columns
+COLORS = ('r', 'g', 'b')
+COLOR_INDEX = {'r': 0, 'g': 1, 'b': 2}
+
+# every food particle currently has the same radius
+PARTICLE_SIZE = 1
+
+
+def dominant_color_indices(rgb):
+    # same tie breaking as Cell.get_dominant_color: r wins over g wins over b
+    return np.argmax(rgb, axis=1).astype(np.uint8)
+
+
+def color_flags(flags):
+    """Unpack r/g/b bitmasks (ColorFlags) into an (n, 3) bool array."""
+    return (np.asarray(flags, np.int64).reshape(-1, 1) >> np.arange(3)) & 1 == 1
+
+
+def expand_ranges(starts, ends):
+    """Concatenate arange(start, end) for every row, returns (row of each index, indices)."""
+    lengths = np.maximum(ends - starts, 0)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return rows, np.repeat(starts, lengths) + offsets
+
+
+def neighbourhood_columns(grid_x, grid_y, grid_radius, num_columns, num_rows):
+    """Split square neighbourhoods into one bucket range per grid column.
+
+    Buckets outside the grid are skipped, not wrapped. Returns the neighbourhood each
+    column belongs to and its first and one-past-last bucket numbers.
+    """
+    grid_x, grid_y, grid_radius = np.broadcast_arrays(np.atleast_1d(grid_x), np.atleast_1d(grid_y), np.atleast_1d(grid_radius))
+    widths = 2 * grid_radius + 1
+    owner, offset = expand_ranges(np.zeros(len(widths), np.int64), widths)
+    column = grid_x[owner] + offset - grid_radius[owner]
+    low = np.maximum(grid_y[owner] - grid_radius[owner], 0)
+    high = np.minimum(grid_y[owner] + grid_radius[owner], num_rows - 1)
+
+    valid = (column >= 0) & (column < num_columns) & (low <= high)
+    owner, column, low, high = owner[valid], column[valid], low[valid], high[valid]
+    return owner, column * num_rows + low, column * num_rows + high + 1
+
+
+class ParticleStore:
+    """Food particles as contiguous arrays, sorted so every grid bucket is one index range.
+
+    Buckets are numbered column by column (grid_x * num_rows + grid_y) so a square
+    neighbourhood is one slice per column. Removed particles are tombstoned and particles
+    added since the last compaction sit in a small tail region with its own bucket ranges,
+    so a frame only pays for what changed; the arrays are compacted and fully re-sorted
+    once enough tombstones or tail entries pile up. Additions only become visible to
+    queries after commit(), and indices are only stable between commits.
+    """
+
+    # compact once this fraction of the slots are tombstones or unsorted tail entries
+    compact_fraction = 0.25
+    # parts of every spawned batch that get the first, second and third palette color
+    mix = (50, 35, 15)
+
+    def __init__(self, num_columns: int, num_rows: int, grid_size: int, capacity: int = 1024):
+        self.num_columns = num_columns
+        self.num_rows = num_rows
+        self.grid_size = grid_size
+        self.num_buckets = num_columns * num_rows
+
+        self.count = 0
+        self.dead = 0
+        self.x = np.empty(capacity, np.float32)
+        self.y = np.empty(capacity, np.float32)
+        self.rgb = np.empty((capacity, 3), np.uint8)
+        self.color = np.empty(capacity, np.uint8)
+        self.mass = np.empty(capacity, np.uint16)
+        self.bucket = np.empty(capacity, np.int32)
+        self.alive = np.empty(capacity, bool)
+
+        # [0, main_end) is sorted by bucket, starts[b]:starts[b + 1] is the index range of bucket b
+        # [main_end, tail_end) is sorted the same way with tail_starts
+        # [tail_end, count) was added this frame and is not visible yet
+        self.main_end = 0
+        self.tail_end = 0
+        self.starts = np.zeros(self.num_buckets + 1, np.int64)
+        self.tail_starts = np.zeros(self.num_buckets + 1, np.int64)
+
+        # mass of the alive particles per bucket and dominant color, kept up to date by add and remove
+        self.bucket_mass = np.zeros((self.num_buckets, 3), np.int64)
+
+        # spawn positions and colors, replaced by the game's seeded particle stream
+        self.rng = np.random.default_rng()
+
+    def __len__(self):
+        return self.count - self.dead
+
+    @property
+    def nbytes(self):
+        n = self.count
+        return (self.x[:n].nbytes + self.y[:n].nbytes + self.rgb[:n].nbytes + self.color[:n].nbytes
+                + self.mass[:n].nbytes + self.bucket[:n].nbytes + self.alive[:n].nbytes)
+
+    @property
+    def pending(self):
+        # added since the last commit, counted in bucket_mass but not visible to queries yet
+        return self.count - self.tail_end
+
+    def bucket_of(self, x, y):
+        # clamp to the initialized grid like the spatial hash does for cells
+        grid_x = np.clip((np.asarray(x) // self.grid_size).astype(np.int32), 0, self.num_columns - 1)
+        grid_y = np.clip((np.asarray(y) // self.grid_size).astype(np.int32), 0, self.num_rows - 1)
+        return grid_x * self.num_rows + grid_y
+
+    def _reserve(self, extra):
+        needed = self.count + extra
+        capacity = len(self.x)
+        if needed <= capacity:
+            return
+
+        while capacity < needed:
+            capacity *= 2
+        for name in ('x', 'y', 'rgb', 'color', 'mass', 'bucket', 'alive'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def add(self, x, y, rgb, mass=1):
+        x = np.asarray(x, np.float32).ravel()
+        n = len(x)
+        if n == 0:
+            return
+
+        self._reserve(n)
+        start, end = self.count, self.count + n
+        rgb = np.broadcast_to(np.asarray(rgb, np.uint8), (n, 3))
+        self.x[start:end] = x
+        self.y[start:end] = y
+        self.rgb[start:end] = rgb
+        self.color[start:end] = dominant_color_indices(rgb)
+        self.mass[start:end] = mass
+        self.bucket[start:end] = self.bucket_of(self.x[start:end], self.y[start:end])
+        self.alive[start:end] = True
+        np.add.at(self.bucket_mass, (self.bucket[start:end], self.color[start:end]), self.mass[start:end])
+        self.count = end
+
+    def spawn(self, count, palette, x_bounds, y_bounds):
+        # 50% first palette color, 35% second, 15% third with the default mix
+        count = int(count)
+        if count <= 0:
+            return
+
+        x = self.rng.integers(x_bounds[0], x_bounds[1] + 1, count)
+        y = self.rng.integers(y_bounds[0], y_bounds[1] + 1, count)
+        thresholds = np.cumsum(self.mix)
+        roll = self.rng.integers(1, thresholds[-1] + 1, count)
+        choice = np.searchsorted(thresholds[:-1], roll)
+        self.add(x, y, np.asarray(palette, np.uint8)[choice])
+
+    def remove(self, indices):
+        """Tombstone particles, O(len(indices)). Queries skip them right away."""
+        indices = np.asarray(indices, np.int64)
+        if len(indices) == 0:
+            return
+
+        indices = np.unique(indices[self.alive[indices]])
+        self.alive[indices] = False
+        self.dead += len(indices)
+        np.subtract.at(self.bucket_mass, (self.bucket[indices], self.color[indices]), self.mass[indices])
+
+    def _take(self, order, start=0):
+        # permute (or, with fewer indices, compact) the slots from start onwards
+        end = start + len(order)
+        for name in ('x', 'y', 'rgb', 'color', 'mass', 'bucket', 'alive'):
+            array = getattr(self, name)
+            array[start:end] = array[order]
+        return end
+
+    def _ranges(self, first, end):
+        counts = np.bincount(self.bucket[first:end], minlength=self.num_buckets)
+        starts = np.empty(self.num_buckets + 1, np.int64)
+        starts[0] = first
+        np.cumsum(counts, out=starts[1:])
+        starts[1:] += first
+        return starts
+
+    def compact(self):
+        """Drop tombstones and merge the tail, leaving one fully sorted region."""
+        alive = np.flatnonzero(self.alive[:self.count])
+        order = alive[np.argsort(self.bucket[alive], kind='stable')]
+        self.count = self._take(order)
+        self.dead = 0
+        self.main_end = self.tail_end = self.count
+        self.starts = self._ranges(0, self.count)
+        self.tail_starts = np.full(self.num_buckets + 1, self.count, np.int64)
+
+    def commit(self):
+        """Make this frame's additions visible, compacting if tombstones or the tail grew too large."""
+        unsorted = self.count - self.main_end
+        if self.dead > self.compact_fraction * self.count or unsorted > self.compact_fraction * self.main_end + 1024:
+            self.compact()
+        elif self.count > self.tail_end:
+            self.sort_tail()
+
+    def sort_tail(self):
+        # only the small tail is re-sorted
+        tail = self.main_end + np.argsort(self.bucket[self.main_end:self.count], kind='stable')
+        self.tail_end = self._take(tail, self.main_end)
+        self.tail_starts = self._ranges(self.main_end, self.tail_end)
+
+    def indices_in_buckets(self, first, last):
+        """Alive particles in bucket ranges first[i]:last[i], returns (range of each index, indices)."""
+        rows, indices = expand_ranges(self.starts[first], self.starts[last])
+        if self.tail_end > self.main_end:
+            tail_rows, tail_indices = expand_ranges(self.tail_starts[first], self.tail_starts[last])
+            rows, indices = np.concatenate((rows, tail_rows)), np.concatenate((indices, tail_indices))
+
+        if self.dead:
+            alive = self.alive[indices]
+            rows, indices = rows[alive], indices[alive]
+        return rows, indices
+
+    def indices_in_area(self, min_grid_x, max_grid_x, min_grid_y, max_grid_y):
+        # buckets outside the grid are skipped, not wrapped
+        min_grid_x, max_grid_x = max(min_grid_x, 0), min(max_grid_x, self.num_columns - 1)
+        min_grid_y, max_grid_y = max(min_grid_y, 0), min(max_grid_y, self.num_rows - 1)
+        if min_grid_x > max_grid_x or min_grid_y > max_grid_y:
+            return np.empty(0, np.int64)
+
+        columns = np.arange(min_grid_x, max_grid_x + 1)
+        _, indices = self.indices_in_buckets(columns * self.num_rows + min_grid_y, columns * self.num_rows + max_grid_y + 1)
+        return indices
@@ -29,6 +29,21 @@ class PhysicsParticle:
         self.shape.friction = 0.9
         self.shape.density = self.density
 
+    # reuse a body and circle that were taken out of their space, like create_body and create_circle
+    def reset_body(self, moment):
+        self.body.mass = self.mass
+        self.body.moment = moment
+        self.body.position = self.position
+        self.body.velocity = 0, 0
+        self.body.force = 0, 0
+        self.body.angle = 0
+        self.body.angular_velocity = 0
+        self.body.torque = 0
+
+    def reset_circle(self, radius):
+        self.shape.unsafe_set_radius(radius)
+        self.shape.density = self.density
+
     def add_to_space(self, space):
         space.add(self.body, self.shape)
 
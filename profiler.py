@@ -0,0 +1,109 @@
+import json
+import sys
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+
+class Profiler:
+    """Named phase timers and counters for the game loop.
+
+    Phases are timed back to back: lap(name) adds the time since the previous lap, or
+    since begin(), to name. end_frame() closes a frame and keeps the last `window` frames
+    of every timer and counter for rolling percentiles. Disabled profilers return from
+    every call right away, and hot loops check enabled before calling at all.
+    """
+
+    def __init__(self, enabled: bool = False, window: int = 300):
+        self.enabled = enabled
+        self.window = window
+        self.last = 0.0
+
+        # since the last reset
+        self.totals = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.frames = 0
+
+        # the frame in progress and the rolling history of finished ones
+        self.frame_times = defaultdict(float)
+        self.frame_counts = {}
+        self.history = defaultdict(lambda: deque(maxlen=self.window))
+        self.last_counts = {}
+        self.blocks = sys.getallocatedblocks()
+
+    def begin(self):
+        if self.enabled:
+            self.last = time.perf_counter()
+
+    def lap(self, name: str):
+        if self.enabled:
+            now = time.perf_counter()
+            self.frame_times[name] += now - self.last
+            self.last = now
+
+    def record(self, name: str, seconds: float):
+        # time measured apart from the laps, like on another thread
+        if self.enabled:
+            self.frame_times[name] += seconds
+
+    def count(self, name: str, amount: int = 1):
+        if self.enabled:
+            self.frame_counts[name] = self.frame_counts.get(name, 0) + amount
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+
+        # blocks allocated minus blocks freed during the frame, CPython does not count allocations alone
+        blocks = sys.getallocatedblocks()
+        self.frame_counts['net_allocated_blocks'] = blocks - self.blocks
+        self.blocks = blocks
+
+        for name, seconds in self.frame_times.items():
+            self.totals[name] += seconds
+            self.history[name].append(seconds * 1000)
+        for name, amount in self.frame_counts.items():
+            self.counters[name] += amount
+        self.last_counts = self.frame_counts
+        self.frame_times = defaultdict(float)
+        self.frame_counts = {}
+        self.frames += 1
+
+    def reset(self):
+        self.totals.clear()
+        self.counters.clear()
+        self.history.clear()
+        self.frames = 0
+        self.blocks = sys.getallocatedblocks()
+
+    def mean_ms(self):
+        """Milliseconds per frame spent in every phase since the last reset."""
+        frames = max(self.frames, 1)
+        return {name: total * 1000 / frames for name, total in self.totals.items()}
+
+    def percentiles(self, percents=(50, 95, 99)):
+        """Rolling percentiles of every phase's ms per frame over the last `window` frames."""
+        return {name: dict(zip(percents, np.percentile(np.asarray(times), percents).tolist()))
+                for name, times in self.history.items() if times}
+
+    def overlay_lines(self):
+        lines = [f"{'phase':<12}{'mean':>7}{'p95':>7}{'p99':>7}"]
+        for name, values in self.percentiles().items():
+            mean = sum(self.history[name]) / len(self.history[name])
+            lines.append(f"{name:<12}{mean:7.2f}{values[95]:7.2f}{values[99]:7.2f}")
+        for name, amount in self.last_counts.items():
+            lines.append(f"{name}: {amount}")
+        return lines
+
+    def export(self, path: str):
+        """Write the totals, counters and rolling percentiles to a JSON file."""
+        with open(path, 'w') as out:
+            json.dump({
+                'frames': self.frames,
+                'mean_ms': self.mean_ms(),
+                'percentiles_ms': {name: {f"p{percent}": ms for percent, ms in values.items()}
+                                   for name, values in self.percentiles().items()},
+                'counters_per_frame': {name: amount / max(self.frames, 1) for name, amount in self.counters.items()},
+                'last_frame_counts': self.last_counts,
+            }, out, indent=2)
@@ -0,0 +1,49 @@
+import gzip
+import json
+
+
+class ReplayLog:
+    """The input of a run, one frame per tick, enough to simulate it again headless.
+
+    A frame is the dt the tick was simulated with, the held keys as a bitmask and the
+    input events of that frame. Runs of identical frames without events are stored once
+    with a repeat count, so idle stretches and fixed dt runs cost next to nothing.
+    """
+
+    version = 1
+
+    def __init__(self, settings: dict):
+        # Game keyword arguments that rebuild the world the input was recorded in
+        self.settings = settings
+        self.runs = []  # [repeat, dt, keys, events]
+        self.digest = None
+
+    def __len__(self):
+        return sum(run[0] for run in self.runs)
+
+    def record(self, dt: float, keys: int, events: list):
+        if not events and self.runs and self.runs[-1][1] == dt and self.runs[-1][2] == keys and not self.runs[-1][3]:
+            self.runs[-1][0] += 1
+        else:
+            self.runs.append([1, dt, keys, [list(event) for event in events]])
+
+    def frames(self):
+        for repeat, dt, keys, events in self.runs:
+            for _ in range(repeat):
+                yield dt, keys, events
+
+    def save(self, path: str):
+        with gzip.open(path, 'wt') as out:
+            json.dump({'version': self.version, 'settings': self.settings, 'digest': self.digest, 'runs': self.runs}, out)
+
+    @classmethod
+    def load(cls, path: str):
+        with gzip.open(path, 'rt') as log_file:
+            data = json.load(log_file)
+        if data['version'] != cls.version:
+            raise ValueError(f"{path} is a version {data['version']} replay, expected version {cls.version}")
+
+        log = cls(data['settings'])
+        log.runs = data['runs']
+        log.digest = data['digest']
+        return log
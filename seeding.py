@@ -0,0 +1,38 @@
+import random
+
+import numpy as np
+
+# one stream per subsystem, so extra draws in one of them never shift the others
+STREAMS = ('mutation', 'split', 'particles', 'spawn', 'death')
+
+
+class RandomStreams:
+    """Independent random number streams for every subsystem, all derived from one run seed.
+
+    particles is a numpy Generator for the vectorized particle store, the others are
+    random.Random instances with the same interface as the random module. Without a seed
+    fresh entropy is drawn, and kept in .seed so the run can still be recorded and replayed.
+    """
+
+    def __init__(self, seed: int = None):
+        sequence = np.random.SeedSequence(seed)
+        self.seed = sequence.entropy
+
+        for name, child in zip(STREAMS, sequence.spawn(len(STREAMS))):
+            if name == 'particles':
+                stream = np.random.default_rng(child)
+            else:
+                stream = random.Random(int.from_bytes(child.generate_state(4).tobytes(), 'little'))
+            setattr(self, name, stream)
+
+
+def hash64(keys):
+    """splitmix64 of every uint64 key: the same keys always give the same well mixed numbers.
+
+    For randomness that has to come out the same whenever it is asked for, in any order,
+    like the particle positions of a collapsed bucket (see ChunkManager.materialize).
+    """
+    z = np.asarray(keys, np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
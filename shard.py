@@ -0,0 +1,379 @@
+import argparse
+import multiprocessing
+import os
+import random
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pymunk
+
+from AI import decide_all
+from cell import MAX_CELLS, Cell, Genome
+from game import CHUNK_SIZE, GRID_SIZE, Game
+
+# bucket columns on each side of a shard border that neighbours mirror as ghosts,
+# enough for the default detection_radius of 1 plus a tick or two of drift
+GHOST_WIDTH = 2
+
+
+class GhostCell:
+    """Read-only stand-in for a cell owned by a neighbouring shard.
+
+    Ghosts only exist so social forces can look across borders. They are never simulated,
+    eaten or exploded, which is why they always count as dead.
+    """
+    genome = Genome()
+
+    def __init__(self, position, color):
+        self.position = pymunk.Vec2d(*position)
+        self.color = color
+        self.size = self.genome.size
+        self.dead = True
+        self.body = SimpleNamespace(position=self.position, velocity=(0, 0))
+
+
+class ShardGame(Game):
+    """A headless Game that only simulates chunk columns [first, last) of a larger world.
+
+    Particles in the GHOST_WIDTH bucket columns either side of the region are copies of the
+    neighbours' food, refreshed at every exchange. Eating one of them becomes a claim that
+    the owning shard grants or denies, and the mass is only credited once granted. Food a cell
+    drops outside the region is sent to the shard owning it.
+    """
+
+    def __init__(self, num_chunks: tuple, chunk_columns: tuple, seed: int = None):
+        self.ghost_cells = []
+        self.outgoing_food = []
+        super().__init__(headless=True, num_chunks=num_chunks, spawn_player=False, chunk_columns=chunk_columns, seed=seed)
+
+        self.min_grid_x = chunk_columns[0] * self.chunk_size
+        self.max_grid_x = chunk_columns[1] * self.chunk_size
+        self.min_x = self.min_grid_x * self.grid_size
+        self.max_x = self.max_grid_x * self.grid_size
+
+        self.next_claim = 0
+        self.pending_claims = {}  # claim id -> (cell, cell id, claim) until the owner answers
+        self.outgoing_claims = {'left': [], 'right': []}
+
+    def owns_columns(self, grid_x):
+        # from chunk_columns, Game.__init__ generates the first chunks before min_grid_x is set
+        return (grid_x >= self.chunk_columns[0] * self.chunk_size) & (grid_x < self.chunk_columns[1] * self.chunk_size)
+
+    def create_particles(self, count, color, x_bounds=None, y_bounds=None):
+        # a cell that died or split outside the region drops its food there, replace_ghosts would wipe it
+        start = self.particles.count
+        super().create_particles(count, color, x_bounds, y_bounds)
+        if x_bounds is None or self.owns_columns(x_bounds[0] // self.grid_size):
+            return
+        dropped = np.arange(start, self.particles.count)
+        self.outgoing_food.append({
+            'x': self.particles.x[dropped].copy(),
+            'y': self.particles.y[dropped].copy(),
+            'rgb': self.particles.rgb[dropped].copy(),
+            'mass': self.particles.mass[dropped].copy(),
+        })
+        self.particles.remove(dropped)
+
+    def consume_particles(self):
+        pair_cells, pair_particles = self.find_consumed_particles()
+        own = self.owns_columns(self.particles.bucket[pair_particles] // self.num_rows)
+        mass, rgb = self.particles.mass[pair_particles], self.particles.rgb[pair_particles]
+        self.feed_cells(self.cells, pair_cells[own], mass[own], rgb[own])
+
+        # ghost particles belong to a neighbour, ask it before crediting the mass
+        ghosts = np.flatnonzero(~own)
+        for i, cell_index, particle in zip(ghosts.tolist(), pair_cells[ghosts].tolist(), pair_particles[ghosts].tolist()):
+            claim_id = self.next_claim
+            self.next_claim += 1
+            cell = self.cells[cell_index]
+            claim = (claim_id, float(self.particles.x[particle]), float(self.particles.y[particle]), rgb[i].tolist(), int(mass[i]))
+            self.pending_claims[claim_id] = (cell, cell.id, claim)
+            side = 'left' if claim[1] < self.min_x else 'right'
+            self.outgoing_claims[side].append(claim)
+
+        self.particles.remove(pair_particles)
+
+    def decide_npc_movement(self):
+        # ghosts count for social forces, only our own cells get the result written back
+        cells = self.cells + self.ghost_cells
+        velocities = decide_all(cells, self.particles, *self.find_neighbours(cells))
+        for cell, velocity in zip(self.cells, velocities.tolist()):
+            if cell not in self.to_remove_cells:
+                cell.body.velocity = velocity
+
+    def stream_chunks(self):
+        # neighbours' cells near the border need our border chunks loaded too
+        cell_positions = np.array([cell.body.position for cell in self.cells] + [ghost.position for ghost in self.ghost_cells],
+                                  np.float64).reshape(-1, 2)
+        self.chunk_manager.update(cell_positions)
+        # and the border columns the neighbours mirror never collapse (Game.__init__ gets here before min_grid_x is set)
+        radii = [cell.genome.detection_radius for cell in self.cells] + [ghost.genome.detection_radius for ghost in self.ghost_cells]
+        min_grid_x, max_grid_x = self.chunk_columns[0] * self.chunk_size, self.chunk_columns[1] * self.chunk_size
+        borders = [(min_grid_x, min_grid_x + GHOST_WIDTH - 1, 0, self.num_rows - 1),
+                   (max_grid_x - GHOST_WIDTH, max_grid_x - 1, 0, self.num_rows - 1)]
+        self.chunk_manager.update_buckets(cell_positions, radii, borders)
+
+    def resolve_claims(self, claims):
+        """Grant claims on particles that are still here, returns (claim id, granted) answers."""
+        answers = []
+        for claim_id, x, y, rgb, mass in claims:
+            grid_x, grid_y = int(x // self.grid_size), int(y // self.grid_size)
+            indices = self.particles.indices_in_area(grid_x, grid_x, grid_y, grid_y)
+            # spawn positions are whole numbers and repeat, any particle equal to the eaten one in every column can stand in for it
+            match = indices[(self.particles.x[indices] == x) & (self.particles.y[indices] == y)
+                            & (self.particles.mass[indices] == mass) & np.all(self.particles.rgb[indices] == rgb, axis=1)]
+            if len(match):
+                self.particles.remove(match[:1])
+            answers.append((claim_id, bool(len(match))))
+        return answers
+
+    def apply_answers(self, answers):
+        index_of, granted_cells, pair_cells, mass, rgb = {}, [], [], [], []
+        for claim_id, granted in answers:
+            cell, cell_id, (_, x, y, claimed_rgb, claimed_mass) = self.pending_claims.pop(claim_id)
+            if not granted:
+                continue
+            # the cell may have died or split, and been reused from the pool, since
+            if cell.id != cell_id or cell not in self.spatial:
+                # the owner already took the particle out, it goes back
+                self.outgoing_food.append({
+                    'x': np.array([x], np.float32),
+                    'y': np.array([y], np.float32),
+                    'rgb': np.array([claimed_rgb], np.uint8),
+                    'mass': np.array([claimed_mass], np.uint16),
+                })
+                continue
+            if cell not in index_of:
+                index_of[cell] = len(granted_cells)
+                granted_cells.append(cell)
+            pair_cells.append(index_of[cell])
+            mass.append(claimed_mass)
+            rgb.append(claimed_rgb)
+
+        if granted_cells:
+            # feed_cells wants the pairs grouped by cell
+            order = np.argsort(pair_cells, kind='stable')
+            self.feed_cells(granted_cells, np.array(pair_cells)[order], np.array(mass)[order], np.array(rgb)[order])
+
+    def replace_ghosts(self, particles, ghost_cells):
+        # drop last exchange's ghost particles on both sides, then mirror the neighbours' current food
+        for first, last in ((self.min_grid_x - GHOST_WIDTH, self.min_grid_x - 1), (self.max_grid_x, self.max_grid_x + GHOST_WIDTH - 1)):
+            self.particles.remove(self.particles.indices_in_area(first, last, 0, self.num_rows - 1))
+        for part in particles:
+            self.particles.add(part['x'], part['y'], part['rgb'], part['mass'])
+        self.particles.commit()
+
+        for ghost in self.ghost_cells:
+            self.spatial.remove(ghost)
+        self.ghost_cells = [GhostCell(position, color) for position, color in ghost_cells]
+        for ghost in self.ghost_cells:
+            self.spatial.insert(ghost)
+
+    def add_cell(self, cell):
+        cell.add_to_space(self.space)
+        self.cells.append(cell)
+        self.spatial.insert(cell)
+
+    def border(self, first, last):
+        # what a neighbour needs to mirror of bucket columns [first, last]
+        indices = self.particles.indices_in_area(first, last, 0, self.num_rows - 1)
+        particles = {
+            'x': self.particles.x[indices].copy(),
+            'y': self.particles.y[indices].copy(),
+            'rgb': self.particles.rgb[indices].copy(),
+            'mass': self.particles.mass[indices].copy(),
+        }
+        cells = [
+            (tuple(cell.body.position), cell.color) for cell in self.cells
+            if first <= cell.body.position[0] // self.grid_size <= last
+        ]
+        return particles, cells
+
+    def exchange(self, inbox, n_ticks, dt):
+        """Apply what the neighbours sent, run n_ticks and return what has to leave this shard."""
+        self.apply_answers(inbox['answers'])
+        answers = {side: self.resolve_claims(claims) for side, claims in inbox['claims'].items()}
+        # committed together with the ghosts
+        for food in inbox['food']:
+            self.particles.add(food['x'], food['y'], food['rgb'], food['mass'])
+        self.replace_ghosts(inbox['ghost_particles'], inbox['ghost_cells'])
+        for state in inbox['migrants']:
+            self.add_cell(Cell.from_state(state, self.cell_pool))
+        for position in inbox['spawn']:
+            self.spawn_cell(position)
+        self.max_cells = inbox['max_cells']
+        self.stream_chunks()
+
+        self.step(n_ticks, dt)
+
+        # cells that left the region move on, unless they still wait for a claim answer
+        waiting = {cell for cell, _, _ in self.pending_claims.values()}
+        migrants = []
+        for cell in self.cells[:]:
+            x = cell.body.position[0]
+            if not (self.min_x <= x < self.max_x) and cell not in waiting:
+                migrants.append(cell.to_state())
+                self.cell_pool.release(cell)
+                self.spatial.remove(cell)
+                self.cells.remove(cell)
+
+        claims, self.outgoing_claims = self.outgoing_claims, {'left': [], 'right': []}
+        food, self.outgoing_food = self.outgoing_food, []
+        return {
+            'migrants': migrants,
+            'food': food,
+            'ghosts': {
+                'left': self.border(self.min_grid_x, self.min_grid_x + GHOST_WIDTH - 1),
+                'right': self.border(self.max_grid_x - GHOST_WIDTH, self.max_grid_x - 1),
+            },
+            'claims': claims,
+            'answers': answers,
+            'stats': {
+                'cells': len(self.cells),
+                'particles': len(self.particles),
+                'cell_mass': sum(cell.mass for cell in self.cells),
+                'max_generation': max((cell.generation for cell in self.cells), default=0),
+            },
+        }
+
+
+def _shard_worker(connection, num_chunks, chunk_columns, seed):
+    game = ShardGame(num_chunks, chunk_columns, seed)
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            inbox, n_ticks, dt = message
+            connection.send(game.exchange(inbox, n_ticks, dt))
+    finally:
+        game.chunk_manager.close()
+        connection.close()
+
+
+def _empty_inbox():
+    return {'answers': [], 'claims': {'left': [], 'right': []}, 'ghost_particles': [], 'ghost_cells': [], 'migrants': [], 'food': [], 'spawn': []}
+
+
+class ShardedWorld:
+    """A headless world split into vertical strips of chunk columns, one worker process each.
+
+    Every worker runs its own ShardGame and pymunk Space. At each exchange the coordinator
+    routes cells that crossed a border, and food dropped past it, to the shard now owning them,
+    border food and cells to the neighbours as ghosts, and particle claims and their answers
+    between owners. It also hands every shard its share of the MAX_CELLS population left, see
+    share_cell_budget.
+    """
+
+    def __init__(self, num_shards: int = None, num_chunks: tuple = (8, 2), initial_cells: int = 100, seed: int = 0):
+        num_shards = min(num_shards or os.cpu_count(), num_chunks[0])
+        self.num_chunks = num_chunks
+        self.columns = [(int(part[0]), int(part[-1]) + 1) for part in np.array_split(np.arange(num_chunks[0]), num_shards)]
+
+        self.chunk_width = CHUNK_SIZE * GRID_SIZE
+        self.world_width = num_chunks[0] * self.chunk_width
+        self.world_height = num_chunks[1] * self.chunk_width
+
+        self.connections = []
+        self.processes = []
+        for index, chunk_columns in enumerate(self.columns):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_shard_worker, args=(child, num_chunks, chunk_columns, seed + index), daemon=True)
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+        self.inboxes = [_empty_inbox() for _ in self.columns]
+        self.populations = [0 for _ in self.columns]
+        rng = random.Random(seed)
+        for _ in range(initial_cells):
+            position = (rng.uniform(0, self.world_width), rng.uniform(0, self.world_height))
+            self.inboxes[self.shard_of(position[0])]['spawn'].append(position)
+
+        self.stats = []
+        self.tick_count = 0
+
+    def shard_of(self, x):
+        chunk_x = min(max(int(x // self.chunk_width), 0), self.num_chunks[0] - 1)
+        for index, (first, last) in enumerate(self.columns):
+            if first <= chunk_x < last:
+                return index
+
+    def share_cell_budget(self):
+        # MAX_CELLS holds for the whole world: every shard may grow by an even share of what is left
+        populations = [population + len(inbox['migrants']) + len(inbox['spawn'])
+                       for population, inbox in zip(self.populations, self.inboxes)]
+        headroom = max(MAX_CELLS - sum(populations), 0)
+        for index, (population, inbox) in enumerate(zip(populations, self.inboxes)):
+            inbox['max_cells'] = population + headroom // len(self.inboxes) + (index < headroom % len(self.inboxes))
+
+    def exchange(self, n_ticks, dt):
+        self.share_cell_budget()
+        for connection, inbox in zip(self.connections, self.inboxes):
+            connection.send((inbox, n_ticks, dt))
+        outboxes = [connection.recv() for connection in self.connections]
+
+        self.inboxes = [_empty_inbox() for _ in self.columns]
+        last = len(self.columns) - 1
+        for index, outbox in enumerate(outboxes):
+            for state in outbox['migrants']:
+                self.inboxes[self.shard_of(state['position'][0])]['migrants'].append(state)
+            # dropped within one grid bucket, so all on the same shard
+            for food in outbox['food']:
+                self.inboxes[self.shard_of(food['x'][0])]['food'].append(food)
+
+            # left goes to the previous shard, which hears it from its right, and vice versa
+            for side, neighbour, their_side in (('left', index - 1, 'right'), ('right', index + 1, 'left')):
+                if not 0 <= neighbour <= last:
+                    continue
+                particles, cells = outbox['ghosts'][side]
+                self.inboxes[neighbour]['ghost_particles'].append(particles)
+                self.inboxes[neighbour]['ghost_cells'].extend(cells)
+                self.inboxes[neighbour]['claims'][their_side].extend(outbox['claims'][side])
+                self.inboxes[neighbour]['answers'].extend(outbox['answers'][side])
+
+        self.stats = [outbox['stats'] for outbox in outboxes]
+        self.populations = [stats['cells'] for stats in self.stats]
+        self.tick_count += n_ticks
+
+    def step(self, n_ticks: int = 1, dt: float = 1 / 60, ticks_per_exchange: int = 1):
+        """Advance every shard n_ticks, exchanging borders every ticks_per_exchange ticks, returns ticks per second."""
+        start = time.perf_counter()
+        remaining = n_ticks
+        while remaining > 0:
+            batch = min(ticks_per_exchange, remaining)
+            self.exchange(batch, dt)
+            remaining -= batch
+        elapsed = time.perf_counter() - start
+
+        return n_ticks / elapsed if elapsed > 0 else float("inf")
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, default=None, help="worker processes, defaults to one per core")
+    parser.add_argument("--chunks", type=int, nargs=2, default=(8, 2), metavar=("X", "Y"), help="world size in chunks")
+    parser.add_argument("--cells", type=int, default=200, help="initial npc cells")
+    parser.add_argument("--ticks", type=int, default=600)
+    parser.add_argument("--dt", type=float, default=1 / 60)
+    parser.add_argument("--exchange", type=int, default=1, help="ticks between border exchanges")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with ShardedWorld(args.shards, tuple(args.chunks), args.cells, args.seed) as world:
+        tps = world.step(args.ticks, args.dt, args.exchange)
+        cells = sum(stats['cells'] for stats in world.stats)
+        print(f"{len(world.columns)} shards, {args.ticks} ticks at {tps:.0f} ticks/s, {cells} cells")
@@ -0,0 +1,317 @@
+import itertools
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from genomes import GenomeArrays
+from chunks import ACTIVE, DORMANT, EVICTED, PRISTINE
+from particle import COLORS, COLOR_INDEX
+
+# snapshots are directories of .npy columns plus meta.json, so np.load(..., mmap_mode='r')
+# can map any column without reading the rest
+VERSION = 4
+
+CHUNK_STATES = (PRISTINE, ACTIVE, DORMANT, EVICTED)
+
+# numbers the links capture() makes to evicted chunk files
+_links = itertools.count()
+
+
+def _random_state(stream):
+    # random.Random and numpy Generator states, as JSON
+    if hasattr(stream, 'bit_generator'):
+        return stream.bit_generator.state
+    version, internal, gauss = stream.getstate()
+    return [version, list(internal), gauss]
+
+
+def _set_random_state(stream, state):
+    if hasattr(stream, 'bit_generator'):
+        stream.bit_generator.state = state
+    else:
+        stream.setstate((state[0], tuple(state[1]), state[2]))
+
+
+def capture(game):
+    """Copy the whole simulation state into flat arrays and a meta dict.
+
+    This is the only part of a snapshot that has to run on the game loop's thread, after
+    it the arrays are private and can be written out in the background. Evicted chunks are
+    only linked here, write() reads them from disk.
+    """
+    cells = game.cells
+    genomes = [genome for cell in cells for genome in cell.chromosome]
+    columns = {
+        'cells.x': np.array([cell.body.position[0] for cell in cells], np.float64),
+        'cells.y': np.array([cell.body.position[1] for cell in cells], np.float64),
+        'cells.vx': np.array([cell.body.velocity[0] for cell in cells], np.float64),
+        'cells.vy': np.array([cell.body.velocity[1] for cell in cells], np.float64),
+        'cells.angle': np.array([cell.body.angle for cell in cells], np.float64),
+        'cells.angular_velocity': np.array([cell.body.angular_velocity for cell in cells], np.float64),
+        'cells.mass': np.array([cell.mass for cell in cells], np.int64),
+        'cells.age': np.array([cell.age for cell in cells], np.float64),
+        'cells.generation': np.array([cell.generation for cell in cells], np.int64),
+        'cells.animation': np.array([cell.animation for cell in cells], np.int64),
+        'cells.color': np.array([COLOR_INDEX[cell.color] for cell in cells], np.uint8),
+        'cells.flags': np.array([[cell.is_player, cell.has_split, cell.dead] for cell in cells], bool).reshape(-1, 3),
+        'cells.active_gene': np.array([cell.active_gene for cell in cells], np.int64),
+        'cells.chromosome_length': np.array([len(cell.chromosome) for cell in cells], np.int64),
+    }
+
+    # one row per genome, chromosomes are consecutive runs of rows
+    for name, array in GenomeArrays.from_genomes(genomes).columns.items():
+        columns[f'genomes.{name}'] = array
+
+    particles = game.particles
+    alive = np.flatnonzero(particles.alive[:particles.count])
+    columns['particles.x'] = particles.x[alive]
+    columns['particles.y'] = particles.y[alive]
+    columns['particles.rgb'] = particles.rgb[alive]
+    columns['particles.mass'] = particles.mass[alive]
+
+    # chunks that are not active keep their particles packed. An evicted chunk's file gets a
+    # second name, so it is still there if the chunk is loaded back before write() reads it
+    manager = game.chunk_manager
+    chunks = list(manager.chunks.values())
+    resident = {key: rank for rank, key in enumerate(manager.resident)}
+    packed = []
+    for chunk in chunks:
+        if chunk.state == DORMANT:
+            packed.append(chunk.packed)
+        elif chunk.state == EVICTED:
+            link = f"{chunk.path}.{next(_links)}.snapshot"
+            os.link(chunk.path, link)
+            packed.append(link)
+        else:
+            packed.append(None)
+
+    columns['chunks.key'] = np.array([chunk.key for chunk in chunks], np.int64).reshape(-1, 2)
+    columns['chunks.state'] = np.array([CHUNK_STATES.index(chunk.state) for chunk in chunks], np.uint8)
+    columns['chunks.idle_ticks'] = np.array([chunk.idle_ticks for chunk in chunks], np.int64)
+    columns['chunks.counts'] = np.array([chunk.counts for chunk in chunks], np.int64).reshape(-1, 3)
+    columns['chunks.resident_rank'] = np.array([resident.get(chunk.key, -1) for chunk in chunks], np.int64)
+    # per chunk: packed arrays, a linked file or None, turned into columns by write()
+    columns['chunks.packed'] = packed
+
+    # collapsed buckets, one row per grid bucket
+    columns['buckets.collapsed_mass'] = manager.collapsed_mass.copy()
+    columns['buckets.seeds'] = manager.seeds.copy()
+    columns['buckets.last_needed'] = manager.last_needed.copy()
+
+    meta = {
+        'version': VERSION,
+        'settings': game.settings,
+        'tick_count': game.tick_count,
+        'chunk_updates': manager.updates,
+        'particles_main': int(np.count_nonzero(particles.alive[:particles.main_end])),
+        'generation': game.generation,
+        'player': cells.index(game.player) if game.player in cells else None,
+        'camera': [game.camera_x, game.camera_y, game.zoom_factor],
+        'random': {name: _random_state(getattr(game.rng, name)) for name in vars(game.rng) if name != 'seed'},
+    }
+    return columns, meta
+
+
+def _packed_columns(packed):
+    # the chunks' packed particles as consecutive runs, reading and dropping capture()'s links
+    chunks = []
+    for arrays in packed:
+        if isinstance(arrays, str):
+            with np.load(arrays) as data:
+                chunks.append({name: data[name] for name in data.files})
+            os.remove(arrays)
+        else:
+            chunks.append(arrays)
+
+    columns = {'chunks.packed_length': np.array([len(arrays['x']) if arrays else 0 for arrays in chunks], np.int64)}
+    chunks = [arrays for arrays in chunks if arrays]
+    columns['chunks.x'] = np.concatenate([arrays['x'] for arrays in chunks] or [np.empty(0, np.float32)])
+    columns['chunks.y'] = np.concatenate([arrays['y'] for arrays in chunks] or [np.empty(0, np.float32)])
+    columns['chunks.rgb'] = np.concatenate([arrays['rgb'] for arrays in chunks] or [np.empty((0, 3), np.uint8)])
+    columns['chunks.mass'] = np.concatenate([arrays['mass'] for arrays in chunks] or [np.empty(0, np.uint16)])
+    return columns
+
+
+def write(columns, meta, path):
+    """Write a captured snapshot to the directory path, replacing it only once complete.
+
+    The previous snapshot is renamed to path + '.old' first and only deleted once the new one
+    is in place, read_meta() and read_columns() fall back to it if path is missing.
+    """
+    columns = dict(columns)
+    columns.update(_packed_columns(columns.pop('chunks.packed')))
+
+    path = path.rstrip(os.sep)
+    partial, old = path + '.partial', path + '.old'
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    for name, array in columns.items():
+        np.save(os.path.join(partial, name + '.npy'), array)
+    with open(os.path.join(partial, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+    if os.path.exists(path):
+        shutil.rmtree(old, ignore_errors=True)
+        os.rename(path, old)
+    os.rename(partial, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def save(game, path):
+    write(*capture(game), path)
+
+
+def _complete(path):
+    # a crash between write()'s renames leaves the last complete snapshot at path + '.old'
+    path = path.rstrip(os.sep)
+    return path if os.path.exists(path) or not os.path.exists(path + '.old') else path + '.old'
+
+
+def read_meta(path):
+    path = _complete(path)
+    with open(os.path.join(path, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    if meta['version'] != VERSION:
+        raise ValueError(f"{path} is a version {meta['version']} snapshot, expected version {VERSION}")
+    return meta
+
+
+def read_columns(path, mmap: bool = True):
+    """Every column of a snapshot by name, memory mapped unless mmap is False."""
+    path = _complete(path)
+    columns = {}
+    for file_name in os.listdir(path):
+        if file_name.endswith('.npy'):
+            columns[file_name[:-4]] = np.load(os.path.join(path, file_name), mmap_mode='r' if mmap else None)
+    return columns
+
+
+def load(game, path):
+    """Replace the state of game, built with the snapshot's settings, by the snapshot at path.
+
+    The pymunk Space gets fresh bodies at the saved positions and velocities; contact
+    caches inside pymunk are not part of a snapshot.
+    """
+    meta = read_meta(path)
+    if meta['settings']['num_chunks'] != game.settings['num_chunks'] or meta['settings']['grid_size'] != game.settings['grid_size']:
+        raise ValueError(f"{path} was saved from a {meta['settings']['num_chunks']} chunk world with grid_size "
+                         f"{meta['settings']['grid_size']}")
+    columns = read_columns(path)
+
+    # drop whatever the game spawned while it was built
+    for cell in list(game.cells):
+        game.cell_pool.release(cell)
+        game.spatial.remove(cell)
+    game.cells.clear()
+    game.player = None
+    game.cell_pool.recycle()
+    particles = game.particles
+    particles.remove(np.arange(particles.count))
+    particles.compact()
+
+    # particles of active chunks go straight into the store, in the same sorted main part and tail as they were
+    main = meta['particles_main']
+    particles.add(columns['particles.x'][:main], columns['particles.y'][:main], columns['particles.rgb'][:main],
+                  columns['particles.mass'][:main])
+    particles.compact()
+    particles.add(columns['particles.x'][main:], columns['particles.y'][main:], columns['particles.rgb'][main:],
+                  columns['particles.mass'][main:])
+    particles.sort_tail()
+
+    manager = game.chunk_manager
+    manager.active.clear()
+    manager.resident.clear()
+    manager.dormant_mass[:] = 0
+    manager.collapsed_mass[:] = columns['buckets.collapsed_mass']
+    manager.seeds[:] = columns['buckets.seeds']
+    manager.last_needed[:] = columns['buckets.last_needed']
+    manager.updates = meta['chunk_updates']
+    offsets = np.concatenate(([0], np.cumsum(columns['chunks.packed_length'])))
+    resident = []
+    for i, key in enumerate(map(tuple, columns['chunks.key'].tolist())):
+        chunk = manager.chunks[key]
+        chunk.state = CHUNK_STATES[columns['chunks.state'][i]]
+        chunk.idle_ticks = int(columns['chunks.idle_ticks'][i])
+        chunk.counts[:] = columns['chunks.counts'][i]
+        chunk.path = None
+        chunk.packed = None
+        if chunk.state == ACTIVE:
+            manager.active.add(key)
+        elif chunk.state in (DORMANT, EVICTED):
+            start, end = offsets[i], offsets[i + 1]
+            chunk.packed = {name: np.array(columns[f'chunks.{name}'][start:end]) for name in ('x', 'y', 'rgb', 'mass')}
+            chunk.state = DORMANT
+            manager.record_dormant(chunk)
+            resident.append((int(columns['chunks.resident_rank'][i]), chunk))
+
+    # evicted chunks come back as the least recently used dormant ones, and go to disk again if over budget
+    resident.sort(key=lambda item: item[0])
+    for _, chunk in resident:
+        manager.resident[chunk.key] = chunk
+    while len(manager.resident) > manager.max_resident:
+        _, oldest = manager.resident.popitem(last=False)
+        manager.evict(oldest)
+
+    genomes = GenomeArrays({name[len('genomes.'):]: array for name, array in columns.items() if name.startswith('genomes.')}).to_genomes()
+    start = 0
+    for i in range(len(columns['cells.x'])):
+        length = int(columns['cells.chromosome_length'][i])
+        chromosome = genomes[start:start + length]
+        start += length
+
+        is_player, has_split, dead = columns['cells.flags'][i].tolist()
+        cell = game.cell_pool.acquire((float(columns['cells.x'][i]), float(columns['cells.y'][i])), chromosome,
+                                      int(columns['cells.active_gene'][i]), int(columns['cells.generation'][i]), is_player, has_split)
+        cell.body.velocity = float(columns['cells.vx'][i]), float(columns['cells.vy'][i])
+        cell.body.angle = float(columns['cells.angle'][i])
+        cell.body.angular_velocity = float(columns['cells.angular_velocity'][i])
+        cell.mass = int(columns['cells.mass'][i])
+        cell.age = float(columns['cells.age'][i])
+        cell.animation = int(columns['cells.animation'][i])
+        cell.color = COLORS[columns['cells.color'][i]]
+        cell.dead = dead
+        cell.add_to_space(game.space)
+        game.cells.append(cell)
+        game.spatial.insert(cell)
+
+    if meta['player'] is not None:
+        game.player = game.cells[meta['player']]
+    game.tick_count = meta['tick_count']
+    game.generation = meta['generation']
+    game.camera_x, game.camera_y, game.zoom_factor = meta['camera']
+    for name, state in meta['random'].items():
+        _set_random_state(getattr(game.rng, name), state)
+
+
+class BackgroundSnapshots:
+    """Saves a snapshot every `every` ticks without stalling the game loop.
+
+    The loop only pays for capture(); files are written by a background thread. If the
+    previous snapshot is still being written when the next one is due, that one is skipped.
+    """
+
+    def __init__(self, path: str, every: int):
+        self.path = path
+        self.every = every
+        self.thread = None
+        self.skipped = 0
+
+    def update(self, game):
+        if game.tick_count == 0 or game.tick_count % self.every:
+            return
+
+        if self.thread is not None and self.thread.is_alive():
+            self.skipped += 1
+            return
+
+        columns, meta = capture(game)
+        self.thread = threading.Thread(target=write, args=(columns, meta, self.path), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        # let the last snapshot finish writing
+        if self.thread is not None:
+            self.thread.join()
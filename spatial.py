@@ -0,0 +1,125 @@
+import numpy as np
+
+from particle import ParticleStore, expand_ranges, neighbourhood_columns
+
+
+class SpatialHash:
+    """Cells and food particles bucketed by grid coordinate, in separate containers.
+
+    Each bucket keeps its cells in an insertion ordered dict used as a set, so insert and
+    remove are O(1) and a cell is only moved when its bucket coordinate changes. Particles
+    live in the bucket-sorted ParticleStore.
+    """
+
+    def __init__(self, num_columns: int, num_rows: int, grid_size: int):
+        self.num_columns = num_columns
+        self.num_rows = num_rows
+        self.grid_size = grid_size
+
+        self.buckets = {(grid_x, grid_y): {} for grid_x in range(num_columns) for grid_y in range(num_rows)}
+        self.cell_bucket = {}
+        self.particles = ParticleStore(num_columns, num_rows, grid_size)
+
+    def __len__(self):
+        return len(self.cell_bucket)
+
+    def __contains__(self, cell):
+        return cell in self.cell_bucket
+
+    def grid_coords(self, position):
+        # not clamped, neighbourhoods of cells outside the world just see fewer buckets
+        return int(position[0] // self.grid_size), int(position[1] // self.grid_size)
+
+    def bucket_of(self, position):
+        grid_x, grid_y = self.grid_coords(position)
+
+        # Clamp grid_x and grid_y to stay within initialized bounds
+        grid_x = max(0, min(grid_x, self.num_columns - 1))
+        grid_y = max(0, min(grid_y, self.num_rows - 1))
+        return grid_x, grid_y
+
+    def insert(self, cell):
+        key = self.bucket_of(cell.position)
+        self.buckets[key][cell] = None
+        self.cell_bucket[cell] = key
+
+    def remove(self, cell):
+        key = self.cell_bucket.pop(cell, None)
+        if key is not None:
+            del self.buckets[key][cell]
+
+    def move(self, cell):
+        """Re-bucket a cell if it crossed into another bucket, returns whether it moved."""
+        key = self.bucket_of(cell.position)
+        old_key = self.cell_bucket.get(cell)
+        if key == old_key:
+            return False
+
+        if old_key is not None:
+            del self.buckets[old_key][cell]
+        self.buckets[key][cell] = None
+        self.cell_bucket[cell] = key
+        return True
+
+    def cells_in_area(self, min_grid_x, max_grid_x, min_grid_y, max_grid_y):
+        cells = []
+        for grid_x in range(max(min_grid_x, 0), min(max_grid_x, self.num_columns - 1) + 1):
+            for grid_y in range(max(min_grid_y, 0), min(max_grid_y, self.num_rows - 1) + 1):
+                cells.extend(self.buckets[(grid_x, grid_y)])
+        return cells
+
+    # grid_radius = 1 -> 3x3 grid
+    # grid_radius = 2 -> 5x5 grid
+    def cells_near(self, position, grid_radius: int):
+        grid_x, grid_y = self.grid_coords(position)
+        return self.cells_in_area(grid_x - grid_radius, grid_x + grid_radius, grid_y - grid_radius, grid_y + grid_radius)
+
+    def _neighbourhood_columns(self, cells):
+        # one bucket range per grid column of every cell's detection neighbourhood
+        positions = np.array([cell.position for cell in cells], np.float64).reshape(-1, 2)
+        radii = np.array([cell.genome.detection_radius for cell in cells], np.int64)
+        grid_coords = (positions // self.grid_size).astype(np.int64)
+
+        owner, first, last = neighbourhood_columns(grid_coords[:, 0], grid_coords[:, 1], radii, self.num_columns, self.num_rows)
+        return positions, owner, first, last
+
+    def particle_pairs(self, cells):
+        """Every (cell, particle) pair within the cells' detection radii, with squared distances.
+
+        The neighbourhoods are expanded into index ranges of the particle store without a
+        Python loop per cell. Returns indices into `cells`, particle indices and squared
+        distances as flat arrays.
+        """
+        if not cells:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+
+        positions, owner, first, last = self._neighbourhood_columns(cells)
+        rows, pair_particles = self.particles.indices_in_buckets(first, last)
+        pair_cells = owner[rows]
+
+        dx = self.particles.x[pair_particles] - positions[pair_cells, 0]
+        dy = self.particles.y[pair_particles] - positions[pair_cells, 1]
+        return pair_cells, pair_particles, dx * dx + dy * dy
+
+    def cell_pairs(self, cells):
+        """Every (cell, other cell) pair within the cells' detection radii, as indices into `cells`.
+
+        Others are found through the buckets the hash has them in, like cells_near.
+        """
+        if not cells:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+
+        # bucket-sorted snapshot of the hashed cells, numbered like the particle buckets
+        hashed = np.array([i for i, cell in enumerate(cells) if cell in self.cell_bucket], np.int64)
+        keys = np.array([self.cell_bucket[cells[i]] for i in hashed.tolist()], np.int64).reshape(-1, 2)
+        buckets = keys[:, 0] * self.num_rows + keys[:, 1]
+        order = np.argsort(buckets, kind='stable')
+        hashed = hashed[order]
+        bucket_starts = np.searchsorted(buckets[order], np.arange(self.num_columns * self.num_rows + 1))
+
+        _, owner, first, last = self._neighbourhood_columns(cells)
+        rows, slots = expand_ranges(bucket_starts[first], bucket_starts[last])
+        pair_cells, pair_others = owner[rows], hashed[slots]
+
+        distinct = pair_cells != pair_others
+        return pair_cells[distinct], pair_others[distinct]
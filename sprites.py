@@ -0,0 +1,50 @@
+from collections import OrderedDict
+
+
+class SpriteCache:
+    """Pre-rendered surfaces by key, least recently used ones dropped past a memory budget.
+
+    get() renders a missing sprite by calling render(*key) and keeps it, None included for
+    keys with nothing to draw. The budget counts pixel memory only, which is nearly all a
+    Surface costs.
+    """
+
+    def __init__(self, budget: int = 32 * 1024 * 1024):
+        self.budget = budget
+        self.sprites = OrderedDict()
+        self.nbytes = 0
+        # for the profiler
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def __contains__(self, key):
+        return key in self.sprites
+
+    def get(self, key, render):
+        if key in self.sprites:
+            self.sprites.move_to_end(key)
+            self.hits += 1
+            return self.sprites[key]
+
+        sprite = render(*key)
+        self.misses += 1
+        self.sprites[key] = sprite
+        self.nbytes += self.sprite_bytes(sprite)
+        while self.nbytes > self.budget and len(self.sprites) > 1:
+            _, oldest = self.sprites.popitem(last=False)
+            self.nbytes -= self.sprite_bytes(oldest)
+        return sprite
+
+    def clear(self):
+        self.sprites.clear()
+        self.nbytes = 0
+
+    @staticmethod
+    def sprite_bytes(sprite):
+        if sprite is None:
+            return 0
+        width, height = sprite.get_size()
+        return width * height * sprite.get_bytesize()
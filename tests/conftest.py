@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the game's modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# pygame is imported by most modules, the tests never open a window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
@@ -0,0 +1,55 @@
+import random
+
+import numpy as np
+import pytest
+
+from cell import Genome
+from genomes import GenomeArrays
+
+SAMPLES = 20000
+
+# one start genome for each rule set of mutate_gene, with a high rate so every rule fires often
+START_GENOMES = {
+    'red': Genome(mutation_rate=0.5, perception=0b110),
+    'green': Genome(r=0, b=0, mutation_rate=0.5, p_consumption=0b011, c_consumption=0b010, perception=0b100),
+    'special': Genome(r=0, g=0, mutation_rate=0.5, p_consumption=0b110, c_consumption=0b101, perception=0b011),
+}
+
+
+def features(population):
+    # every field as numbers, color flags split into their bits
+    columns = population.columns
+    result = {name: columns[name].astype(np.float64) for name in GenomeArrays.INTS + GenomeArrays.FLAGS}
+    for color in range(3):
+        result[f'behavior_{color}'] = columns['behavior'][:, color]
+        for name in GenomeArrays.COLOR_FLAGS:
+            result[f'{name}_{color}'] = (columns[name] >> color & 1).astype(np.float64)
+    return result
+
+
+@pytest.mark.parametrize("kind", START_GENOMES)
+def test_mutate_matches_mutate_gene_in_distribution(kind):
+    genome = START_GENOMES[kind]
+    batch = GenomeArrays.repeat(genome, SAMPLES)
+    batch.mutate(np.random.default_rng(0))
+
+    rng = random.Random(0)
+    single = GenomeArrays.from_genomes([genome.mutated(rng) for _ in range(SAMPLES)])
+
+    batch_features, single_features = features(batch), features(single)
+    for name, values in batch_features.items():
+        expected = single_features[name]
+        # means within five standard errors of each other
+        error = np.sqrt((values.var() + expected.var()) / SAMPLES)
+        assert abs(values.mean() - expected.mean()) <= 5 * error + 1e-9, name
+        # and the same set of outcomes for the discrete fields
+        if not name.startswith('behavior'):
+            assert set(np.unique(values)) == set(np.unique(expected)), name
+
+
+def test_mutate_leaves_the_genomes_it_did_not_roll_for_alone():
+    batch = GenomeArrays.repeat(Genome(mutation_rate=0.0), 100)
+    before = batch.copy()
+    batch.mutate(np.random.default_rng(0))
+    for name, array in batch.columns.items():
+        assert np.array_equal(array, before.columns[name]), name
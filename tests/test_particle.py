@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from particle import ParticleStore, dominant_color_indices
+
+NUM_COLUMNS, NUM_ROWS, GRID_SIZE = 6, 5, 10
+
+
+def alive_particles(store):
+    alive = np.flatnonzero(store.alive[:store.count])
+    return alive, store.x[alive], store.y[alive]
+
+
+def brute_force_area(store, min_grid_x, max_grid_x, min_grid_y, max_grid_y, visible=None):
+    # every alive particle whose bucket is inside the area, looked at one by one
+    alive, x, y = alive_particles(store)
+    grid_x, grid_y = x // GRID_SIZE, y // GRID_SIZE
+    inside = (grid_x >= min_grid_x) & (grid_x <= max_grid_x) & (grid_y >= min_grid_y) & (grid_y <= max_grid_y)
+    if visible is not None:
+        inside &= alive < visible
+    return set(alive[inside].tolist())
+
+
+def expected_bucket_mass(store):
+    alive = np.flatnonzero(store.alive[:store.count])
+    mass = np.zeros((store.num_buckets, 3), np.int64)
+    np.add.at(mass, (store.bucket[alive], dominant_color_indices(store.rgb[alive])), store.mass[alive])
+    return mass
+
+
+def add_random(store, rng, count):
+    x = rng.integers(0, NUM_COLUMNS * GRID_SIZE, count)
+    y = rng.integers(0, NUM_ROWS * GRID_SIZE, count)
+    rgb = np.eye(3, dtype=np.uint8)[rng.integers(0, 3, count)] * 255
+    mass = rng.integers(1, 4, count)
+    store.add(x, y, rgb, mass)
+    return int(mass.sum())
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_queries_match_brute_force_through_removes_commits_and_compactions(seed):
+    rng = np.random.default_rng(seed)
+    store = ParticleStore(NUM_COLUMNS, NUM_ROWS, GRID_SIZE, capacity=16)
+    add_random(store, rng, 400)
+    store.commit()
+
+    compactions = 0
+    for _ in range(40):
+        # a frame: remove some, add some, only the committed ones are visible
+        alive, _, _ = alive_particles(store)
+        store.remove(rng.choice(alive, min(len(alive), rng.integers(0, 40)), replace=False))
+        visible = store.count
+        add_random(store, rng, int(rng.integers(0, 60)))
+
+        min_grid_x, min_grid_y = rng.integers(-1, NUM_COLUMNS), rng.integers(-1, NUM_ROWS)
+        area = (min_grid_x, min_grid_x + rng.integers(0, 3), min_grid_y, min_grid_y + rng.integers(0, 3))
+        assert set(store.indices_in_area(*area).tolist()) == brute_force_area(store, *area, visible=visible)
+
+        main_end = store.main_end
+        store.commit()
+        compactions += store.main_end != main_end
+        assert set(store.indices_in_area(*area).tolist()) == brute_force_area(store, *area)
+        assert set(store.indices_in_area(0, NUM_COLUMNS - 1, 0, NUM_ROWS - 1).tolist()) == set(alive_particles(store)[0].tolist())
+
+    # the sequence is long enough to go through the tail and compaction paths both
+    assert compactions > 0
+
+
+def test_bucket_mass_is_kept_exact_and_mass_is_conserved():
+    rng = np.random.default_rng(1)
+    store = ParticleStore(NUM_COLUMNS, NUM_ROWS, GRID_SIZE)
+    total = add_random(store, rng, 500)
+    store.commit()
+
+    for _ in range(30):
+        alive, _, _ = alive_particles(store)
+        removed = rng.choice(alive, 25, replace=False)
+        # removing a particle twice only counts once
+        store.remove(np.concatenate((removed, removed[:5])))
+        total -= int(store.mass[removed].sum())
+        total += add_random(store, rng, 20)
+        # additions count in bucket_mass right away, before they are committed
+        assert np.array_equal(store.bucket_mass, expected_bucket_mass(store))
+        store.commit()
+        assert np.array_equal(store.bucket_mass, expected_bucket_mass(store))
+        assert store.bucket_mass.sum() == total == int(store.mass[alive_particles(store)[0]].sum())
+
+
+def test_compact_keeps_every_alive_particle_and_sorts_buckets():
+    rng = np.random.default_rng(2)
+    store = ParticleStore(NUM_COLUMNS, NUM_ROWS, GRID_SIZE)
+    add_random(store, rng, 300)
+    store.commit()
+    store.remove(np.arange(0, 300, 3))
+    add_random(store, rng, 50)
+    store.commit()
+
+    def contents():
+        alive, x, y = alive_particles(store)
+        return sorted(zip(x.tolist(), y.tolist(), map(tuple, store.rgb[alive].tolist()), store.mass[alive].tolist()))
+
+    before = contents()
+    store.compact()
+    assert contents() == before
+    assert store.dead == 0 and store.pending == 0
+    assert np.all(np.diff(store.bucket[:store.count]) >= 0)
+    # every bucket's range holds exactly its particles
+    for bucket in range(store.num_buckets):
+        assert np.all(store.bucket[store.starts[bucket]:store.starts[bucket + 1]] == bucket)
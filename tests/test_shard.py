@@ -0,0 +1,59 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from shard import ShardGame, _empty_inbox
+
+
+@pytest.fixture
+def left():
+    """The left half of a world two chunks wide."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        game = ShardGame((2, 1), (0, 1), seed=1)
+    yield game
+    game.chunk_manager.close()
+
+
+def test_food_dropped_outside_the_region_is_sent_to_its_owner(left):
+    mass = int(left.particles.bucket_mass.sum())
+    x = left.max_x + left.grid_size
+    left.create_particles(5, 'r', (x, x + left.grid_size - 1), (0, left.grid_size - 1))
+    left.create_particles(3, 'g', (0, left.grid_size - 1), (0, left.grid_size - 1))
+
+    # the food dropped in our own columns stays
+    assert int(left.particles.bucket_mass.sum()) == mass + 3
+    [food] = left.outgoing_food
+    assert len(food['x']) == 5 and np.all(food['x'] >= left.max_x)
+
+    outbox = left.exchange(dict(_empty_inbox(), max_cells=10), 1, 1 / 60)
+    assert len(outbox['food']) == 1 and outbox['food'][0] is food and not left.outgoing_food
+
+
+def test_claims_are_granted_on_the_particle_that_was_eaten(left):
+    # two particles on the same spot, told apart by their color and mass
+    x, y = left.max_x - 5, 7
+    left.particles.add([x, x], [y, y], [(255, 0, 0), (0, 255, 0)], [1, 2])
+    left.particles.commit()
+
+    answers = left.resolve_claims([(0, float(x), float(y), [0, 255, 0], 2), (1, float(x), float(y), [0, 255, 0], 2),
+                                   (2, float(x), float(y), [255, 0, 0], 3)])
+    assert answers == [(0, True), (1, False), (2, False)]
+    grid_x, grid_y = x // left.grid_size, y // left.grid_size
+    left_over = left.particles.indices_in_area(grid_x, grid_x, grid_y, grid_y)
+    left_over = left_over[(left.particles.x[left_over] == x) & (left.particles.y[left_over] == y)]
+    assert left.particles.rgb[left_over].tolist() == [[255, 0, 0]] and left.particles.mass[left_over].tolist() == [1]
+
+
+def test_food_granted_to_a_cell_that_is_gone_goes_back(left):
+    x = float(left.max_x + 5)
+    cell = left.spawn_cell((x - 20, 30.0))
+    # the cell was released and reused from the pool before the answer came
+    left.pending_claims[0] = (cell, cell.id - 1, (0, x, 7.0, [0, 0, 255], 2))
+    mass = cell.mass
+    left.apply_answers([(0, True)])
+
+    assert cell.mass == mass
+    [food] = left.outgoing_food
+    assert food['x'].tolist() == [x] and food['rgb'].tolist() == [[0, 0, 255]] and food['mass'].tolist() == [2]
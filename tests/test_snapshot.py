@@ -0,0 +1,119 @@
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+import pytest
+
+import snapshot
+from chunks import DORMANT, EVICTED
+from game import Game
+
+
+def quiet(function, *args, **kwargs):
+    # cells print when they die or eat each other
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def configure(game):
+    game.chunk_manager.dormant_after = 5
+    game.chunk_manager.max_resident = 1
+    game.chunk_manager.collapse_after = 10
+
+
+@pytest.fixture
+def game():
+    """A world whose cells moved away from where they started, leaving dormant, evicted and collapsed food behind."""
+    game = quiet(Game, headless=True, num_chunks=(4, 1), spawn_player=False, seed=3)
+    configure(game)
+    chunk_width = game.chunk_size * game.grid_size
+    for _ in range(12):
+        game.spawn_cell((game.rng.spawn.uniform(0, chunk_width), game.rng.spawn.uniform(0, chunk_width)))
+    quiet(game.step, 20)
+    for cell in game.cells:
+        cell.body.position = cell.body.position[0] + 3 * chunk_width, cell.body.position[1]
+    quiet(game.step, 20)
+    yield game
+    game.chunk_manager.close()
+
+
+def load(path):
+    loaded = quiet(Game.from_settings, snapshot.read_meta(path)['settings'], headless=True)
+    configure(loaded)
+    snapshot.load(loaded, path)
+    return loaded
+
+
+def assert_same_columns(path, other_path):
+    columns, other = snapshot.read_columns(path, mmap=False), snapshot.read_columns(other_path, mmap=False)
+    assert columns.keys() == other.keys()
+    for name in columns:
+        assert np.array_equal(columns[name], other[name]), name
+
+
+def test_round_trip_restores_the_same_state(game, tmp_path):
+    states = {chunk.state for chunk in game.chunks.values()}
+    assert {DORMANT, EVICTED} <= states
+    assert game.chunk_manager.collapsed_mass.any()
+
+    snapshot.save(game, str(tmp_path / 'a'))
+    loaded = load(str(tmp_path / 'a'))
+    assert loaded.state_digest() == game.state_digest()
+    assert len(loaded.cells) == len(game.cells)
+
+    # saving the loaded game gives the same columns back
+    snapshot.save(loaded, str(tmp_path / 'b'))
+    assert_same_columns(str(tmp_path / 'a'), str(tmp_path / 'b'))
+    assert snapshot.read_meta(str(tmp_path / 'a'))['random'] == snapshot.read_meta(str(tmp_path / 'b'))['random']
+    loaded.chunk_manager.close()
+
+
+def test_evicted_chunks_are_read_after_capture(game, tmp_path):
+    columns, meta = snapshot.capture(game)
+    snapshot.save(game, str(tmp_path / 'now'))
+
+    # the game loop loads an evicted chunk back before the background writer gets to it
+    evicted = [chunk for chunk in game.chunks.values() if chunk.state == EVICTED]
+    path = evicted[0].path
+    game.chunk_manager.activate(evicted[0])
+    assert not os.path.exists(path)
+
+    snapshot.write(columns, meta, str(tmp_path / 'later'))
+    assert_same_columns(str(tmp_path / 'now'), str(tmp_path / 'later'))
+    # the links capture made are gone again
+    assert not [name for name in os.listdir(game.chunk_manager.chunk_dir) if name.endswith('.snapshot')]
+
+
+def test_write_keeps_the_previous_snapshot_until_the_new_one_is_in_place(game, tmp_path):
+    path = str(tmp_path / 'snap')
+    snapshot.save(game, path)
+    quiet(game.step, 2)
+    snapshot.save(game, path)
+    assert snapshot.read_meta(path)['tick_count'] == game.tick_count
+    assert sorted(os.listdir(tmp_path)) == ['snap']
+
+    # a crash between the two renames leaves only the previous snapshot, aside
+    os.rename(path, path + '.old')
+    assert snapshot.read_meta(path)['tick_count'] == game.tick_count
+    assert load(path).state_digest() == game.state_digest()
+
+
+def test_closing_the_game_finishes_a_snapshot_still_being_written(game, tmp_path, monkeypatch):
+    packed_columns = snapshot._packed_columns
+
+    def slow_packed_columns(packed):
+        # the writer thread is still busy when the game closes
+        time.sleep(0.2)
+        return packed_columns(packed)
+
+    monkeypatch.setattr(snapshot, '_packed_columns', slow_packed_columns)
+    path = str(tmp_path / 'snap')
+    expected = game.state_digest()
+    game.snapshots = snapshot.BackgroundSnapshots(path, every=1)
+    game.snapshots.update(game)
+    game.close()
+
+    assert not os.path.exists(path + '.partial')
+    assert load(path).state_digest() == expected
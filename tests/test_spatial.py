@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from spatial import SpatialHash
+
+NUM_COLUMNS, NUM_ROWS, GRID_SIZE = 7, 6, 10
+
+
+class FakeCell:
+    # what the spatial hash reads of a cell; hashed by identity like Cell
+    def __init__(self, position, detection_radius):
+        self.position = position
+        self.genome = SimpleNamespace(detection_radius=detection_radius)
+
+
+def random_world(seed, num_cells=40, num_particles=600):
+    rng = np.random.default_rng(seed)
+    spatial = SpatialHash(NUM_COLUMNS, NUM_ROWS, GRID_SIZE)
+    particles = spatial.particles
+    particles.add(rng.integers(0, NUM_COLUMNS * GRID_SIZE, num_particles), rng.integers(0, NUM_ROWS * GRID_SIZE, num_particles),
+                  np.eye(3, dtype=np.uint8)[rng.integers(0, 3, num_particles)] * 255)
+    particles.commit()
+    particles.remove(rng.choice(num_particles, num_particles // 5, replace=False))
+    particles.add(rng.integers(0, NUM_COLUMNS * GRID_SIZE, 50), rng.integers(0, NUM_ROWS * GRID_SIZE, 50), (255, 0, 0))
+    particles.commit()
+
+    # some cells sit outside the world, their neighbourhoods are cut off at the edges
+    cells = [FakeCell((float(x), float(y)), int(radius)) for x, y, radius in
+             zip(rng.uniform(-15, NUM_COLUMNS * GRID_SIZE + 15, num_cells), rng.uniform(-15, NUM_ROWS * GRID_SIZE + 15, num_cells),
+                 rng.integers(0, 3, num_cells))]
+    for cell in cells[:-5]:
+        spatial.insert(cell)
+    return spatial, cells
+
+
+def within(cell, grid_x, grid_y, grid_size=GRID_SIZE):
+    # the brute force neighbourhood test: grid coordinates within the cell's detection radius
+    cell_x, cell_y = int(cell.position[0] // grid_size), int(cell.position[1] // grid_size)
+    radius = cell.genome.detection_radius
+    return abs(grid_x - cell_x) <= radius and abs(grid_y - cell_y) <= radius
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_particle_pairs_match_brute_force(seed):
+    spatial, cells = random_world(seed)
+    particles = spatial.particles
+    pair_cells, pair_particles, pair_dist = spatial.particle_pairs(cells)
+
+    alive = np.flatnonzero(particles.alive[:particles.count]).tolist()
+    expected = {(i, p) for i, cell in enumerate(cells) for p in alive
+                if within(cell, particles.x[p] // GRID_SIZE, particles.y[p] // GRID_SIZE)}
+    pairs = list(zip(pair_cells.tolist(), pair_particles.tolist()))
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == expected
+
+    for i, p, dist in zip(pair_cells.tolist(), pair_particles.tolist(), pair_dist.tolist()):
+        dx, dy = particles.x[p] - cells[i].position[0], particles.y[p] - cells[i].position[1]
+        # the store keeps float32 positions
+        assert dist == pytest.approx(dx * dx + dy * dy, rel=1e-5, abs=1e-3)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_cell_pairs_match_brute_force(seed):
+    spatial, cells = random_world(seed)
+    pair_cells, pair_others = spatial.cell_pairs(cells)
+
+    # others are found through the bucket the hash keeps them in, cells not in the hash are never found
+    expected = {(i, j) for i, cell in enumerate(cells) for j, other in enumerate(cells)
+                if i != j and other in spatial and within(cell, *spatial.cell_bucket[other])}
+    pairs = list(zip(pair_cells.tolist(), pair_others.tolist()))
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == expected
+
+
+def test_moved_cells_are_found_in_their_new_bucket():
+    spatial, cells = random_world(0)
+    hashed = [cell for cell in cells if cell in spatial]
+    for cell in hashed[::2]:
+        cell.position = (cell.position[0] + 23.0, cell.position[1] - 17.0)
+        spatial.move(cell)
+
+    for cell in hashed:
+        assert cell in spatial.buckets[spatial.bucket_of(cell.position)]
+    assert sum(len(bucket) for bucket in spatial.buckets.values()) == len(spatial) == len(hashed)
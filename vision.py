@@ -0,0 +1,73 @@
+import numpy as np
+
+from particle import color_flags
+
+
+def perceive_color(color, perception):
+    """How a color looks to a cell with the given perception (ColorFlags).
+
+    Channels it can see are raised to the color's brightness, the others show the
+    brightness, so a cell that sees nothing sees shades of grey.
+    """
+    r, g, b = color
+    brightness = (r + g + b)//3
+
+    if perception["r"]:
+        if r < brightness:
+            r = brightness
+        vis_r = r
+    else:
+        vis_r = 0
+
+    if perception["g"]:
+        if g < brightness:
+            g = brightness
+        vis_g = g
+    else:
+        vis_g = 0
+
+    if perception["b"]:
+        if b < brightness:
+            b = brightness
+        vis_b = b
+    else:
+        vis_b = 0
+
+    rp = vis_r if vis_r != 0 else brightness
+    gp = vis_g if vis_g != 0 else brightness
+    bp = vis_b if vis_b != 0 else brightness
+
+    return rp, gp, bp
+
+
+def perceive_colors(rgb, perception):
+    """perceive_color for an (n, 3) array of colors at once, returns uint8 colors."""
+    rgb = np.asarray(rgb, np.int64).reshape(-1, 3)
+    brightness = rgb.sum(axis=1, keepdims=True) // 3
+    seen = color_flags(perception)[0]
+    return np.where(seen, np.maximum(rgb, brightness), brightness).astype(np.uint8)
+
+
+class PerceivedColors:
+    """perceive_color results by perception and rgb.
+
+    Perception only changes when the player's genome does (a split, a mutation or the
+    'c' toggle), so the table is only rebuilt then. It is cleared instead of growing past
+    max_size, the colors of cells drift as they eat.
+    """
+
+    max_size = 4096
+
+    def __init__(self):
+        self.perception = None
+        self.colors = {}
+
+    def get(self, perception, color):
+        if perception != self.perception or len(self.colors) >= self.max_size:
+            self.colors.clear()
+            self.perception = perception
+
+        perceived = self.colors.get(color)
+        if perceived is None:
+            perceived = self.colors[color] = perceive_color(color, perception)
+        return perceived